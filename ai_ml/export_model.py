@@ -0,0 +1,252 @@
+"""
+Export trained food recognition model for fast CPU inference
+Produces frozen TorchScript / ONNX artifacts with optional int8 quantization
+
+Usage:
+    python export_model.py --format onnx --quantize static   # recommended for CPU
+    python export_model.py --format torchscript --quantize dynamic
+
+Artifacts are written next to the checkpoint (best_model.onnx,
+best_model.int8.onnx, best_model.ts, best_model.int8.ts) where
+ProductionFoodRecognizer(backend='auto') picks up the fastest one.
+Each export also writes <artifact>.report.json with top-1 agreement and
+latency versus the fp32 eager model.
+"""
+
+import argparse
+import json
+import random
+import time
+from pathlib import Path
+from typing import Tuple
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader, Subset
+from torchvision import transforms
+from torchvision.datasets import ImageFolder
+
+from model_inference import BACKENDS, load_checkpoint_model
+
+
+# Configuration
+class Config:
+    MODEL_PATH = './models/best_model.pth'
+    VAL_DIR = './dataset/val'
+    INPUT_SIZE = 224
+    CALIBRATION_SAMPLES = 256
+    EVAL_SAMPLES = 500
+    BATCH_SIZE = 16
+    ONNX_OPSET = 17
+    SEED = 42
+
+
+def get_val_transform():
+    """Same preprocessing as validation and ProductionFoodRecognizer"""
+    return transforms.Compose([
+        transforms.Resize(256),
+        transforms.CenterCrop(Config.INPUT_SIZE),
+        transforms.ToTensor(),
+        transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+    ])
+
+
+def sample_loaders(val_dir: str, calibration_samples: int, eval_samples: int,
+                   seed: int) -> Tuple[DataLoader, DataLoader]:
+    """
+    Disjoint, reproducible calibration and evaluation samples of the validation set
+
+    One shuffle, split into [calibration | evaluation], so int8 accuracy is
+    never measured on images the quantizer was calibrated with. Pass
+    calibration_samples=0 when nothing is calibrated, so evaluation starts
+    at the first image.
+
+    Raises:
+        ValueError: if no images are left for evaluation
+    """
+    dataset = ImageFolder(val_dir, transform=get_val_transform())
+    indices = list(range(len(dataset)))
+    random.Random(seed).shuffle(indices)
+    calibration = Subset(dataset, indices[:calibration_samples])
+    evaluation = Subset(dataset, indices[calibration_samples:calibration_samples + eval_samples])
+    if len(evaluation) == 0:
+        raise ValueError(
+            f"No validation images left for evaluation: {val_dir} has {len(dataset)}, "
+            f"{len(calibration)} used for calibration"
+        )
+    return tuple(
+        DataLoader(subset, batch_size=Config.BATCH_SIZE, shuffle=False, num_workers=2)
+        for subset in (calibration, evaluation)
+    )
+
+
+def export_torchscript(model: nn.Module, output_path: Path, quantize: str):
+    """Trace and freeze the model, optionally with dynamic int8 Linear layers"""
+    if quantize == 'static':
+        raise ValueError("Static int8 quantization is supported for ONNX export only")
+    if quantize == 'dynamic':
+        model = torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+    example = torch.randn(1, 3, Config.INPUT_SIZE, Config.INPUT_SIZE)
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example)
+    frozen = torch.jit.freeze(traced.eval())
+    torch.jit.save(frozen, str(output_path))
+
+
+class ValidationCalibrationReader:
+    """Feeds validation batches to ONNX Runtime static quantization"""
+
+    def __init__(self, loader: DataLoader, input_name: str):
+        self.input_name = input_name
+        self._batches = iter(loader)
+
+    def get_next(self):
+        batch = next(self._batches, None)
+        if batch is None:
+            return None
+        images, _ = batch
+        return {self.input_name: images.numpy()}
+
+    def rewind(self):
+        pass
+
+
+def export_onnx(model: nn.Module, output_path: Path, quantize: str, calibration_loader: DataLoader = None):
+    """Export to ONNX with a dynamic batch axis, then optionally quantize to int8"""
+    fp32_path = output_path if quantize == 'none' else output_path.with_suffix('.fp32.onnx')
+    example = torch.randn(1, 3, Config.INPUT_SIZE, Config.INPUT_SIZE)
+    torch.onnx.export(
+        model,
+        example,
+        str(fp32_path),
+        input_names=['input'],
+        output_names=['logits'],
+        dynamic_axes={'input': {0: 'batch'}, 'logits': {0: 'batch'}},
+        opset_version=Config.ONNX_OPSET
+    )
+
+    if quantize == 'none':
+        return
+
+    from onnxruntime.quantization import QuantType, quantize_dynamic, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    prepared_path = output_path.with_suffix('.prep.onnx')
+    quant_pre_process(str(fp32_path), str(prepared_path))
+
+    if quantize == 'dynamic':
+        quantize_dynamic(str(prepared_path), str(output_path), weight_type=QuantType.QInt8)
+    else:
+        reader = ValidationCalibrationReader(calibration_loader, 'input')
+        quantize_static(
+            str(prepared_path),
+            str(output_path),
+            reader,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            per_channel=True
+        )
+
+    # Remove intermediates (and any external-data sidecar files next to them)
+    for path in (prepared_path, fp32_path):
+        path.unlink(missing_ok=True)
+        Path(f'{path}.data').unlink(missing_ok=True)
+
+
+def compare_with_fp32(reference: nn.Module, backend, loader: DataLoader) -> dict:
+    """Top-1 agreement and per-image latency of the exported backend vs fp32 eager"""
+    agree = 0
+    correct_ref = 0
+    correct_exported = 0
+    total = 0
+    ref_time = 0.0
+    exported_time = 0.0
+
+    with torch.no_grad():
+        for images, labels in loader:
+            start = time.perf_counter()
+            ref_pred = reference(images).argmax(dim=1)
+            ref_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            exported_pred = backend(images).argmax(dim=1)
+            exported_time += time.perf_counter() - start
+
+            agree += (ref_pred == exported_pred).sum().item()
+            correct_ref += (ref_pred == labels).sum().item()
+            correct_exported += (exported_pred == labels).sum().item()
+            total += labels.size(0)
+
+    if total == 0:
+        raise ValueError("Evaluation loader is empty: nothing to compare against fp32")
+    return {
+        'samples': total,
+        'top1_agreement': round(100. * agree / total, 2),
+        'fp32_accuracy': round(100. * correct_ref / total, 2),
+        'exported_accuracy': round(100. * correct_exported / total, 2),
+        'fp32_ms_per_image': round(1000 * ref_time / total, 3),
+        'exported_ms_per_image': round(1000 * exported_time / total, 3),
+        'speedup': round(ref_time / exported_time, 2) if exported_time else None,
+    }
+
+
+def main():
+    """Main export function"""
+    parser = argparse.ArgumentParser(description='Export food recognition model for CPU inference')
+    parser.add_argument('--model-path', default=Config.MODEL_PATH)
+    parser.add_argument('--val-dir', default=Config.VAL_DIR)
+    parser.add_argument('--format', choices=['torchscript', 'onnx'], default='onnx')
+    parser.add_argument('--quantize', choices=['none', 'dynamic', 'static'], default='none')
+    parser.add_argument('--calibration-samples', type=int, default=Config.CALIBRATION_SAMPLES)
+    parser.add_argument('--eval-samples', type=int, default=Config.EVAL_SAMPLES)
+    args = parser.parse_args()
+
+    torch.manual_seed(Config.SEED)
+    np.random.seed(Config.SEED)
+    device = torch.device('cpu')
+    model = load_checkpoint_model(args.model_path, device)
+
+    suffix = {'torchscript': '.ts', 'onnx': '.onnx'}[args.format]
+    if args.quantize != 'none':
+        suffix = '.int8' + suffix
+    output_path = Path(args.model_path).with_suffix('')
+    output_path = output_path.with_name(output_path.name + suffix)
+
+    # Calibrate on a different slice of the validation set than we evaluate on
+    # (only static quantization calibrates; otherwise evaluate from the start)
+    calibration_samples = args.calibration_samples if args.quantize == 'static' else 0
+    calibration_loader, eval_loader = sample_loaders(
+        args.val_dir, calibration_samples, args.eval_samples, Config.SEED
+    )
+
+    print(f'Exporting {args.format} (quantize={args.quantize}) -> {output_path}')
+    if args.format == 'torchscript':
+        export_torchscript(model, output_path, args.quantize)
+    else:
+        export_onnx(model, output_path, args.quantize,
+                    calibration_loader if args.quantize == 'static' else None)
+
+    # Measure agreement with the fp32 model before anyone ships this
+    backend = BACKENDS[args.format](str(output_path), device)
+    report = compare_with_fp32(model, backend, eval_loader)
+    report.update({
+        'artifact': str(output_path),
+        'format': args.format,
+        'quantize': args.quantize,
+    })
+
+    report_path = Path(f'{output_path}.report.json')
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"Top-1 agreement with fp32: {report['top1_agreement']:.2f}%")
+    print(f"Accuracy fp32 {report['fp32_accuracy']:.2f}% | exported {report['exported_accuracy']:.2f}%")
+    print(f"Latency fp32 {report['fp32_ms_per_image']}ms | exported {report['exported_ms_per_image']}ms "
+          f"({report['speedup']}x)")
+    print(f'✓ Report saved to {report_path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -9,79 +9,360 @@ from torchvision import transforms, models
 from PIL import Image
 import io
 import json
-from typing import List, Tuple, Dict
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, List, Tuple, Dict, Optional, Union
 import numpy as np
 
+# Works both as part of a package (the backend) and as a script from ai_ml/
+try:
+    from .nutrition_table import DEFAULT_TABLE_PATH, FIELDS as NUTRITION_FIELDS, open_table
+except ImportError:
+    from nutrition_table import DEFAULT_TABLE_PATH, FIELDS as NUTRITION_FIELDS, open_table
+
+# ONNX Runtime is optional - only needed for exported .onnx artifacts
+try:
+    import onnxruntime as ort
+    HAS_ONNXRUNTIME = True
+except ImportError:
+    HAS_ONNXRUNTIME = False
+
+
+def build_model(num_classes: int) -> nn.Module:
+    """EfficientNetV2-S with the food classifier head used in training"""
+    model = models.efficientnet_v2_s(weights=None)
+    in_features = model.classifier[1].in_features
+    model.classifier = nn.Sequential(
+        nn.Dropout(p=0.3),
+        nn.Linear(in_features, num_classes)
+    )
+    return model
+
+
+def load_checkpoint_model(model_path: str, device: torch.device) -> nn.Module:
+    """Load the fp32 eager model from a training checkpoint"""
+    checkpoint = torch.load(model_path, map_location=device)
+    model = build_model(len(checkpoint.get('class_names', [])))
+    model.load_state_dict(checkpoint['model_state_dict'])
+    model = model.to(device)
+    model.eval()
+    return model
+
+
+class EagerBackend:
+    """fp32 eager PyTorch model loaded from the training checkpoint"""
+    
+    name = 'eager'
+    
+    def __init__(self, model_path: str, device: torch.device):
+        self.device = device
+        self.model = load_checkpoint_model(model_path, device)
+    
+    def __call__(self, batch: torch.Tensor) -> torch.Tensor:
+        with torch.no_grad():
+            return self.model(batch.to(self.device))
+
+
+class TorchScriptBackend:
+    """Frozen TorchScript artifact produced by export_model.py"""
+    
+    name = 'torchscript'
+    
+    def __init__(self, model_path: str, device: torch.device):
+        self.device = device
+        self.model = torch.jit.load(model_path, map_location=device)
+        self.model.eval()
+    
+    def __call__(self, batch: torch.Tensor) -> torch.Tensor:
+        with torch.no_grad():
+            return self.model(batch.to(self.device))
+
+
+class OnnxBackend:
+    """ONNX Runtime session over an artifact produced by export_model.py"""
+    
+    name = 'onnx'
+    
+    def __init__(self, model_path: str, device: torch.device):
+        if not HAS_ONNXRUNTIME:
+            raise ImportError("onnxruntime is required for the ONNX backend")
+        self.session = ort.InferenceSession(model_path, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+    
+    def __call__(self, batch: torch.Tensor) -> torch.Tensor:
+        logits = self.session.run(None, {self.input_name: batch.cpu().numpy()})[0]
+        return torch.from_numpy(logits)
+
+
+BACKENDS = {
+    'eager': EagerBackend,
+    'torchscript': TorchScriptBackend,
+    'onnx': OnnxBackend,
+}
+
+# Artifact suffixes written by export_model.py, fastest first
+ARTIFACT_PREFERENCE = [
+    ('onnx', '.int8.onnx'),
+    ('torchscript', '.int8.ts'),
+    ('onnx', '.onnx'),
+    ('torchscript', '.ts'),
+]
+
+
+def select_backend(model_path: str, backend: str = 'auto', device: torch.device = None):
+    """
+    Load an inference backend
+    
+    `model_path` is the training checkpoint (e.g. best_model.pth). With
+    backend='auto' the fastest exported artifact found next to it is used,
+    falling back to the eager fp32 model. With an explicit backend name,
+    `model_path` may also point directly at that backend's artifact.
+    """
+    device = device or torch.device('cpu')
+    if backend != 'auto':
+        return BACKENDS[backend](model_path, device)
+    
+    stem = Path(model_path).with_suffix('')
+    for name, suffix in ARTIFACT_PREFERENCE:
+        artifact = Path(f"{stem}{suffix}")
+        if not artifact.exists():
+            continue
+        if name == 'onnx' and not HAS_ONNXRUNTIME:
+            continue
+        print(f"[Inference] Using {name} artifact {artifact}")
+        return BACKENDS[name](str(artifact), device)
+    
+    return EagerBackend(model_path, device)
+
+
+class QueueFullError(Exception):
+    """Raised when the batching queue is at capacity"""
+
+
+class MicroBatchScheduler:
+    """
+    Dynamic micro-batching in front of a batched inference function
+    
+    Concurrent requests are queued and grouped into batches of up to
+    `max_batch_size`, waiting at most `max_wait_ms` after the first request
+    of a batch arrives. Each batch is run in one call on a dedicated thread
+    and every caller gets back its own result.
+    """
+    
+    def __init__(self, infer_fn: Callable[[List[Any]], List[Any]],
+                 max_batch_size: int = 16, max_wait_ms: float = 5.0,
+                 max_queue_size: int = 256):
+        self.infer_fn = infer_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_queue_size = max_queue_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        # One thread: batches run back to back, torch parallelizes inside the op
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='inference')
+        
+        # Metrics
+        self.requests = 0
+        self.rejected = 0
+        self.batches = 0
+        self.batched_items = 0
+        self.max_observed_batch = 0
+        self.total_infer_time = 0.0
+        self.total_queue_wait = 0.0
+    
+    def _ensure_started(self):
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+    
+    async def submit(self, item: Any) -> Any:
+        """Queue one item and wait for its result"""
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((item, future, time.perf_counter()))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise QueueFullError(f"Inference queue full ({self.max_queue_size} pending)")
+        self.requests += 1
+        return await future
+    
+    async def _collect_batch(self) -> List[Tuple[Any, asyncio.Future, float]]:
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect_batch()
+            # Drop requests whose callers already gave up
+            batch = [entry for entry in batch if not entry[1].cancelled()]
+            if not batch:
+                continue
+            
+            started = time.perf_counter()
+            self.total_queue_wait += sum(started - queued_at for _, _, queued_at in batch)
+            try:
+                results = await loop.run_in_executor(
+                    self._executor, self.infer_fn, [item for item, _, _ in batch]
+                )
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            finally:
+                self.total_infer_time += time.perf_counter() - started
+            
+            self.batches += 1
+            self.batched_items += len(batch)
+            self.max_observed_batch = max(self.max_observed_batch, len(batch))
+            for (_, future, _), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+    
+    def get_stats(self) -> Dict:
+        """Batching configuration and throughput metrics"""
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000,
+            'max_queue_size': self.max_queue_size,
+            'queue_length': self._queue.qsize() if self._queue else 0,
+            'requests': self.requests,
+            'rejected': self.rejected,
+            'batches': self.batches,
+            'avg_batch_size': round(self.batched_items / self.batches, 2) if self.batches else 0.0,
+            'max_observed_batch': self.max_observed_batch,
+            'avg_infer_ms': round(1000 * self.total_infer_time / self.batches, 2) if self.batches else 0.0,
+            'avg_queue_wait_ms': round(1000 * self.total_queue_wait / self.batched_items, 2) if self.batched_items else 0.0,
+        }
+
 
 class ProductionFoodRecognizer:
     """Production-ready food recognition service"""
     
-    def __init__(self, model_path: str, class_names_path: str):
+    RESIZE = 256
+    INPUT_SIZE = 224
+    MEAN = [0.485, 0.456, 0.406]
+    STD = [0.229, 0.224, 0.225]
+    # Detected-food keys for the nutrition table columns ('calories_per_100g' -> 'calories')
+    NUTRIENT_KEYS = [field.split('_per_')[0] for field in NUTRITION_FIELDS]
+    
+    def __init__(self, model_path: str, class_names_path: str,
+                 max_batch_size: int = 16, max_wait_ms: float = 5.0,
+                 max_queue_size: int = 256, top_k: int = 5,
+                 backend: str = 'auto', nutrition_table_path: str = DEFAULT_TABLE_PATH):
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-        self.model = self._load_model(model_path)
+        self.model = self._load_model(model_path, backend)
         self.class_names = self._load_class_names(class_names_path)
         self.transform = self._get_transform()
-        self.nutrition_db = self._load_nutrition_db()
-    
-    def _load_model(self, model_path: str) -> nn.Module:
-        """Load trained model"""
-        checkpoint = torch.load(model_path, map_location=self.device)
-        
-        # Initialize model architecture
-        model = models.efficientnet_v2_s(pretrained=False)
-        num_classes = len(checkpoint.get('class_names', []))
-        in_features = model.classifier[1].in_features
-        model.classifier = nn.Sequential(
-            nn.Dropout(p=0.3),
-            nn.Linear(in_features, num_classes)
+        # ToTensor + Normalize folded into one multiply-add per channel
+        std = torch.tensor(self.STD).view(3, 1, 1)
+        self._norm_scale = 1.0 / (255.0 * std)
+        self._norm_bias = -torch.tensor(self.MEAN).view(3, 1, 1) / std
+        self.nutrition_table = self._load_nutrition_table(nutrition_table_path)
+        self.top_k = top_k
+        self.batcher = MicroBatchScheduler(
+            self._predict_batch,
+            max_batch_size=max_batch_size,
+            max_wait_ms=max_wait_ms,
+            max_queue_size=max_queue_size
         )
-        
-        # Load weights
-        model.load_state_dict(checkpoint['model_state_dict'])
-        model = model.to(self.device)
-        model.eval()
-        
-        return model
+    
+    def _load_model(self, model_path: str, backend: str = 'auto'):
+        """Load the inference backend (exported artifact or eager checkpoint)"""
+        return select_backend(model_path, backend, self.device)
     
     def _load_class_names(self, path: str) -> List[str]:
         """Load food class names"""
         with open(path, 'r') as f:
             return json.load(f)
     
-    def _load_nutrition_db(self) -> Dict:
-        """Load nutrition database"""
-        with open('nutrition_db.json', 'r') as f:
-            return json.load(f)
+    def _load_nutrition_table(self, path: str):
+        """Memory-map the per-class nutrition table (compiled from nutrition_db.json if needed)"""
+        return open_table(path, self.class_names)
     
     def _get_transform(self):
-        """Preprocessing transform"""
+        """Geometric preprocessing (resize + center crop) for raw images"""
         return transforms.Compose([
-            transforms.Resize(256),
-            transforms.CenterCrop(224),
-            transforms.ToTensor(),
-            transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+            transforms.Resize(self.RESIZE),
+            transforms.CenterCrop(self.INPUT_SIZE),
         ])
     
-    async def analyze_image(self, image_bytes: bytes) -> Tuple[List[Dict], float]:
+    def _to_tensor(self, image: Image.Image) -> torch.Tensor:
+        """HWC uint8 RGB crop -> normalized CHW float tensor in a single pass"""
+        array = np.asarray(image, dtype=np.float32)
+        tensor = torch.from_numpy(array).permute(2, 0, 1).contiguous()
+        return tensor.mul_(self._norm_scale).add_(self._norm_bias)
+    
+    def _preprocess(self, image: Union[bytes, Image.Image]) -> Tuple[Tuple[int, int], torch.Tensor]:
         """
-        Analyze food image and return detected foods
+        Turn one image into a model input tensor
         
-        Returns:
-            (detected_foods, overall_confidence)
+        Accepts raw bytes or an already decoded RGB image. A decoded image of
+        exactly INPUT_SIZE x INPUT_SIZE (e.g. the backend's
+        ProcessedImage.model_input) is used as-is without resizing.
         """
-        # Load and preprocess image
-        image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
-        input_tensor = self.transform(image).unsqueeze(0).to(self.device)
+        if isinstance(image, (bytes, bytearray)):
+            image = Image.open(io.BytesIO(image))
+            # Full size for portion estimates; draft() below shrinks image.size
+            original_size = image.size
+            if image.format == 'JPEG':
+                # Decode at reduced scale when the image is much larger than needed
+                image.draft('RGB', (self.RESIZE, self.RESIZE))
+        else:
+            original_size = image.size
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
         
-        # Inference
+        if image.size != (self.INPUT_SIZE, self.INPUT_SIZE):
+            image = self.transform(image)
+        return original_size, self._to_tensor(image)
+    
+    def _predict_batch(self, tensors: List[torch.Tensor]) -> List[Tuple[List[float], List[int]]]:
+        """Run one forward pass over a batch and split top-k back per image"""
+        batch = torch.stack(tensors)
         with torch.no_grad():
-            outputs = self.model(input_tensor)
+            outputs = self.model(batch)
             probabilities = torch.nn.functional.softmax(outputs, dim=1)
-            top5_prob, top5_idx = torch.topk(probabilities, 5)
+            top_prob, top_idx = torch.topk(probabilities, min(self.top_k, probabilities.shape[1]))
+        return list(zip(top_prob.cpu().tolist(), top_idx.cpu().tolist()))
+    
+    def get_stats(self) -> Dict:
+        """Batching scheduler metrics"""
+        return self.batcher.get_stats()
+    
+    async def analyze_image(self, image: Union[bytes, Image.Image],
+                            image_size: Optional[Tuple[int, int]] = None) -> Tuple[List[Dict], float]:
+        """
+        Analyze food image and return detected foods
+        
+        Args:
+            image: Raw image bytes, or an already decoded RGB image
+            image_size: Size of the full photo when `image` is a model-sized crop
+        
+        Returns:
+            (detected_foods, overall_confidence)
+        """
+        # Transform off the event loop, then join the next batch
+        loop = asyncio.get_running_loop()
+        decoded_size, input_tensor = await loop.run_in_executor(None, self._preprocess, image)
+        top_probs, top_indices = await self.batcher.submit(input_tensor)
         
         # Get top prediction
-        top_prob = top5_prob[0][0].item()
-        top_idx = top5_idx[0][0].item()
+        top_prob = top_probs[0]
+        top_idx = top_indices[0]
         
         if top_prob < 0.85:
             # Low confidence
@@ -89,36 +370,32 @@ class ProductionFoodRecognizer:
         
         # Get food details
         food_name = self.class_names[top_idx]
-        nutrition = self.nutrition_db.get(food_name, {})
         
         # Estimate portion size (simple heuristic for now)
-        portion_grams = self._estimate_portion_size(image)
+        portion_grams = self._estimate_portion_size(image_size or decoded_size)
         
-        # Calculate nutrition for portion
+        # Calculate nutrition for portion (one row of the table, scaled)
+        per_100g = self.nutrition_table.row(top_idx)
+        portion = (per_100g * (portion_grams / 100)).tolist()
         detected_food = {
             'name': food_name.title(),
             'confidence': top_prob,
-            'calories': nutrition.get('calories_per_100g', 0) * (portion_grams / 100),
-            'protein': nutrition.get('protein_per_100g', 0) * (portion_grams / 100),
-            'carbs': nutrition.get('carbs_per_100g', 0) * (portion_grams / 100),
-            'fats': nutrition.get('fats_per_100g', 0) * (portion_grams / 100),
-            'fiber': nutrition.get('fiber_per_100g', 0) * (portion_grams / 100),
-            'sugar': nutrition.get('sugar_per_100g', 0) * (portion_grams / 100),
-            'sodium': nutrition.get('sodium_per_100g', 0) * (portion_grams / 100),
+            # float32 storage: round off the representation noise
+            **{key: round(value, 2) for key, value in zip(self.NUTRIENT_KEYS, portion)},
             'portion': f"{portion_grams}g",
             'weight_grams': portion_grams
         }
         
         return [detected_food], top_prob
     
-    def _estimate_portion_size(self, image: Image.Image) -> float:
+    def _estimate_portion_size(self, image_size: Tuple[int, int]) -> float:
         """
-        Estimate portion size from image
+        Estimate portion size from image dimensions
         TODO: Implement depth-based estimation or object detection
         """
         # Simple heuristic based on image analysis
         # In production, use a separate portion estimation model
-        width, height = image.size
+        width, height = image_size
         area = width * height
         
         # Rough estimation (needs improvement)
@@ -142,7 +419,10 @@ class AIFoodRecognitionService:
             model_path='./models/best_model.pth',
             class_names_path='./models/class_names.json'
         )
+        # Ask ImageService for the 224x224 crop alongside the stored JPEG
+        self.model_input_size = ProductionFoodRecognizer.INPUT_SIZE
     
-    async def analyze_image(self, image_bytes: bytes):
-        return await self.model.analyze_image(image_bytes)
+    async def analyze_image(self, image: ProcessedImage):
+        # The upload was decoded once in ImageService; no second decode here
+        return await self.model.analyze_image(image.model_input, image_size=image.size)
 """
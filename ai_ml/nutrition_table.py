@@ -0,0 +1,196 @@
+"""
+Compact, memory-mapped nutrition table indexed by class id
+
+`nutrition_db.json` (food name -> {"calories_per_100g": ..., ...}) is
+compiled once into a fixed-width binary file whose row i holds the
+per-100g nutrients of class i as float32. Readers memory-map the file, so
+DataLoader workers and server processes share one page-cache copy and a
+lookup is a single array index.
+
+File layout (little-endian):
+    header   32 bytes  magic, version, rows, fields, names offset/length
+    values   rows x fields float32
+    present  rows uint8 (0 = class missing from nutrition_db.json)
+    names    UTF-8 JSON {"fields": [...], "class_names": [...]}
+
+Usage:
+    python nutrition_table.py --db nutrition_db.json --classes models/class_names.json
+    python nutrition_table.py --db nutrition_db.json --classes models/best_model.pth
+"""
+
+import argparse
+import json
+import os
+import struct
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+MAGIC = b'NUTRTBL\x00'
+VERSION = 1
+HEADER = struct.Struct('<8sIIIQI')  # magic, version, rows, fields, names_offset, names_length
+HEADER_SIZE = 32
+
+# Columns, in file order (keys of each nutrition_db.json entry)
+FIELDS = [
+    'calories_per_100g',
+    'protein_per_100g',
+    'carbs_per_100g',
+    'fats_per_100g',
+    'fiber_per_100g',
+    'sugar_per_100g',
+    'sodium_per_100g',
+]
+
+DEFAULT_TABLE_PATH = './models/nutrition_table.bin'
+
+
+def load_class_names(path: str) -> List[str]:
+    """Class names from a class_names.json list or a training checkpoint"""
+    if path.endswith('.json'):
+        with open(path, 'r') as f:
+            return json.load(f)
+    import torch
+    checkpoint = torch.load(path, map_location='cpu', weights_only=False)
+    return list(checkpoint['class_names'])
+
+
+def compile_table(nutrition_db: Dict[str, Dict], class_names: List[str], output_path: str) -> int:
+    """
+    Write the binary table for `class_names` (row i = class i)
+
+    Returns the number of classes that had no nutrition entry (stored as zeros).
+    """
+    rows = len(class_names)
+    values = np.zeros((rows, len(FIELDS)), dtype='<f4')
+    present = np.zeros(rows, dtype=np.uint8)
+    for class_id, name in enumerate(class_names):
+        entry = nutrition_db.get(name)
+        if entry is None:
+            continue
+        present[class_id] = 1
+        values[class_id] = [float(entry.get(field, 0) or 0) for field in FIELDS]
+
+    names = json.dumps({'fields': FIELDS, 'class_names': class_names}).encode('utf-8')
+    names_offset = HEADER_SIZE + values.nbytes + present.nbytes
+
+    # Write to a temp file and rename so readers never map a half-written table
+    tmp_path = f'{output_path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, rows, len(FIELDS), names_offset, len(names)).ljust(HEADER_SIZE, b'\x00'))
+        f.write(values.tobytes())
+        f.write(present.tobytes())
+        f.write(names)
+    os.replace(tmp_path, output_path)
+    return int(rows - present.sum())
+
+
+class NutritionTable:
+    """Read-only, memory-mapped view of a compiled nutrition table"""
+
+    def __init__(self, path: str):
+        self.path = str(path)
+        with open(self.path, 'rb') as f:
+            magic, version, rows, fields, names_offset, names_length = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f'{self.path} is not a version {VERSION} nutrition table')
+            f.seek(names_offset)
+            names = json.loads(f.read(names_length).decode('utf-8'))
+
+        self.rows = rows
+        self.fields: List[str] = names['fields']
+        self.class_names: List[str] = names['class_names']
+        self._values = None
+        self._present = None
+
+    def _map(self):
+        self._values = np.memmap(self.path, dtype='<f4', mode='r', offset=HEADER_SIZE,
+                                 shape=(self.rows, len(self.fields)))
+        self._present = np.memmap(self.path, dtype=np.uint8, mode='r',
+                                  offset=HEADER_SIZE + self._values.nbytes, shape=(self.rows,))
+
+    @property
+    def values(self) -> np.ndarray:
+        """(rows, fields) float32 array backed by the file"""
+        if self._values is None:
+            self._map()
+        return self._values
+
+    def row(self, class_id: int) -> np.ndarray:
+        """Per-100g nutrients of one class, in FIELDS order (read-only view)"""
+        return self.values[class_id]
+
+    def has(self, class_id: int) -> bool:
+        if self._present is None:
+            self._map()
+        return bool(self._present[class_id])
+
+    def get(self, class_id: int) -> Dict[str, float]:
+        """Row as a {field: value} dict (the old nutrition_db.json entry shape)"""
+        return dict(zip(self.fields, self.row(class_id).tolist()))
+
+    def check_classes(self, class_names: List[str]):
+        """Fail loudly if the table was compiled for a different class list"""
+        if list(class_names) != self.class_names:
+            raise ValueError(
+                f'{self.path} was compiled for a different class list; '
+                f'recompile it with nutrition_table.py'
+            )
+
+    def __len__(self) -> int:
+        return self.rows
+
+    # Pickled into DataLoader workers: ship the path, re-map on first use
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_values'] = None
+        state['_present'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+
+def open_table(table_path: str = DEFAULT_TABLE_PATH, class_names: Optional[List[str]] = None,
+               db_path: str = 'nutrition_db.json') -> NutritionTable:
+    """
+    Open the compiled table, compiling it from nutrition_db.json first if it
+    is missing (or stale relative to the JSON file)
+    """
+    table = Path(table_path)
+    db = Path(db_path)
+    stale = db.exists() and table.exists() and db.stat().st_mtime > table.stat().st_mtime
+    if (not table.exists() or stale) and class_names is not None and db.exists():
+        with open(db, 'r') as f:
+            missing = compile_table(json.load(f), list(class_names), str(table))
+        print(f'✓ Compiled {table} ({len(class_names)} classes, {missing} without nutrition data)')
+
+    nutrition_table = NutritionTable(str(table))
+    if class_names is not None:
+        nutrition_table.check_classes(class_names)
+    return nutrition_table
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compile nutrition_db.json into a memory-mapped table')
+    parser.add_argument('--db', default='nutrition_db.json')
+    parser.add_argument('--classes', default='./models/class_names.json',
+                        help='class_names.json or a training checkpoint (.pth)')
+    parser.add_argument('--out', default=DEFAULT_TABLE_PATH)
+    args = parser.parse_args()
+
+    with open(args.db, 'r') as f:
+        nutrition_db = json.load(f)
+    class_names = load_class_names(args.classes)
+    missing = compile_table(nutrition_db, class_names, args.out)
+
+    print(f'✓ Wrote {args.out}: {len(class_names)} classes x {len(FIELDS)} fields '
+          f'({os.path.getsize(args.out)} bytes)')
+    if missing:
+        print(f'⚠ {missing} classes have no entry in {args.db} (stored as zeros)')
+
+
+if __name__ == '__main__':
+    main()
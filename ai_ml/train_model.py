@@ -11,9 +11,10 @@ from torchvision import transforms, models
 from torchvision.datasets import ImageFolder
 from tqdm import tqdm
 import wandb
-import json
 from pathlib import Path
 
+from nutrition_table import open_table
+
 # Configuration
 class Config:
     # Model
@@ -30,6 +31,8 @@ class Config:
     # Paths
     DATA_DIR = './dataset'
     SAVE_DIR = './models'
+    NUTRITION_DB = 'nutrition_db.json'
+    NUTRITION_TABLE = './models/nutrition_table.bin'
     
     # Device
     DEVICE = 'cuda' if torch.cuda.is_available() else 'cpu'
@@ -62,20 +65,20 @@ class FoodDataset(Dataset):
     
     def __init__(self, root_dir, transform=None):
         self.dataset = ImageFolder(root_dir, transform=transform)
-        self.nutrition_db = self._load_nutrition_db()
+        self.nutrition_table = self._load_nutrition_table()
     
-    def _load_nutrition_db(self):
-        # Load nutrition database
-        with open('nutrition_db.json', 'r') as f:
-            return json.load(f)
+    def _load_nutrition_table(self):
+        # Memory-mapped: DataLoader workers share the page cache instead of copying dicts
+        Path(Config.NUTRITION_TABLE).parent.mkdir(parents=True, exist_ok=True)
+        return open_table(Config.NUTRITION_TABLE, self.dataset.classes, Config.NUTRITION_DB)
     
     def __len__(self):
         return len(self.dataset)
     
     def __getitem__(self, idx):
         image, label = self.dataset[idx]
-        food_name = self.dataset.classes[label]
-        nutrition = self.nutrition_db.get(food_name, {})
+        # Per-100g nutrients in nutrition_table.FIELDS order (float32)
+        nutrition = torch.tensor(self.nutrition_table.row(label))
         
         return {
             'image': image,
@@ -0,0 +1,125 @@
+"""
+Backfill derived columns on existing food scans
+
+Usage:
+    python -m app.cli.backfill --counts
+    python -m app.cli.backfill --rollups
+    python -m app.cli.backfill --derivatives
+"""
+import argparse
+import asyncio
+import time
+from pathlib import Path
+from sqlalchemy import select, update
+from app.config import settings
+from app.database import AsyncSessionLocal, async_engine
+from app.models import FoodScan
+from app.services.image_service import derivative_path, image_service
+from app.services.rollup_service import rollup_service
+
+
+async def backfill_counts(chunk_size: int) -> int:
+    """Fill food_scans.detected_foods_count from the detected_foods blob"""
+    updated = 0
+    last_id = 0
+    async with AsyncSessionLocal() as db:
+        while True:
+            result = await db.execute(
+                select(FoodScan.id, FoodScan.detected_foods)
+                .where(FoodScan.id > last_id)
+                .order_by(FoodScan.id)
+                .limit(chunk_size)
+            )
+            rows = result.all()
+            if not rows:
+                break
+            
+            await db.execute(
+                update(FoodScan),
+                [
+                    {"id": scan_id, "detected_foods_count": len(detected_foods or [])}
+                    for scan_id, detected_foods in rows
+                ]
+            )
+            await db.commit()
+            updated += len(rows)
+            last_id = rows[-1].id
+    return updated
+
+
+async def backfill_derivatives(chunk_size: int, write_missing: bool) -> int:
+    """
+    Fill food_scans.image_derivatives from the derivative files on disk
+
+    With `write_missing`, uploads that have no derivatives yet get them written
+    first. Returns the number of scans updated.
+    """
+    updated = 0
+    last_id = 0
+    async with AsyncSessionLocal() as db:
+        while True:
+            result = await db.execute(
+                select(FoodScan.id, FoodScan.image_url)
+                .where(FoodScan.id > last_id, FoodScan.image_derivatives.is_(None))
+                .order_by(FoodScan.id)
+                .limit(chunk_size)
+            )
+            rows = result.all()
+            if not rows:
+                break
+            
+            values = []
+            for scan_id, image_url in rows:
+                if not image_url.startswith("/uploads/"):
+                    continue
+                file_path = str(Path(settings.UPLOAD_DIR) / image_url.removeprefix("/uploads/"))
+                names = [
+                    name for name in settings.IMAGE_DERIVATIVE_SIZES
+                    if Path(derivative_path(file_path, name, settings.IMAGE_DERIVATIVE_FORMAT)).exists()
+                ]
+                if not names and write_missing and Path(file_path).exists():
+                    try:
+                        names = list(await image_service.write_derivatives(file_path))
+                    except Exception as e:
+                        print(f"[WARN] Scan {scan_id}: writing derivatives failed: {e}")
+                if names:
+                    values.append({"id": scan_id, "image_derivatives": sorted(names)})
+            
+            if values:
+                await db.execute(update(FoodScan), values)
+                await db.commit()
+            updated += len(values)
+            last_id = rows[-1].id
+    return updated
+
+
+async def main(args):
+    start_time = time.time()
+    try:
+        if args.counts:
+            updated = await backfill_counts(args.chunk_size)
+            print(f"[OK] detected_foods_count backfilled for {updated} scans")
+        if args.rollups:
+            async with AsyncSessionLocal() as db:
+                scans_read, rows_written = await rollup_service.rebuild(db, args.chunk_size)
+            print(f"[OK] Rebuilt {rows_written} daily rollups from {scans_read} scans")
+        if args.derivatives:
+            updated = await backfill_derivatives(args.chunk_size, args.write_missing)
+            print(f"[OK] image_derivatives backfilled for {updated} scans")
+    finally:
+        await async_engine.dispose()
+    print(f"[OK] Done in {time.time() - start_time:.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill derived food scan data")
+    parser.add_argument("--counts", action="store_true", help="Fill detected_foods_count")
+    parser.add_argument("--rollups", action="store_true", help="Rebuild daily_nutrition from food_scans")
+    parser.add_argument("--derivatives", action="store_true", help="Fill image_derivatives from files on disk")
+    parser.add_argument("--write-missing", action="store_true",
+                        help="With --derivatives, also write derivatives for uploads that have none")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args()
+    if not (args.counts or args.rollups or args.derivatives):
+        parser.error("Nothing to do: pass --counts, --rollups and/or --derivatives")
+    asyncio.run(main(args))
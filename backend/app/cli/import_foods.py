@@ -0,0 +1,374 @@
+"""
+Bulk import of nutrition datasets into food_items
+
+Streams CSV, JSON (top-level array) or NDJSON, validates each record and
+upserts on the food name in large batches:
+  - PostgreSQL: COPY into a temporary staging table, then one
+    INSERT ... SELECT ... ON CONFLICT (name) DO UPDATE per batch
+  - SQLite: executemany of INSERT ... ON CONFLICT per batch
+
+Each batch commits in its own transaction and then records the number of
+source records consumed in a checkpoint file, so an interrupted import
+can be resumed with --resume without reprocessing earlier batches.
+
+Usage:
+    python -m app.cli.import_foods data/foods.csv
+    python -m app.cli.import_foods data/foods.ndjson --batch-size 50000 --rejects rejects.ndjson
+    python -m app.cli.import_foods data/foods.json --resume
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+from app.database import async_engine, init_db
+import app.models  # noqa: F401  (registers the tables init_db creates)
+
+
+# Target columns, in COPY / INSERT order
+FLOAT_COLUMNS = ["calories_per_100g", "protein", "carbs", "fats", "fiber", "sugar", "sodium"]
+TEXT_COLUMNS = {"name": 255, "category": 100, "region": 50, "description": None, "common_serving_size": 100}
+JSON_COLUMNS = ["vitamins", "minerals"]
+COLUMNS = ["name", "category", *FLOAT_COLUMNS, "vitamins", "minerals", "region",
+           "dietary_tags", "description", "common_serving_size"]
+
+# Source field aliases seen in public datasets (and database/SETUP_GUIDE.md)
+ALIASES = {
+    "calories": "calories_per_100g",
+    "energy_kcal": "calories_per_100g",
+    "protein_per_100g": "protein",
+    "carbs_per_100g": "carbs",
+    "carbohydrates": "carbs",
+    "fats_per_100g": "fats",
+    "fat": "fats",
+    "fiber_per_100g": "fiber",
+    "fibre": "fiber",
+    "sugar_per_100g": "sugar",
+    "sugars": "sugar",
+    "sodium_per_100g": "sodium",
+    "tags": "dietary_tags",
+    "serving_size": "common_serving_size",
+}
+
+STAGING_TABLE = "food_items_import"
+
+
+class RowError(ValueError):
+    """A source record that can't be imported"""
+
+
+# ---- readers ---------------------------------------------------------------
+
+def iter_csv(path: str) -> Iterator[Dict]:
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        yield from csv.DictReader(f)
+
+
+def iter_ndjson(path: str) -> Iterator[Dict]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def iter_json_array(path: str, chunk_size: int = 1 << 20) -> Iterator[Dict]:
+    """Yield the elements of a top-level JSON array without loading the whole file"""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    started = False
+    with open(path, encoding="utf-8") as f:
+        while True:
+            # Skip whitespace and separators between elements
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if not started and position < len(buffer):
+                if buffer[position] != "[":
+                    raise ValueError("JSON input must be a top-level array")
+                started = True
+                position += 1
+                continue
+            if position < len(buffer) and buffer[position] == "]":
+                return
+
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    if buffer[position:].strip():
+                        raise
+                    return
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+            yield item
+            position = end
+
+
+READERS = {"csv": iter_csv, "ndjson": iter_ndjson, "jsonl": iter_ndjson, "json": iter_json_array}
+
+
+# ---- validation ------------------------------------------------------------
+
+def _float(value, field: str) -> Optional[float]:
+    if value is None or value == "":
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise RowError(f"{field}: not a number ({value!r})")
+    if number != number or number < 0:
+        raise RowError(f"{field}: must be a non-negative number")
+    return number
+
+
+def _tags(value) -> Optional[List[str]]:
+    if value is None or value == "":
+        return None
+    if isinstance(value, str):
+        value = value.replace("|", ";").replace(",", ";").split(";")
+    if not isinstance(value, list):
+        raise RowError("dietary_tags: expected a list or ';'-separated string")
+    tags = [str(tag).strip().lower() for tag in value if str(tag).strip()]
+    return tags or None
+
+
+def _json_object(value, field: str) -> Optional[Dict]:
+    if value is None or value == "":
+        return None
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError:
+            raise RowError(f"{field}: invalid JSON")
+    if not isinstance(value, dict):
+        raise RowError(f"{field}: expected an object")
+    return value
+
+
+def validate_record(record: Dict) -> Dict:
+    """Map a source record onto food_items columns, raising RowError if invalid"""
+    if not isinstance(record, dict):
+        raise RowError("record is not an object")
+    source = {ALIASES.get(key.strip().lower(), key.strip().lower()): value
+              for key, value in record.items() if key}
+
+    row = {}
+    for column, max_length in TEXT_COLUMNS.items():
+        value = source.get(column)
+        value = str(value).strip() if value not in (None, "") else None
+        if value and max_length and len(value) > max_length:
+            raise RowError(f"{column}: longer than {max_length} characters")
+        row[column] = value
+    if not row["name"]:
+        raise RowError("name: required")
+
+    for column in FLOAT_COLUMNS:
+        row[column] = _float(source.get(column), column)
+    if row["calories_per_100g"] is None:
+        raise RowError("calories_per_100g: required")
+
+    for column in JSON_COLUMNS:
+        row[column] = _json_object(source.get(column), column)
+
+    tags = _tags(source.get("dietary_tags")) or []
+    # Boolean flags used by some datasets
+    for flag, tag in (("is_vegetarian", "veg"), ("is_vegan", "vegan")):
+        if str(source.get(flag, "")).strip().lower() in ("1", "true", "yes") and tag not in tags:
+            tags.append(tag)
+    row["dietary_tags"] = tags or None
+    return row
+
+
+# ---- checkpoints -----------------------------------------------------------
+
+def load_checkpoint(path: str, source: str) -> int:
+    """Number of source records already imported from this exact file"""
+    if not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        checkpoint = json.load(f)
+    stat = os.stat(source)
+    if checkpoint.get("source") != os.path.abspath(source) or checkpoint.get("size") != stat.st_size:
+        raise SystemExit(f"Checkpoint {path} belongs to a different input file; delete it to start over")
+    return checkpoint["records_done"]
+
+
+def save_checkpoint(path: str, source: str, records_done: int):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({
+            "source": os.path.abspath(source),
+            "size": os.stat(source).st_size,
+            "records_done": records_done,
+        }, f)
+    os.replace(tmp_path, path)
+
+
+# ---- writers ---------------------------------------------------------------
+
+def to_records(rows: List[Dict], json_columns: List[str]) -> List[tuple]:
+    """Rows -> driver parameter tuples in COLUMNS order, JSON-encoding json_columns"""
+    return [
+        tuple(json.dumps(row[c]) if c in json_columns and row[c] is not None else row[c] for c in COLUMNS)
+        for row in rows
+    ]
+
+
+async def upsert_sqlite(conn, rows: List[Dict]):
+    # Straight to the driver's executemany: no per-row statement compilation or bind processing
+    raw = await conn.get_raw_connection()
+    updates = ", ".join(f"{c} = excluded.{c}" for c in COLUMNS if c != "name")
+    await raw.driver_connection.executemany(
+        f"INSERT INTO food_items ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))}) "
+        f"ON CONFLICT (name) DO UPDATE SET {updates}",
+        to_records(rows, JSON_COLUMNS + ["dietary_tags"])
+    )
+
+
+async def upsert_postgres(conn, rows: List[Dict]):
+    raw = await conn.get_raw_connection()
+    driver = raw.driver_connection
+    await driver.execute(
+        f"CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE} AS "
+        f"SELECT {', '.join(COLUMNS)} FROM food_items WITH NO DATA"
+    )
+    await driver.copy_records_to_table(STAGING_TABLE, records=to_records(rows, JSON_COLUMNS), columns=COLUMNS)
+
+    column_list = ", ".join(COLUMNS)
+    updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in COLUMNS if c != "name")
+    await driver.execute(
+        f"INSERT INTO food_items ({column_list}) SELECT {column_list} FROM {STAGING_TABLE} "
+        f"ON CONFLICT (name) DO UPDATE SET {updates}"
+    )
+    await driver.execute(f"TRUNCATE {STAGING_TABLE}")
+
+
+async def write_batch(conn, upsert, rows: List[Dict], consumed: int) -> Tuple[int, int]:
+    """Upsert one batch in its own transaction; returns (rows_written, records_consumed)"""
+    if rows:
+        async with conn.begin():
+            await upsert(conn, rows)
+    return len(rows), consumed
+
+
+def batches(records: Iterator[Dict], batch_size: int, first_record: int, stats: Dict,
+            rejects) -> Iterator[Tuple[List[Dict], int]]:
+    """
+    Group valid rows into batches
+
+    Yields (rows, records_consumed). Duplicate names within a batch keep the
+    last occurrence, since one upsert statement can't touch a row twice.
+    """
+    pending: Dict[str, Dict] = {}
+    consumed = 0
+    for number, record in enumerate(records, first_record):
+        consumed += 1
+        try:
+            row = validate_record(record)
+        except RowError as e:
+            stats["rejected"] += 1
+            if rejects:
+                rejects.write(json.dumps({"record": number, "error": str(e), "data": record}, default=str) + "\n")
+            continue
+        pending.pop(row["name"], None)
+        pending[row["name"]] = row
+        if len(pending) >= batch_size:
+            yield list(pending.values()), consumed
+            pending = {}
+            consumed = 0
+    if pending or consumed:
+        yield list(pending.values()), consumed
+
+
+async def import_foods(path: str, file_format: str, batch_size: int, checkpoint_path: str,
+                       resume: bool, rejects_path: Optional[str] = None) -> Dict:
+    """Stream a dataset into food_items; returns counters for the run"""
+    stats = {"read": 0, "skipped": 0, "upserted": 0, "rejected": 0}
+    skip = load_checkpoint(checkpoint_path, path) if resume else 0
+    stats["skipped"] = skip
+
+    records = READERS[file_format](path)
+    for _ in range(skip):
+        if next(records, None) is None:
+            break
+
+    # Also adds uq_food_items_name to older tables; the upserts conflict on it
+    await init_db()
+    dialect = async_engine.dialect.name
+    upsert = upsert_postgres if dialect == "postgresql" else upsert_sqlite
+
+    rejects = open(rejects_path, "a", encoding="utf-8") if rejects_path else None
+    start = time.perf_counter()
+    writing: Optional[asyncio.Task] = None
+    try:
+        async with async_engine.connect() as conn:
+            pending = batches(records, batch_size, skip + 1, stats, rejects)
+            while True:
+                # Parse/validate the next batch in a thread while the previous one is written
+                batch = await asyncio.to_thread(next, pending, None)
+                if writing is not None:
+                    written, consumed = await writing
+                    writing = None
+                    stats["read"] += consumed
+                    stats["upserted"] += written
+                    save_checkpoint(checkpoint_path, path, skip + stats["read"])
+
+                    elapsed = time.perf_counter() - start
+                    print(f"[IMPORT] {skip + stats['read']} records, {stats['upserted']} upserted "
+                          f"({stats['read'] / elapsed:.0f} rows/s), {stats['rejected']} rejected")
+                if batch is None:
+                    break
+                writing = asyncio.create_task(write_batch(conn, upsert, *batch))
+    finally:
+        if writing is not None:
+            writing.cancel()
+        if rejects:
+            rejects.close()
+
+    stats["seconds"] = time.perf_counter() - start
+    # Finished: a later run starts from the top again
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return stats
+
+
+def detect_format(path: str) -> str:
+    extension = os.path.splitext(path)[1].lstrip(".").lower()
+    if extension not in READERS:
+        raise SystemExit(f"Can't infer format from '{path}', pass --format")
+    return extension
+
+
+async def main(args):
+    try:
+        stats = await import_foods(
+            args.path,
+            args.format or detect_format(args.path),
+            args.batch_size,
+            args.checkpoint or f"{args.path}.checkpoint",
+            args.resume,
+            args.rejects
+        )
+    finally:
+        await async_engine.dispose()
+
+    rate = stats["read"] / stats["seconds"] if stats["seconds"] > 0 else 0
+    print(f"[OK] Imported {stats['upserted']} foods from {stats['read']} records in "
+          f"{stats['seconds']:.1f}s ({rate:.0f} rows/s); {stats['rejected']} rejected"
+          + (f", resumed after {stats['skipped']}" if stats["skipped"] else ""))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk import a nutrition dataset into food_items")
+    parser.add_argument("path", help="CSV, JSON (array) or NDJSON file")
+    parser.add_argument("--format", choices=sorted(READERS), help="Defaults to the file extension")
+    parser.add_argument("--batch-size", type=int, default=20000)
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: <path>.checkpoint)")
+    parser.add_argument("--resume", action="store_true", help="Skip records already imported per the checkpoint")
+    parser.add_argument("--rejects", help="Append rejected records with their errors to this NDJSON file")
+    asyncio.run(main(parser.parse_args()))
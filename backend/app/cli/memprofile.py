@@ -0,0 +1,98 @@
+"""
+Measure memory per stage of the image path on sample uploads
+
+Runs each image through ImageService.save_image (and, with --analyze, the
+AI service's analyze_image) one at a time under tracemalloc, so every
+stage's traced peak and allocation sites belong to that stage alone. Stored
+files are deleted afterwards.
+
+Usage:
+    python -m app.cli.memprofile photo.jpg
+    python -m app.cli.memprofile uploads/*.jpg --repeat 5 --frames 10 --top 5
+    python -m app.cli.memprofile photo.jpg --analyze --json
+"""
+import argparse
+import asyncio
+import json
+import os
+from app.config import settings
+from app.services.ai_service import ai_service
+from app.services.image_service import image_service
+from app.services.memory_profiler import memory_profiler
+
+
+def format_bytes(value: int) -> str:
+    for unit in ("B", "KB", "MB"):
+        if abs(value) < 1024:
+            return f"{value:.0f}{unit}"
+        value /= 1024
+    return f"{value:.1f}GB"
+
+
+def print_report(report: dict, top: int):
+    print(f"\n{'stage':<28}{'runs':>6}{'traced peak avg':>18}{'max':>10}{'rss delta avg':>16}{'max':>10}")
+    for name, stats in report["stages"].items():
+        peak = stats["traced_peak_bytes"]
+        rss = stats["rss_delta_bytes"]
+        print(f"{name:<28}{stats['samples']:>6}{format_bytes(peak['avg']):>18}{format_bytes(peak['max']):>10}"
+              f"{format_bytes(rss['avg']):>16}{format_bytes(rss['max']):>10}")
+
+    if top:
+        for name, stats in report["stages"].items():
+            if not stats["top_sites"]:
+                continue
+            print(f"\n{name}: allocations held at stage end (avg of {stats['snapshots']} runs)")
+            for site in stats["top_sites"]:
+                print(f"  {format_bytes(site['avg_bytes']):>8} {site['avg_blocks']:>8} blocks  {site['site']}")
+
+    print(f"\n[OK] RSS {format_bytes(report['rss_bytes'])}, peak RSS {format_bytes(report['peak_rss_bytes'])}, "
+          f"tracemalloc overhead {format_bytes(report['tracemalloc_overhead_bytes'])}")
+
+
+async def main(args):
+    # Stages in a process pool would run untraced in the child processes
+    settings.IMAGE_EXECUTOR = "thread"
+    memory_profiler.enabled = True
+    memory_profiler.snapshot_every = args.snapshot_every
+    memory_profiler.start(args.frames)
+
+    stored = []
+    try:
+        for path in args.images:
+            with open(path, "rb") as f:
+                data = f.read()
+            for _ in range(args.repeat):
+                processed = await image_service.save_image(
+                    data, os.path.basename(path), model_input_size=ai_service.model_input_size
+                )
+                stored.append(processed.file_path)
+                if args.analyze:
+                    with memory_profiler.stage("analyze_image", unit=True):
+                        await ai_service.analyze_image(processed)
+                del processed
+        report = memory_profiler.get_report(args.top)
+    finally:
+        memory_profiler.stop()
+        for file_path in stored:
+            image_service.delete_image(file_path)
+        image_service.executor.shutdown()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report, args.top)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-stage memory of the image pipeline")
+    parser.add_argument("images", nargs="+", help="Image files to process")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per image")
+    parser.add_argument("--frames", type=int, default=settings.MEMORY_PROFILER_FRAMES,
+                        help="Traceback depth kept per allocation")
+    parser.add_argument("--snapshot-every", type=int, default=1,
+                        help="Allocation-site snapshots every N runs of a stage (0 = off)")
+    parser.add_argument("--top", type=int, default=5, help="Allocation sites per stage")
+    parser.add_argument("--analyze", action="store_true",
+                        help="Also run analyze_image (calls the configured AI service)")
+    parser.add_argument("--json", action="store_true", help="Print the raw report")
+    asyncio.run(main(parser.parse_args()))
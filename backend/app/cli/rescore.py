@@ -0,0 +1,112 @@
+"""
+Re-score existing food scans after a change to the nutrition scoring rules
+
+Streams food_scans in id order through NutritionService.score_batch and
+rewrites health_score, dietary_tags and ai_insights. Totals that changed
+are rewritten too, and the daily_nutrition rollups are adjusted by the
+difference in the same transaction.
+
+Usage:
+    python -m app.cli.rescore
+    python -m app.cli.rescore --chunk-size 5000 --dry-run
+"""
+import argparse
+import asyncio
+import time
+from types import SimpleNamespace
+from sqlalchemy import select, update
+from app.database import AsyncSessionLocal, async_engine
+from app.models import FoodScan
+from app.services.nutrition_service import NUTRIENT_TOTALS, nutrition_service
+from app.services.rollup_service import rollup_service
+
+
+TOTAL_FIELDS = [field for _, field in NUTRIENT_TOTALS]
+
+
+async def rescore(chunk_size: int, dry_run: bool = False) -> dict:
+    """Re-score all scans; returns counters for the run"""
+    stats = {"scanned": 0, "changed": 0, "totals_changed": 0}
+    last_id = 0
+    columns = [getattr(FoodScan, field) for field in TOTAL_FIELDS]
+
+    async with AsyncSessionLocal() as db:
+        while True:
+            result = await db.execute(
+                select(
+                    FoodScan.id,
+                    FoodScan.user_id,
+                    FoodScan.created_at,
+                    FoodScan.detected_foods,
+                    FoodScan.health_score,
+                    FoodScan.dietary_tags,
+                    FoodScan.ai_insights,
+                    *columns
+                )
+                .where(FoodScan.id > last_id)
+                .order_by(FoodScan.id)
+                .limit(chunk_size)
+            )
+            rows = result.all()
+            if not rows:
+                break
+
+            batch = nutrition_service.score_batch(
+                *nutrition_service.build_batch_columns([row.detected_foods for row in rows]),
+                num_scans=len(rows)
+            )
+
+            changes = []
+            old_totals = []
+            new_totals = []
+            for i, row in enumerate(rows):
+                values = {
+                    "health_score": batch.health_score(i),
+                    "dietary_tags": batch.dietary_tags(i),
+                    "ai_insights": batch.ai_insights(i),
+                }
+                totals = batch.nutrition(i)
+                if any(getattr(row, field) != totals[field] for field in TOTAL_FIELDS):
+                    values.update(totals)
+                    stats["totals_changed"] += 1
+                    old_totals.append(row)
+                    new_totals.append(SimpleNamespace(user_id=row.user_id, created_at=row.created_at, **totals))
+
+                if any(getattr(row, key) != value for key, value in values.items()):
+                    changes.append({"id": row.id, **values})
+
+            if changes and not dry_run:
+                await db.execute(update(FoodScan), changes)
+                if old_totals:
+                    # Swap each scan's old totals for the new ones in its day's rollup
+                    await rollup_service.apply_scans(db, old_totals, sign=-1)
+                    await rollup_service.apply_scans(db, new_totals)
+                await db.commit()
+
+            stats["scanned"] += len(rows)
+            stats["changed"] += len(changes)
+            last_id = rows[-1].id
+    return stats
+
+
+async def main(args):
+    start_time = time.time()
+    try:
+        stats = await rescore(args.chunk_size, args.dry_run)
+    finally:
+        await async_engine.dispose()
+
+    elapsed = time.time() - start_time
+    rate = stats["scanned"] / elapsed if elapsed > 0 else 0
+    action = "would change" if args.dry_run else "changed"
+    print(f"[OK] Re-scored {stats['scanned']} scans ({rate:.0f} scans/s), {action} {stats['changed']}")
+    if stats["totals_changed"]:
+        verb = "would change" if args.dry_run else "changed, daily rollups updated"
+        print(f"[OK] Totals {verb} on {stats['totals_changed']} scans")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-score food scans with the current nutrition rules")
+    parser.add_argument("--chunk-size", type=int, default=2000)
+    parser.add_argument("--dry-run", action="store_true", help="Report changes without writing them")
+    asyncio.run(main(parser.parse_args()))
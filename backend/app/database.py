@@ -1,51 +1,120 @@
 """
 Database connection and session management
 """
-from sqlalchemy import create_engine
+from typing import List
+from sqlalchemy import inspect, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.schema import CreateColumn
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
 from app.config import settings
 
+
+def get_async_database_url(url: str) -> str:
+    """Map a sync DATABASE_URL onto its async driver (aiosqlite / asyncpg)"""
+    if url.startswith("sqlite:"):
+        return url.replace("sqlite:", "sqlite+aiosqlite:", 1)
+    if url.startswith("postgres://"):
+        return url.replace("postgres://", "postgresql+asyncpg://", 1)
+    if url.startswith("postgresql://") or url.startswith("postgresql+psycopg2://"):
+        return "postgresql+asyncpg://" + url.split("://", 1)[1]
+    return url
+
+
 # Create database engine
-# Create database engine
-connect_args = {}
+# Async drivers keep request handlers from blocking the event loop on DB I/O
 if settings.DATABASE_URL.startswith("sqlite"):
-    connect_args = {"check_same_thread": False}
-    # Remove Postgres-specific args for SQLite
-    engine = create_engine(
-        settings.DATABASE_URL,
-        connect_args=connect_args,
+    async_engine = create_async_engine(
+        get_async_database_url(settings.DATABASE_URL),
         echo=settings.DEBUG
     )
 else:
-    engine = create_engine(
-        settings.DATABASE_URL,
-        pool_pre_ping=True,
-        pool_size=10,
-        max_overflow=20,
+    async_engine = create_async_engine(
+        get_async_database_url(settings.DATABASE_URL),
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
         echo=settings.DEBUG
     )
 
-# Session factory
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Async session factory (objects stay usable after commit)
+AsyncSessionLocal = async_sessionmaker(
+    async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False
+)
 
 # Base class for models
 Base = declarative_base()
 
 
-def get_db():
+async def get_db():
     """
-    Dependency function to get database session
-    Usage: db: Session = Depends(get_db)
+    Dependency function to get an async database session
+    Usage: db: AsyncSession = Depends(get_db)
     """
-    db = SessionLocal()
-    try:
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
-def init_db():
+# Columns and indexes added to existing tables after their first release.
+# create_all only creates missing tables, so init_db adds these in place.
+ADDED_COLUMNS = [
+    ("food_scans", "image_phash"),
+    ("food_scans", "detected_foods_count"),  # Filled by COLUMN_BACKFILLS below
+    ("food_scans", "image_derivatives"),  # Fill with python -m app.cli.backfill --derivatives
+]
+ADDED_INDEXES = [
+    ("food_items", "uq_food_items_name"),  # Bulk imports upsert on it
+    ("food_scans", "ix_food_scans_image_phash"),
+    ("food_scans", "ix_food_scans_user_created"),
+]
+
+# Per-dialect UPDATE run right after a column is added, so existing rows get
+# real values instead of the column default
+COLUMN_BACKFILLS = {
+    ("food_scans", "detected_foods_count"): {
+        "postgresql": (
+            "UPDATE food_scans SET detected_foods_count = CASE WHEN jsonb_typeof(detected_foods) = 'array' "
+            "THEN jsonb_array_length(detected_foods) ELSE 0 END"
+        ),
+        "sqlite": "UPDATE food_scans SET detected_foods_count = COALESCE(json_array_length(detected_foods), 0)",
+    },
+}
+
+
+def upgrade_schema(conn) -> List[str]:
+    """Add missing ADDED_COLUMNS / ADDED_INDEXES to existing tables (idempotent)"""
+    inspector = inspect(conn)
+    added = []
+    for table_name, column_name in ADDED_COLUMNS:
+        existing = {column["name"] for column in inspector.get_columns(table_name)}
+        if column_name in existing:
+            continue
+        column = Base.metadata.tables[table_name].c[column_name]
+        ddl = CreateColumn(column).compile(dialect=conn.dialect)
+        conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {ddl}"))
+        backfill = COLUMN_BACKFILLS.get((table_name, column_name), {}).get(conn.dialect.name)
+        if backfill:
+            conn.execute(text(backfill))
+        added.append(f"{table_name}.{column_name}")
+    for table_name, index_name in ADDED_INDEXES:
+        existing = {index["name"] for index in inspector.get_indexes(table_name)}
+        if index_name in existing:
+            continue
+        index = next(index for index in Base.metadata.tables[table_name].indexes if index.name == index_name)
+        index.create(conn)
+        added.append(index_name)
+    return added
+
+
+async def init_db():
     """Initialize database tables"""
-    Base.metadata.create_all(bind=engine)
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        added = await conn.run_sync(upgrade_schema)
+    if added:
+        print(f"✅ Database schema upgraded: added {', '.join(added)}")
     print("✅ Database tables created successfully")
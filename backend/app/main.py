@@ -2,13 +2,24 @@
 CalorAI Backend - FastAPI Application
 Premium AI-powered food calorie tracking API
 """
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import JSONResponse, PlainTextResponse
 from app.config import settings
-from app.database import init_db
-from app.routers import auth, food, chat
+from app.database import init_db, AsyncSessionLocal, async_engine
+from app.static_files import ImmutableStaticFiles
+from app.routers import auth, food, chat, admin
+from app.services.ai_service import ai_service
+from app.services.cache_service import analysis_cache, chat_cache
+from app.services.phash_index import phash_index, warm_phash_index
+from app.services.image_service import image_service
+from app.services.food_index import food_index
+from app.services.rate_limiter import rate_limiter
+from app.services.admission import analysis_admission
+from app.workers.analysis_worker import analysis_workers
+from app.services.profiler import profile_manager
+from app.services.memory_profiler import memory_profiler
+from app.services.metrics import metrics, flatten_stats, http_request_seconds, http_requests_in_flight
 import time
 import os
 
@@ -21,6 +32,56 @@ app = FastAPI(
     redoc_url="/redoc"
 )
 
+# Reject oversized upload bodies before (Content-Length) or while (chunked) they are received
+class LimitUploadSize:
+    """
+    413 for request bodies larger than the upload limit
+
+    Declared sizes are rejected before any of the body is read. Bodies
+    without a Content-Length (chunked) are counted as they stream in and cut
+    off as soon as they pass the limit, before Starlette has spooled the rest.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        # Batch analysis carries several images; each is still size-checked on its own
+        max_upload = settings.MAX_UPLOAD_SIZE
+        if scope["path"].endswith("/food/analyze/batch"):
+            max_upload *= settings.ANALYZE_BATCH_MAX_IMAGES
+        # Allow some headroom for multipart boundaries and form fields
+        max_body = max_upload + 64 * 1024
+        detail = f"Request body exceeds maximum allowed size of {max_upload} bytes"
+
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > max_body:
+            response = JSONResponse(status_code=413, content={"detail": detail})
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_body:
+                    # Raised inside body parsing; FastAPI passes HTTPExceptions through as-is
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+# Innermost: an exception raised from receive() inside BaseHTTPMiddleware's
+# task group would reach FastAPI as an ExceptionGroup (400) instead of a 413
+app.add_middleware(LimitUploadSize)
+
+
 # CORS Middleware
 app.add_middleware(
     CORSMiddleware,
@@ -34,23 +95,64 @@ app.add_middleware(
 # Request timing middleware
 @app.middleware("http")
 async def add_process_time_header(request: Request, call_next):
-    """Add response time header to all requests"""
+    """Add response time header to all requests and record per-route latency"""
     start_time = time.time()
-    response = await call_next(request)
+    http_requests_in_flight.inc()
+    try:
+        response = await call_next(request)
+    finally:
+        http_requests_in_flight.dec()
     process_time = time.time() - start_time
     response.headers["X-Process-Time"] = str(process_time)
+    # Route template (e.g. /api/food/analysis/{scan_id}) keeps label cardinality bounded
+    route = request.scope.get("route")
+    http_request_seconds.observe(
+        process_time, request.method, getattr(route, "path", "unmatched"), str(response.status_code)
+    )
     return response
 
 
-# Mount static files (for uploaded images)
+# Request-driven profiling (only installed when the profiler is enabled)
+if settings.PROFILER_ENABLED:
+    @app.middleware("http")
+    async def profile_requests(request: Request, call_next):
+        """Sample while armed paths (or requests sent with X-Profile) are in flight"""
+        session = profile_manager.claim_request(request.url.path, request.headers.get("x-profile"))
+        if session is None:
+            return await call_next(request)
+        try:
+            response = await call_next(request)
+        finally:
+            profile_manager.release_request(session)
+        response.headers["X-Profile-Id"] = session.id
+        return response
+
+
+# Per-request memory tracking (only installed when the memory profiler is enabled)
+if settings.MEMORY_PROFILER_ENABLED:
+    @app.middleware("http")
+    async def track_request_memory(request: Request, call_next):
+        """Record RSS growth, traced peak and (sampled) allocation sites per route"""
+        scope, token = memory_profiler.begin_request(request.method, request.url.path)
+        route = None
+        try:
+            response = await call_next(request)
+            route = request.scope.get("route")
+            return response
+        finally:
+            memory_profiler.end_request(scope, token, f"{request.method} {getattr(route, 'path', 'unmatched')}")
+
+
+# Mount static files (for uploaded images; immutable, cacheable, range-capable)
 if os.path.exists(settings.UPLOAD_DIR):
-    app.mount("/uploads", StaticFiles(directory=settings.UPLOAD_DIR), name="uploads")
+    app.mount("/uploads", ImmutableStaticFiles(directory=settings.UPLOAD_DIR), name="uploads")
 
 
 # Include routers
 app.include_router(auth.router, prefix=settings.API_V1_PREFIX)
 app.include_router(food.router, prefix=settings.API_V1_PREFIX)
 app.include_router(chat.router, prefix=settings.API_V1_PREFIX)
+app.include_router(admin.router)
 
 
 # Root endpoint
@@ -65,6 +167,46 @@ async def root():
     }
 
 
+def component_stats() -> dict:
+    """Stats of every service, as reported on /health and /metrics"""
+    return {
+        "ai_stats": ai_service.get_stats(),
+        "analysis_cache": analysis_cache.get_stats(),
+        "chat_cache": chat_cache.get_stats(),
+        "phash_index": phash_index.get_stats(),
+        "image_pipeline": image_service.get_stats(),
+        "food_index": food_index.get_stats(),
+        "rate_limiter": rate_limiter.get_stats(),
+        "analysis_admission": analysis_admission.get_stats(),
+        "analysis_workers": analysis_workers.get_stats(),
+        "memory": memory_profiler.get_stats()
+    }
+
+
+def db_pool_stats() -> dict:
+    """Connection pool usage (pools without these counters report nothing)"""
+    pool = async_engine.pool
+    stats = {}
+    for state in ("size", "checkedin", "checkedout", "overflow"):
+        counter = getattr(pool, state, None)
+        if callable(counter):
+            stats[(state,)] = counter()
+    return stats
+
+
+# Scrape-time gauges: read existing counters, nothing extra on the request path
+metrics.gauge(
+    "component_stat", "Numeric stats reported by each service (as on /health)",
+    ("component", "stat"),
+    collect=lambda: {
+        (component, stat): value
+        for component, stats in component_stats().items()
+        for stat, value in flatten_stats(stats).items()
+    }
+)
+metrics.gauge("db_pool_connections", "Database connection pool usage", ("state",), collect=db_pool_stats)
+
+
 # Health check
 @app.get("/health")
 async def health_check():
@@ -73,10 +215,18 @@ async def health_check():
         "status": "healthy",
         "environment": settings.ENVIRONMENT,
         "database": "connected",
-        "ai_service": "ready"
+        "ai_service": "ready",
+        **component_stats()
     }
 
 
+if settings.METRICS_ENABLED:
+    @app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+    async def prometheus_metrics():
+        """Prometheus text exposition of request, stage and service metrics"""
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 # Global exception handler
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
@@ -109,11 +259,34 @@ async def startup_event():
     
     # Initialize database
     try:
-        init_db()
+        await init_db()
         print("[OK] Database initialized")
     except Exception as e:
         print(f"[WARN] Database initialization warning: {e}")
     
+    # Rebuild the near-duplicate index from recent scans
+    try:
+        async with AsyncSessionLocal() as db:
+            loaded = await warm_phash_index(phash_index, db)
+        print(f"[OK] Near-duplicate index loaded ({loaded} recent scans)")
+    except Exception as e:
+        print(f"[WARN] Near-duplicate index warm-up skipped: {e}")
+    
+    # Load the food name index and keep it fresh in the background
+    try:
+        async with AsyncSessionLocal() as db:
+            loaded = await food_index.refresh(db)
+        print(f"[OK] Food name index loaded ({loaded} foods)")
+    except Exception as e:
+        print(f"[WARN] Food name index load skipped: {e}")
+    food_index.start_refresher(AsyncSessionLocal)
+    
+    if settings.MEMORY_PROFILER_ENABLED:
+        memory_profiler.start()
+    
+    # Run queued analysis jobs in this process too (ANALYSIS_WORKERS=0 leaves them to separate workers)
+    analysis_workers.start()
+    
     print(f"[OK] API Documentation: http://localhost:8000/docs")
     print(f"[OK] Health Check: http://localhost:8000/health")
     print("="*60 + "\n")
@@ -124,6 +297,8 @@ async def startup_event():
 async def shutdown_event():
     """Cleanup on shutdown"""
     print("\n[SHUTDOWN] Find Your Food Backend shutting down...")
+    await analysis_workers.stop()
+    await food_index.stop_refresher()
 
 
 if __name__ == "__main__":
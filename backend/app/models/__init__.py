@@ -4,5 +4,7 @@ Models package - exports all database models
 from app.models.user import User
 from app.models.food_scan import FoodScan
 from app.models.food_item import FoodItem
+from app.models.daily_nutrition import DailyNutrition
+from app.models.analysis_job import AnalysisJob
 
-__all__ = ["User", "FoodScan", "FoodItem"]
+__all__ = ["User", "FoodScan", "FoodItem", "DailyNutrition", "AnalysisJob"]
@@ -0,0 +1,47 @@
+"""
+Analysis job model for queued (asynchronous) food analysis
+"""
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, ForeignKey, Index
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.sql import func
+from datetime import datetime, timezone
+from app.database import Base
+
+
+class AnalysisJob(Base):
+    __tablename__ = "analysis_jobs"
+    __table_args__ = (
+        # Serves the worker claim query (oldest runnable job first)
+        Index("ix_analysis_jobs_status_available", "status", "available_at"),
+    )
+
+    id = Column(String(32), primary_key=True)  # uuid4 hex (not guessable)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+
+    # Stored upload (already compressed by the HTTP tier)
+    image_path = Column(String(500), nullable=False)
+    image_url = Column(String(500), nullable=False)
+    image_phash = Column(BigInteger)  # 64-bit dHash (signed)
+
+    # Queue state: queued -> running -> succeeded | failed
+    status = Column(String(16), nullable=False, default="queued")
+    attempts = Column(Integer, nullable=False, default=0)
+    available_at = Column(DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc))  # Retry backoff
+    worker_id = Column(String(64))  # Worker holding the lease
+    lease_expires_at = Column(DateTime(timezone=True))  # Running jobs past this are reclaimed
+
+    # Outcome
+    scan_id = Column(Integer, ForeignKey("food_scans.id", ondelete="SET NULL"))
+    error = Column(JSONB)  # {"error": ..., "message": ...} when failed
+
+    # Metadata
+    created_at = Column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        default=lambda: datetime.now(timezone.utc)
+    )
+    started_at = Column(DateTime(timezone=True))
+    finished_at = Column(DateTime(timezone=True))
+
+    def __repr__(self):
+        return f"<AnalysisJob {self.id} - {self.status}>"
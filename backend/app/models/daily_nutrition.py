@@ -0,0 +1,34 @@
+"""
+Daily nutrition rollup model (per user, per UTC day)
+"""
+from sqlalchemy import Column, Integer, Float, Date, DateTime, ForeignKey, UniqueConstraint
+from sqlalchemy.sql import func
+from app.database import Base
+
+
+class DailyNutrition(Base):
+    __tablename__ = "daily_nutrition"
+    __table_args__ = (
+        # One row per user per day; also serves date range scans for summaries
+        UniqueConstraint("user_id", "day", name="uq_daily_nutrition_user_day"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    day = Column(Date, nullable=False)  # UTC date of the scans
+    
+    # Running totals, maintained on every scan insert/delete
+    scan_count = Column(Integer, nullable=False, default=0)
+    total_calories = Column(Float, nullable=False, default=0)
+    total_protein = Column(Float, nullable=False, default=0)
+    total_carbs = Column(Float, nullable=False, default=0)
+    total_fats = Column(Float, nullable=False, default=0)
+    total_fiber = Column(Float, nullable=False, default=0)
+    total_sugar = Column(Float, nullable=False, default=0)
+    total_sodium = Column(Float, nullable=False, default=0)
+    
+    # Metadata
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    
+    def __repr__(self):
+        return f"<DailyNutrition user={self.user_id} {self.day} - {self.total_calories}cal>"
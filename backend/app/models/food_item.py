@@ -1,16 +1,20 @@
 """
 Food Item model for nutrition database
 """
-from sqlalchemy import Column, Integer, String, Float, Text, ARRAY
+from sqlalchemy import Column, Integer, String, Float, Text, ARRAY, Index
 from sqlalchemy.dialects.postgresql import JSONB
 from app.database import Base
 
 
 class FoodItem(Base):
     __tablename__ = "food_items"
+    __table_args__ = (
+        # One row per food name: bulk imports upsert on it
+        Index("uq_food_items_name", "name", unique=True),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
-    name = Column(String(255), nullable=False, index=True)
+    name = Column(String(255), nullable=False)
     category = Column(String(100))  # grains, vegetables, protein, dairy, etc.
     
     # Nutrition per 100g
@@ -1,24 +1,32 @@
 """
 Food Scan model for storing user scan history
 """
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Text, ARRAY
+from sqlalchemy import Column, Integer, BigInteger, String, Float, DateTime, ForeignKey, Text, ARRAY, Index
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.sql import func
+from datetime import datetime, timezone
 from sqlalchemy.orm import relationship
 from app.database import Base
 
 
 class FoodScan(Base):
     __tablename__ = "food_scans"
+    __table_args__ = (
+        # Serves per-user history ordered by time (keyset pagination)
+        Index("ix_food_scans_user_created", "user_id", "created_at", "id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     
     # Image Data
     image_url = Column(String(500), nullable=False)
+    image_phash = Column(BigInteger, index=True)  # 64-bit dHash (signed) for near-duplicate lookup
+    image_derivatives = Column(ARRAY(Text))  # Resized copies written for this image (thumb, medium)
     
     # Detection Results
     detected_foods = Column(JSONB)  # List of detected food items with details
+    detected_foods_count = Column(Integer, nullable=False, default=0, server_default="0")  # len(detected_foods)
     confidence_score = Column(Float)  # Overall confidence (0-100)
     portion_estimate = Column(String(100))  # "1 plate", "2 cups", etc.
     
@@ -40,7 +48,12 @@ class FoodScan(Base):
     analysis_time = Column(Float)  # Time taken to analyze in seconds
     
     # Metadata
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Set client-side too so keyset cursors see the exact stored value (full precision)
+    created_at = Column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        default=lambda: datetime.now(timezone.utc)
+    )
     
     # Relationships
     user = relationship("User", backref="food_scans")
@@ -0,0 +1,159 @@
+"""
+Admin router for live diagnostics (CPU and memory profiling)
+
+Disabled unless ADMIN_TOKEN is set: every endpoint then returns 404.
+Callers authenticate with "Authorization: Bearer <ADMIN_TOKEN>" or an
+X-Admin-Token header. Each worker process profiles only itself.
+"""
+import hmac
+from typing import Literal, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import JSONResponse, PlainTextResponse
+from app.config import settings
+from app.services.memory_profiler import memory_profiler
+from app.services.profiler import profile_manager, to_collapsed, to_speedscope
+
+
+def require_admin(request: Request):
+    """Allow only callers presenting ADMIN_TOKEN (the admin API 404s when it is unset)"""
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    token = request.headers.get("x-admin-token")
+    authorization = request.headers.get("authorization", "")
+    if token is None and authorization.lower().startswith("bearer "):
+        token = authorization[7:].strip()
+    if not token or not hmac.compare_digest(token, settings.ADMIN_TOKEN):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid admin token")
+
+
+router = APIRouter(prefix="/admin", tags=["Admin"], dependencies=[Depends(require_admin)])
+
+ProfileFormat = Literal["collapsed", "speedscope", "summary"]
+
+
+def require_profiler():
+    if not profile_manager.enabled:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profiler disabled (PROFILER_ENABLED=false)")
+    if profile_manager.busy:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="A profile is already running on this worker")
+
+
+def profile_output(session, output_format: str):
+    if output_format == "collapsed":
+        return PlainTextResponse(to_collapsed(session.counts), headers={"X-Profile-Id": session.id})
+    if output_format == "speedscope":
+        return JSONResponse(
+            to_speedscope(session.counts, session.interval, f"profile {session.id}"),
+            headers={"X-Profile-Id": session.id}
+        )
+    return session.summary()
+
+
+@router.post("/profile")
+async def run_profile(
+    seconds: float = Query(10, gt=0),
+    interval_ms: Optional[float] = Query(None, ge=1, le=1000, description="Sampling interval (default PROFILER_INTERVAL_MS)"),
+    output_format: ProfileFormat = Query("collapsed", alias="format")
+):
+    """
+    Sample every thread of this worker for `seconds` and return the profile
+
+    collapsed: "frame;frame;frame count" lines (flamegraph.pl, speedscope)
+    speedscope: speedscope JSON (https://www.speedscope.app)
+    """
+    require_profiler()
+    session = await profile_manager.profile_for(min(seconds, settings.PROFILER_MAX_SECONDS), interval_ms)
+    return profile_output(session, output_format)
+
+
+@router.post("/profile/requests")
+async def arm_request_profile(
+    path: str = Query(..., description="Exact request path, e.g. /api/food/analyze"),
+    count: int = Query(10, ge=1, le=1000),
+    interval_ms: Optional[float] = Query(None, ge=1, le=1000)
+):
+    """
+    Sample while the next `count` requests to `path` are in flight
+
+    Fetch the result from GET /admin/profile/{id} once its status is "done".
+    A single request can also be profiled by sending X-Profile: <ADMIN_TOKEN>;
+    its response carries the profile id in X-Profile-Id.
+    """
+    require_profiler()
+    session = profile_manager.arm(path, count, interval_ms)
+    return session.summary()
+
+
+@router.get("/profile/{session_id}")
+async def get_profile(
+    session_id: str,
+    output_format: ProfileFormat = Query("summary", alias="format")
+):
+    """Status of a profile, or its output once done"""
+    session = profile_manager.get(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if session.status != "done":
+        return session.summary()
+    return profile_output(session, output_format)
+
+
+@router.get("/profile")
+async def list_profiles():
+    """Current and recent profiles of this worker"""
+    return profile_manager.get_stats()
+
+
+def require_memory_profiler(tracing: bool = False):
+    if not memory_profiler.enabled:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Memory profiler disabled (MEMORY_PROFILER_ENABLED=false)")
+    if tracing and not memory_profiler.tracing:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="tracemalloc is not running (POST /admin/memory/start)")
+
+
+@router.get("/memory")
+async def memory_report(top: int = Query(10, ge=0, le=100, description="Allocation sites per route and stage")):
+    """
+    Memory per route and per image stage on this worker
+
+    Routes: RSS delta, peak RSS growth and traced peak per request. Stages
+    (save_image and its steps, analyze_image): traced peak bytes and RSS
+    delta. Both include the top allocation sites still held at the end of
+    sampled runs.
+    """
+    require_memory_profiler()
+    return memory_profiler.get_report(top)
+
+
+@router.get("/memory/top")
+async def memory_top(
+    limit: int = Query(20, ge=1, le=500),
+    group_by: Literal["lineno", "filename", "traceback"] = Query("lineno")
+):
+    """Largest live Python allocation sites of this worker right now"""
+    require_memory_profiler(tracing=True)
+    return {"traced_bytes": memory_profiler.get_stats()["traced_bytes"], "sites": memory_profiler.top_sites(limit, group_by)}
+
+
+@router.post("/memory/start")
+async def start_memory_tracing(frames: Optional[int] = Query(None, ge=1, le=100, description="Traceback depth (default MEMORY_PROFILER_FRAMES)")):
+    """Start tracemalloc (slows allocations while it runs)"""
+    require_memory_profiler()
+    memory_profiler.start(frames)
+    return memory_profiler.get_stats()
+
+
+@router.post("/memory/stop")
+async def stop_memory_tracing():
+    """Stop tracemalloc; per-request RSS tracking continues"""
+    require_memory_profiler()
+    memory_profiler.stop()
+    return memory_profiler.get_stats()
+
+
+@router.post("/memory/reset")
+async def reset_memory_report():
+    """Clear the per-route and per-stage samples"""
+    require_memory_profiler()
+    memory_profiler.reset()
+    return memory_profiler.get_stats()
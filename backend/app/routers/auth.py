@@ -2,7 +2,8 @@
 Authentication router for Google OAuth and user management
 """
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.database import get_db
 from app.models import User
 from app.schemas.auth import (
@@ -46,7 +47,7 @@ async def verify_google_token(id_token: str) -> dict:
 @router.post("/google-signin", response_model=TokenResponse)
 async def google_signin(
     auth_request: GoogleAuthRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Authenticate user with Google ID token
@@ -57,7 +58,7 @@ async def google_signin(
         google_user = await verify_google_token(auth_request.id_token)
         
         # Check if user exists
-        user = db.query(User).filter(User.email == google_user["email"]).first()
+        user = await db.scalar(select(User).where(User.email == google_user["email"]))
         
         if not user:
             # Create new user
@@ -69,8 +70,8 @@ async def google_signin(
                 region="india"  # Default region
             )
             db.add(user)
-            db.commit()
-            db.refresh(user)
+            await db.commit()
+            await db.refresh(user)
         
         # Create access token
         access_token = create_access_token(
@@ -92,7 +93,7 @@ async def google_signin(
 @router.put("/profile", response_model=UserResponse)
 async def update_profile(
     profile: UserProfile,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     # In production, add current_user dependency from JWT token
 ):
     """
@@ -100,7 +101,7 @@ async def update_profile(
     """
     # MOCK: Get first user for development
     # In production, get current_user from JWT token
-    user = db.query(User).first()
+    user = await db.scalar(select(User).limit(1))
     
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -109,19 +110,19 @@ async def update_profile(
     for key, value in profile.model_dump(exclude_unset=True).items():
         setattr(user, key, value)
     
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
     
     return UserResponse.from_orm(user)
 
 
 @router.get("/me", response_model=UserResponse)
-async def get_current_user(db: Session = Depends(get_db)):
+async def get_current_user(db: AsyncSession = Depends(get_db)):
     """
     Get current user profile
     """
     # MOCK: Return first user for development
-    user = db.query(User).first()
+    user = await db.scalar(select(User).limit(1))
     
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -1,6 +1,10 @@
-from fastapi import APIRouter, HTTPException
+import json
+import time
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from app.services.ai_service import ai_service
+from app.services.ai_service import ai_service, AICallTimeout
+from app.services.rate_limiter import chat_rate_limit
 
 router = APIRouter(
     prefix="/chat",
@@ -14,7 +18,7 @@ class ChatRequest(BaseModel):
 class ChatResponse(BaseModel):
     response: str
 
-@router.post("/", response_model=ChatResponse)
+@router.post("/", response_model=ChatResponse, dependencies=[Depends(chat_rate_limit)])
 async def chat_with_coach(request: ChatRequest):
     """
     Send a message to the AI Nutrition Coach
@@ -24,3 +28,63 @@ async def chat_with_coach(request: ChatRequest):
         return {"response": response_text}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+def sse_event(event: str, data: dict) -> str:
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@router.post("/stream", dependencies=[Depends(chat_rate_limit)])
+async def stream_chat_with_coach(request: ChatRequest):
+    """
+    Stream the AI Nutrition Coach answer as Server-Sent Events
+
+    Events:
+        token: {"text": "..."} for each chunk as it arrives from the model
+        done:  {"ttft_ms", "total_ms", "chunks", "chars"} timings once the answer is complete
+        error: {"error", "message"} if the model times out or fails mid-stream
+    """
+    async def events():
+        start_time = time.perf_counter()
+        first_token_time = None
+        chunks = 0
+        chars = 0
+        stream = ai_service.stream_chat_response(request.message)
+        try:
+            async for text in stream:
+                if first_token_time is None:
+                    first_token_time = time.perf_counter()
+                chunks += 1
+                chars += len(text)
+                yield sse_event("token", {"text": text})
+        except AICallTimeout as e:
+            print(f"[AI] Chat Stream Timeout: {e}")
+            yield sse_event("error", {"error": "timeout", "message": "I'm getting a lot of questions right now. Ask me again in a moment!"})
+            return
+        except Exception as e:
+            print(f"[AI] Chat Stream Error: {e}")
+            yield sse_event("error", {"error": "model_error", "message": "I'm having a bit of trouble thinking right now. Ask me again in a moment!"})
+            return
+        finally:
+            await stream.aclose()
+
+        total = time.perf_counter() - start_time
+        ttft = (first_token_time - start_time) if first_token_time is not None else total
+        ai_service.chat_stream_stats.record(ttft, total)
+        yield sse_event("done", {
+            "ttft_ms": round(ttft * 1000, 1),
+            "total_ms": round(total * 1000, 1),
+            "chunks": chunks,
+            "chars": chars
+        })
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # Stop reverse proxies (nginx) from buffering the stream
+            "X-Accel-Buffering": "no"
+        }
+    )
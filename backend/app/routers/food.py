@@ -1,134 +1,140 @@
 """
 Food analysis router for AI food detection and nutrition analysis
 """
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, UploadFile, File, Query, Request, Response, status
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.database import get_db
 from app.models import FoodScan, User
 from app.schemas.food import (
     FoodAnalysisResponse,
+    AnalysisJobResponse,
+    BatchAnalysisResponse,
+    BatchItemResult,
     FeedbackRequest,
     HistoryResponse,
-    DetectedFood
+    NutritionSummaryResponse
 )
-from app.services.ai_service import ai_service
-from app.services.nutrition_service import nutrition_service
-from app.services.image_service import image_service
-from typing import List
+from app.services.ai_service import ai_service, AICallTimeout
+from app.services.analysis_service import analysis_service, LowConfidenceError
+from app.services.image_service import (
+    image_service,
+    UploadTooLargeError,
+    UnsupportedImageTypeError
+)
+from app.services.job_queue import analysis_jobs, FINISHED_STATES, SUCCEEDED
+from app.services.phash_index import phash_index, to_signed64
+from app.services.rollup_service import rollup_service
+from app.services.metrics import analysis_stage
+from app.services.rate_limiter import analyze_rate_limit, analyze_batch_rate_limit
+from app.services.admission import (
+    analysis_admission,
+    request_timeout,
+    run_until_disconnected,
+    Overloaded,
+    ClientDisconnected
+)
+from app.workers.analysis_worker import analysis_workers
+from app.config import settings
+from datetime import date, datetime
+from typing import Dict, List, Literal, Optional, Tuple
+import asyncio
+import math
 import time
 
 router = APIRouter(prefix="/food", tags=["Food Analysis"])
 
 
-@router.post("/analyze", response_model=FoodAnalysisResponse)
+async def store_upload(image: UploadFile):
+    """Validate, compress and save an upload"""
+    # Starlette has already spooled the upload; check it without another copy
+    upload = image_service.validate_upload(image)
+    with analysis_stage("save_image"):
+        return await image_service.save_image(
+            upload, image.filename, model_input_size=ai_service.model_input_size
+        )
+
+
+async def run_analysis(image: UploadFile, db: AsyncSession, start_time: float,
+                       background_tasks: BackgroundTasks) -> FoodAnalysisResponse:
+    """Upload -> AI detection -> nutrition -> stored scan (runs under admission control)"""
+    processed = await store_upload(image)
+    image_url = image_service.get_image_url(processed.file_path)
+    
+    user = await analysis_service.get_user(db)
+    food_scan = await analysis_service.create_scan(db, processed, user.id, image_url, start_time)
+    with analysis_stage("db_commit"):
+        await db.commit()
+    await db.refresh(food_scan)
+    analysis_service.index_scan(food_scan, processed.phash)
+    # Thumbnails are written after the response is sent
+    background_tasks.add_task(analysis_service.write_scan_derivatives, food_scan.id, processed.file_path)
+    
+    return analysis_service.to_response(food_scan)
+
+
+@router.post("/analyze", response_model=FoodAnalysisResponse, dependencies=[Depends(analyze_rate_limit)])
 async def analyze_food(
+    request: Request,
+    background_tasks: BackgroundTasks,
     image: UploadFile = File(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Analyze uploaded food image and return nutrition information
+
+    Runs at most ANALYZE_MAX_IN_FLIGHT analyses at once with a bounded queue
+    behind them; requests that cannot start within their deadline
+    (ANALYZE_DEADLINE_SECONDS, or less via X-Request-Timeout) get 503 with
+    Retry-After. Work is cancelled if the client disconnects.
     """
     start_time = time.time()
+    timeout = request_timeout(request, settings.ANALYZE_DEADLINE_SECONDS)
+
+    async def admitted_analysis():
+        async with analysis_admission.admit(timeout):
+            return await run_analysis(image, db, start_time, background_tasks)
     
     try:
-        # Read image bytes
-        image_bytes = await image.read()
-        
-        # Save image
-        file_path, compressed_bytes = await image_service.save_image(
-            image_bytes, image.filename
+        return await run_until_disconnected(request, admitted_analysis())
+    except HTTPException:
+        raise
+    except Overloaded as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail={
+                "error": "overloaded",
+                "message": "Too many analyses in progress. Please retry shortly.",
+                "reason": e.reason,
+                "retry_after": round(e.retry_after, 1)
+            },
+            headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))}
         )
-        image_url = image_service.get_image_url(file_path)
-        
-        # Analyze with AI
-        detected_foods, confidence_score = await ai_service.analyze_image(compressed_bytes)
-        
-        # Check confidence threshold
-        if confidence_score < 0.85:
-            raise HTTPException(
-                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
-                detail={
-                    "error": "food_not_detected",
-                    "message": "Unable to detect food with sufficient confidence. Please try another image.",
-                    "confidence": confidence_score
-                }
-            )
-        
-        # Calculate total nutrition
-        total_nutrition = nutrition_service.calculate_total_nutrition(detected_foods)
-        
-        # Calculate health score
-        health_score = nutrition_service.calculate_health_score(total_nutrition)
-        
-        # Determine dietary tags
-        dietary_tags = nutrition_service.determine_dietary_tags(detected_foods)
-        
-        # Generate AI insights
-        ai_insights = nutrition_service.generate_ai_insights(
-            total_nutrition,
-            health_score
+    except LowConfidenceError as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=e.to_detail()
         )
-        
-        analysis_time = time.time() - start_time
-        
-        # Get current user (mock - use first user)
-        user = db.query(User).first()
-        if not user:
-            # Create demo user if none exists
-            user = User(
-                email="demo@calorai.com",
-                google_id="demo_123",
-                name="Demo User",
-                region="india"
-            )
-            db.add(user)
-            db.commit()
-            db.refresh(user)
-        
-        # Save scan to database
-        food_scan = FoodScan(
-            user_id=user.id,
-            image_url=image_url,
-            detected_foods=detected_foods,
-            confidence_score=confidence_score,
-            total_calories=total_nutrition["total_calories"],
-            total_protein=total_nutrition["total_protein"],
-            total_carbs=total_nutrition["total_carbs"],
-            total_fats=total_nutrition["total_fats"],
-            total_fiber=total_nutrition["total_fiber"],
-            total_sugar=total_nutrition["total_sugar"],
-            total_sodium=total_nutrition["total_sodium"],
-            health_score=health_score,
-            dietary_tags=dietary_tags,
-            ai_insights=ai_insights,
-            analysis_time=analysis_time
+    except ClientDisconnected:
+        analysis_admission.disconnected += 1
+        print("[ADMISSION] Client disconnected, analysis cancelled")
+        raise HTTPException(status_code=499, detail="Client closed request")
+    except UploadTooLargeError as e:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=str(e)
         )
-        db.add(food_scan)
-        db.commit()
-        db.refresh(food_scan)
-        
-        # Return response
-        return FoodAnalysisResponse(
-            id=food_scan.id,
-            image_url=image_url,
-            detected_foods=[DetectedFood(**f) for f in detected_foods],
-            total_calories=total_nutrition["total_calories"],
-            total_protein=total_nutrition["total_protein"],
-            total_carbs=total_nutrition["total_carbs"],
-            total_fats=total_nutrition["total_fats"],
-            total_fiber=total_nutrition["total_fiber"],
-            total_sugar=total_nutrition["total_sugar"],
-            total_sodium=total_nutrition["total_sodium"],
-            confidence_score=confidence_score,
-            health_score=health_score,
-            dietary_tags=dietary_tags,
-            ai_insights=ai_insights,
-            analysis_time=analysis_time,
-            created_at=food_scan.created_at
+    except UnsupportedImageTypeError as e:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail=str(e)
+        )
+    except AICallTimeout as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"AI service busy: {str(e)}",
+            headers={"Retry-After": "5"}
         )
-        
-    except HTTPException:
-        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -136,78 +142,324 @@ async def analyze_food(
         )
 
 
+def batch_error(exc: BaseException) -> Dict:
+    """Error payload for one failed image of a batch"""
+    if isinstance(exc, LowConfidenceError):
+        return exc.to_detail()
+    if isinstance(exc, UploadTooLargeError):
+        return {"error": "too_large", "message": str(exc)}
+    if isinstance(exc, UnsupportedImageTypeError):
+        return {"error": "unsupported_type", "message": str(exc)}
+    if isinstance(exc, Overloaded):
+        return {
+            "error": "overloaded",
+            "message": "Too many analyses in progress. Please retry shortly.",
+            "retry_after": round(exc.retry_after, 1)
+        }
+    if isinstance(exc, AICallTimeout):
+        return {"error": "ai_busy", "message": f"AI service busy: {str(exc)}"}
+    return {"error": "analysis_failed", "message": f"Analysis failed: {str(exc)}"}
+
+
+@router.post("/analyze/batch", response_model=BatchAnalysisResponse, dependencies=[Depends(analyze_batch_rate_limit)])
+async def analyze_food_batch(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    images: List[UploadFile] = File(...),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Analyze several food images in one request
+    
+    Images are analyzed concurrently (ANALYZE_BATCH_CONCURRENCY at a time,
+    each also holding an admission slot), so a batch takes about as long as
+    its slowest image. All resulting scans are saved in one transaction.
+    Failed images are reported per item and do not fail the batch.
+    """
+    if len(images) > settings.ANALYZE_BATCH_MAX_IMAGES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {settings.ANALYZE_BATCH_MAX_IMAGES} images per batch"
+        )
+    
+    start_time = time.time()
+    timeout = request_timeout(request, settings.ANALYZE_DEADLINE_SECONDS)
+    user = await analysis_service.get_user(db)
+    semaphore = asyncio.Semaphore(settings.ANALYZE_BATCH_CONCURRENCY)
+    db_lock = asyncio.Lock()  # The images share this request's session
+    
+    async def analyze_one(image: UploadFile):
+        async with semaphore:
+            async with analysis_admission.admit(timeout):
+                processed = await store_upload(image)
+                detected_foods, confidence_score = await analysis_service.detect(
+                    db, processed, user.id, db_lock
+                )
+        food_scan = analysis_service.build_scan(
+            processed, user.id, image_service.get_image_url(processed.file_path),
+            detected_foods, confidence_score, start_time
+        )
+        return processed, food_scan
+    
+    async def analyze_all():
+        outcomes = await asyncio.gather(*(analyze_one(image) for image in images), return_exceptions=True)
+        food_scans = [outcome[1] for outcome in outcomes if not isinstance(outcome, BaseException)]
+        if food_scans:
+            await analysis_service.save_scans(db, food_scans)
+            with analysis_stage("db_commit"):
+                await db.commit()
+        return outcomes
+    
+    try:
+        outcomes = await run_until_disconnected(request, analyze_all())
+    except ClientDisconnected:
+        analysis_admission.disconnected += 1
+        print("[ADMISSION] Client disconnected, batch analysis cancelled")
+        raise HTTPException(status_code=499, detail="Client closed request")
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Batch analysis failed: {str(e)}"
+        )
+    
+    results = []
+    for index, (image, outcome) in enumerate(zip(images, outcomes)):
+        if isinstance(outcome, BaseException):
+            results.append(BatchItemResult(
+                index=index, filename=image.filename, status="error", error=batch_error(outcome)
+            ))
+            continue
+        processed, food_scan = outcome
+        analysis_service.index_scan(food_scan, processed.phash)
+        background_tasks.add_task(analysis_service.write_scan_derivatives, food_scan.id, processed.file_path)
+        results.append(BatchItemResult(
+            index=index, filename=image.filename, status="ok", result=analysis_service.to_response(food_scan)
+        ))
+    
+    succeeded = sum(1 for item in results if item.status == "ok")
+    return BatchAnalysisResponse(
+        results=results,
+        succeeded=succeeded,
+        failed=len(results) - succeeded,
+        analysis_time=time.time() - start_time
+    )
+
+
+def job_response(job, result: Optional[FoodAnalysisResponse] = None) -> AnalysisJobResponse:
+    return AnalysisJobResponse(
+        job_id=job.id,
+        status=job.status,
+        attempts=job.attempts,
+        created_at=job.created_at,
+        started_at=job.started_at,
+        finished_at=job.finished_at,
+        result=result,
+        error=job.error
+    )
+
+
+@router.post(
+    "/analyze/async",
+    response_model=AnalysisJobResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+    dependencies=[Depends(analyze_rate_limit)]
+)
+async def analyze_food_async(
+    response: Response,
+    image: UploadFile = File(...),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Queue a food image for analysis and return a job id immediately
+    
+    The image is stored before this returns, so the result survives a
+    dropped connection (and a server restart). Poll GET /food/jobs/{job_id}
+    (optionally with ?wait=seconds to long-poll) for the outcome.
+    """
+    try:
+        processed = await store_upload(image)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    except UnsupportedImageTypeError as e:
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail=str(e))
+    
+    user = await analysis_service.get_user(db)
+    job = await analysis_jobs.enqueue(
+        db,
+        user_id=user.id,
+        image_path=processed.file_path,
+        image_url=image_service.get_image_url(processed.file_path),
+        image_phash=to_signed64(processed.phash) if processed.phash is not None else None
+    )
+    analysis_workers.notify()
+    
+    response.headers["Location"] = f"{settings.API_V1_PREFIX}{router.prefix}/jobs/{job.id}"
+    return job_response(job)
+
+
+@router.get("/jobs/{job_id}", response_model=AnalysisJobResponse)
+async def get_analysis_job(
+    job_id: str,
+    wait: float = Query(0, ge=0, description="Seconds to wait for the job to finish (long-poll)"),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Status of a queued analysis; includes the full result once it succeeds
+    """
+    deadline = time.monotonic() + min(wait, settings.ANALYSIS_JOB_MAX_WAIT_SECONDS)
+    job = await analysis_jobs.get(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    # Workers may live in other processes, so watch the row itself
+    while job.status not in FINISHED_STATES and time.monotonic() < deadline:
+        await asyncio.sleep(min(settings.ANALYSIS_JOB_POLL_SECONDS, max(0.0, deadline - time.monotonic())))
+        await db.rollback()  # Fresh snapshot on the next read
+        job = await analysis_jobs.get(db, job_id)
+    
+    result = None
+    if job.status == SUCCEEDED and job.scan_id is not None:
+        food_scan = await db.get(FoodScan, job.scan_id)
+        if food_scan:
+            result = analysis_service.to_response(food_scan)
+    return job_response(job, result)
+
+
 @router.get("/analysis/{scan_id}", response_model=FoodAnalysisResponse)
-async def get_analysis(scan_id: int, db: Session = Depends(get_db)):
+async def get_analysis(scan_id: int, db: AsyncSession = Depends(get_db)):
     """
     Retrieve a previous food analysis by ID
     """
-    food_scan = db.query(FoodScan).filter(FoodScan.id == scan_id).first()
+    food_scan = await db.get(FoodScan, scan_id)
     
     if not food_scan:
         raise HTTPException(status_code=404, detail="Analysis not found")
     
-    return FoodAnalysisResponse(
-        id=food_scan.id,
-        image_url=food_scan.image_url,
-        detected_foods=[DetectedFood(**f) for f in food_scan.detected_foods],
-        total_calories=food_scan.total_calories,
-        total_protein=food_scan.total_protein,
-        total_carbs=food_scan.total_carbs,
-        total_fats=food_scan.total_fats,
-        total_fiber=food_scan.total_fiber,
-        total_sugar=food_scan.total_sugar,
-        total_sodium=food_scan.total_sodium,
-        confidence_score=food_scan.confidence_score,
-        health_score=food_scan.health_score,
-        dietary_tags=food_scan.dietary_tags,
-        ai_insights=food_scan.ai_insights,
-        analysis_time=food_scan.analysis_time,
-        created_at=food_scan.created_at
-    )
+    return analysis_service.to_response(food_scan)
+
+
+def encode_history_cursor(created_at: datetime, scan_id: int) -> str:
+    """Cursor pointing just past a history row: '<created_at ISO>,<id>'"""
+    return f"{created_at.isoformat()},{scan_id}"
+
+
+def decode_history_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        created_at, scan_id = cursor.rsplit(",", 1)
+        return datetime.fromisoformat(created_at), int(scan_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid history cursor")
 
 
 @router.get("/history", response_model=List[HistoryResponse])
 async def get_history(
-    limit: int = 20,
-    db: Session = Depends(get_db)
+    response: Response,
+    limit: int = Query(20, ge=1, le=100),
+    before: Optional[str] = Query(None, description="Cursor '<created_at>,<id>' from X-Next-Cursor"),
+    db: AsyncSession = Depends(get_db)
 ):
     """
-    Get user's food scan history
+    Get user's food scan history, newest first
+    
+    Keyset paginated: pass the X-Next-Cursor response header as `before`
+    to fetch the next page. Every page costs the same index range scan.
     """
     # MOCK: Get first user
-    user = db.query(User).first()
+    user = await db.scalar(select(User).limit(1))
     
     if not user:
         return []
     
-    scans = db.query(FoodScan)\
-        .filter(FoodScan.user_id == user.id)\
-        .order_by(FoodScan.created_at.desc())\
-        .limit(limit)\
-        .all()
+    # Only the columns HistoryResponse needs (no detected_foods blob)
+    query = select(
+        FoodScan.id,
+        FoodScan.image_url,
+        FoodScan.total_calories,
+        FoodScan.detected_foods_count,
+        FoodScan.image_derivatives,
+        FoodScan.created_at
+    ).where(FoodScan.user_id == user.id)
+    
+    if before:
+        before_created_at, before_id = decode_history_cursor(before)
+        query = query.where(
+            tuple_(FoodScan.created_at, FoodScan.id) < tuple_(before_created_at, before_id)
+        )
+    
+    result = await db.execute(
+        query.order_by(FoodScan.created_at.desc(), FoodScan.id.desc()).limit(limit)
+    )
+    scans = result.all()
+    
+    if len(scans) == limit:
+        last = scans[-1]
+        response.headers["X-Next-Cursor"] = encode_history_cursor(last.created_at, last.id)
     
     return [
         HistoryResponse(
             id=scan.id,
             image_url=scan.image_url,
+            image_urls=image_service.get_image_urls(scan.image_url, scan.image_derivatives),
             total_calories=scan.total_calories,
-            detected_foods_count=len(scan.detected_foods),
+            detected_foods_count=scan.detected_foods_count,
             created_at=scan.created_at
         )
         for scan in scans
     ]
 
 
+@router.delete("/analysis/{scan_id}")
+async def delete_analysis(scan_id: int, db: AsyncSession = Depends(get_db)):
+    """
+    Delete a food analysis and remove it from the daily rollups
+    """
+    food_scan = await db.get(FoodScan, scan_id)
+    
+    if not food_scan:
+        raise HTTPException(status_code=404, detail="Analysis not found")
+    
+    await rollup_service.apply_scan(db, food_scan, sign=-1)
+    await db.delete(food_scan)
+    await db.commit()
+    
+    phash_index.remove(scan_id)
+    if food_scan.image_url.startswith("/uploads/"):
+        image_service.delete_image(str(image_service.upload_dir / food_scan.image_url.rsplit("/", 1)[-1]))
+    
+    return {"message": "Analysis deleted", "scan_id": scan_id}
+
+
+@router.get("/summary", response_model=NutritionSummaryResponse)
+async def get_nutrition_summary(
+    range_name: Literal["day", "week", "month"] = Query("day", alias="range"),
+    end_date: Optional[date] = Query(None, alias="date", description="Last day of the range (UTC), defaults to today"),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Get nutrition totals for the last day, 7 days or 30 days
+    
+    Reads the daily rollups: one indexed range scan over at most 30 rows.
+    """
+    # MOCK: Get first user
+    user = await db.scalar(select(User).limit(1))
+    
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    summary = await rollup_service.get_summary(db, user.id, range_name, end_date)
+    return NutritionSummaryResponse.model_validate(summary, from_attributes=True)
+
+
 @router.post("/feedback")
 async def submit_feedback(
     feedback: FeedbackRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Submit feedback on food detection accuracy
     Used to improve AI model over time
     """
-    food_scan = db.query(FoodScan).filter(FoodScan.id == feedback.scan_id).first()
+    food_scan = await db.get(FoodScan, feedback.scan_id)
     
     if not food_scan:
         raise HTTPException(status_code=404, detail="Scan not found")
@@ -13,7 +13,9 @@ from app.schemas.food import (
     FoodAnalysisResponse,
     FoodAnalysisRequest,
     FeedbackRequest,
-    HistoryResponse
+    HistoryResponse,
+    DailyNutritionResponse,
+    NutritionSummaryResponse
 )
 
 __all__ = [
@@ -26,5 +28,7 @@ __all__ = [
     "FoodAnalysisResponse",
     "FoodAnalysisRequest",
     "FeedbackRequest",
-    "HistoryResponse"
+    "HistoryResponse",
+    "DailyNutritionResponse",
+    "NutritionSummaryResponse"
 ]
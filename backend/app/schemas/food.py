@@ -3,7 +3,7 @@ Pydantic schemas for food analysis
 """
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
-from datetime import datetime
+from datetime import date, datetime
 
 
 class DetectedFood(BaseModel):
@@ -25,6 +25,7 @@ class FoodAnalysisResponse(BaseModel):
     """Complete food analysis result"""
     id: int
     image_url: str
+    image_urls: Dict[str, str] = {}  # original / medium / thumb
     detected_foods: List[DetectedFood]
     
     # Nutrition Summary
@@ -48,6 +49,35 @@ class FoodAnalysisResponse(BaseModel):
         from_attributes = True
 
 
+class BatchItemResult(BaseModel):
+    """Outcome for one image of a batch analysis"""
+    index: int  # Position of the image in the request
+    filename: Optional[str] = None
+    status: str  # ok, error
+    result: Optional[FoodAnalysisResponse] = None
+    error: Optional[Dict[str, Any]] = None  # {"error": ..., "message": ...}
+
+
+class BatchAnalysisResponse(BaseModel):
+    """Per-image results of POST /food/analyze/batch"""
+    results: List[BatchItemResult]
+    succeeded: int
+    failed: int
+    analysis_time: float
+
+
+class AnalysisJobResponse(BaseModel):
+    """Queued analysis job (async mode); result is set once it succeeds"""
+    job_id: str
+    status: str  # queued, running, succeeded, failed
+    attempts: int
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    result: Optional[FoodAnalysisResponse] = None
+    error: Optional[Dict[str, Any]] = None  # {"error": ..., "message": ...} when failed
+
+
 class FoodAnalysisRequest(BaseModel):
     """Request for manual food analysis (if needed)"""
     food_name: str
@@ -67,9 +97,42 @@ class HistoryResponse(BaseModel):
     """Food scan history item"""
     id: int
     image_url: str
+    image_urls: Dict[str, str] = {}  # original / medium / thumb
     total_calories: float
     detected_foods_count: int
     created_at: datetime
     
     class Config:
         from_attributes = True
+
+
+class DailyNutritionResponse(BaseModel):
+    """Nutrition totals for one day"""
+    day: date
+    scan_count: int
+    total_calories: float
+    total_protein: float
+    total_carbs: float
+    total_fats: float
+    total_fiber: float
+    total_sugar: float
+    total_sodium: float
+    
+    class Config:
+        from_attributes = True
+
+
+class NutritionSummaryResponse(BaseModel):
+    """Nutrition totals over a day/week/month range"""
+    range: str
+    start_date: date
+    end_date: date
+    scan_count: int
+    total_calories: float
+    total_protein: float
+    total_carbs: float
+    total_fats: float
+    total_fiber: float
+    total_sugar: float
+    total_sodium: float
+    days: List[DailyNutritionResponse]
@@ -0,0 +1,176 @@
+"""
+Admission control and load shedding for expensive request handlers
+
+A fixed number of requests run at once; a bounded FIFO queue holds the
+next ones. A request is shed (fails fast with a Retry-After hint) when the
+queue is full, or when its estimated wait (queue position x EWMA service
+time / concurrency) would already overrun its deadline. Work for clients
+that disconnect is cancelled instead of finishing for nobody.
+"""
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Deque, Dict
+from starlette.requests import Request
+from app.config import settings
+
+
+class Overloaded(Exception):
+    """Request shed by admission control"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"Server busy ({reason})")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class ClientDisconnected(Exception):
+    """The client went away before its request finished"""
+
+
+class AdmissionController:
+    """Bounded concurrency plus a bounded, deadline-aware FIFO queue"""
+
+    def __init__(self, name: str, max_in_flight: int, max_queue: int,
+                 initial_service_time: float = 2.0, ewma_alpha: float = 0.2):
+        self.name = name
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queue = max(0, max_queue)
+        self.ewma_alpha = ewma_alpha
+        self.service_time = initial_service_time  # EWMA of seconds per admitted request
+
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+        self.admitted = 0
+        self.shed: Dict[str, int] = {}
+        self.max_queued = 0
+        self.disconnected = 0  # requests cancelled because the client went away
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for waiter in self._waiters if not waiter.done())
+
+    def estimated_wait(self, position: int) -> float:
+        """Seconds until the request at queue `position` (1-based) gets a slot"""
+        return position * self.service_time / self.max_in_flight
+
+    def _shed(self, reason: str, position: int):
+        self.shed[reason] = self.shed.get(reason, 0) + 1
+        raise Overloaded(reason, max(1.0, self.estimated_wait(position)))
+
+    @asynccontextmanager
+    async def admit(self, timeout: float):
+        """
+        Hold one execution slot for the duration of the block
+
+        Raises:
+            Overloaded: queue full, deadline unreachable, or timed out waiting
+        """
+        if self.in_flight < self.max_in_flight and not self.queued:
+            self.in_flight += 1
+        else:
+            position = self.queued + 1
+            if position > self.max_queue:
+                self._shed("queue_full", position)
+            if self.estimated_wait(position) > timeout:
+                self._shed("deadline", position)
+
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            self.max_queued = max(self.max_queued, position)
+            try:
+                await asyncio.wait_for(waiter, timeout)
+            except asyncio.TimeoutError:
+                self._shed("timeout", self.queued + 1)
+            except asyncio.CancelledError:
+                # The slot may have been handed over just as we were cancelled
+                if waiter.done() and not waiter.cancelled():
+                    self._release()
+                raise
+            # A released slot was handed to us; in_flight already counts it
+
+        self.admitted += 1
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - start
+            self.service_time += self.ewma_alpha * (elapsed - self.service_time)
+            self._release()
+
+    def _release(self):
+        # Hand the slot straight to the oldest live waiter
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def get_stats(self) -> Dict:
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "max_queued": self.max_queued,
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+            "avg_service_time": round(self.service_time, 3),
+            "admitted": self.admitted,
+            "shed": dict(self.shed),
+            "disconnected": self.disconnected,
+        }
+
+
+def request_timeout(request: Request, default: float) -> float:
+    """Client's time budget (X-Request-Timeout seconds), capped at the server default"""
+    value = request.headers.get("x-request-timeout")
+    try:
+        return max(0.1, min(default, float(value))) if value else default
+    except ValueError:
+        return default
+
+
+async def run_until_disconnected(request: Request, work: Awaitable[Any]) -> Any:
+    """
+    Await `work`, cancelling it if the client disconnects first
+
+    Call only after the request body has been read: the watcher consumes
+    receive() messages, and once the body is in only a disconnect can arrive.
+    (Request.is_disconnected() cannot be polled here; behind @app.middleware
+    it never reports the disconnect.)
+
+    Raises:
+        ClientDisconnected: if the client went away (the work was cancelled)
+    """
+    async def wait_for_disconnect():
+        while True:
+            message = await request.receive()
+            if message["type"] == "http.disconnect":
+                return
+
+    task = asyncio.ensure_future(work)
+    watcher = asyncio.ensure_future(wait_for_disconnect())
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        if task.done():
+            return task.result()
+        task.cancel()
+        try:
+            await task
+        except (asyncio.CancelledError, Exception):
+            pass
+        raise ClientDisconnected()
+    finally:
+        watcher.cancel()
+        if not task.done():
+            task.cancel()
+
+
+# Global admission controller for food analysis
+analysis_admission = AdmissionController(
+    "analysis",
+    max_in_flight=settings.ANALYZE_MAX_IN_FLIGHT,
+    max_queue=settings.ANALYZE_MAX_QUEUE
+)
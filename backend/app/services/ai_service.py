@@ -1,9 +1,16 @@
 import time
 import os
 import json
-from typing import List, Dict, Tuple
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, List, Dict, Tuple, Union
 import io
 import random
+from app.config import settings
+from app.services.image_service import ProcessedImage
+from app.services.food_index import food_index
+from app.services.cache_service import chat_cache
 
 # Try to import optional dependencies
 try:
@@ -26,12 +33,217 @@ except ImportError:
     HAS_GEMINI = False
     print("[AI] WARNING: google-generativeai not found. Using Mock AI.")
 
+class AICallTimeout(Exception):
+    """Raised when a model call misses its deadline or cannot get a slot in time"""
+
+
+# Marks the end of a streamed call on the hand-off queue
+_STREAM_END = object()
+
+
+class ModelCallGate:
+    """
+    Runs blocking model SDK calls off the event loop with bounded concurrency.
+
+    Calls execute on a dedicated thread pool sized to ``max_concurrency`` so a
+    slow Gemini round trip never blocks other requests. Callers beyond the limit
+    wait (up to ``queue_timeout``) for a slot, and every call has a deadline.
+    """
+
+    def __init__(self, max_concurrency: int, call_timeout: float, queue_timeout: float):
+        self.max_concurrency = max(1, max_concurrency)
+        self.call_timeout = call_timeout
+        self.queue_timeout = queue_timeout
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_concurrency,
+            thread_name_prefix="ai-call"
+        )
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        # Metrics
+        self.in_flight = 0
+        self.queued = 0
+        self.max_queued = 0
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.total_call_time = 0.0
+
+    async def run(self, func: Callable[..., Any], *args, timeout: float = None, **kwargs) -> Any:
+        """
+        Run ``func(*args, **kwargs)`` on the model executor
+
+        Raises:
+            AICallTimeout: if no slot frees up in time or the call exceeds its deadline
+        """
+        await self._acquire()
+
+        self.in_flight += 1
+        start_time = time.time()
+
+        def finished(_):
+            # A timed-out call keeps its thread busy: hold the slot until it returns
+            self.total_call_time += time.time() - start_time
+            self.in_flight -= 1
+            self._semaphore.release()
+
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, lambda: func(*args, **kwargs))
+        future.add_done_callback(finished)
+        try:
+            # shield: a deadline or cancelled caller must not mark the running call done
+            result = await asyncio.wait_for(asyncio.shield(future), timeout=timeout or self.call_timeout)
+            self.completed += 1
+            return result
+        except asyncio.TimeoutError:
+            # Also the builtin TimeoutError (3.11+): if the call already finished,
+            # it raised that itself (e.g. an SDK socket timeout) and just failed
+            if future.done():
+                self.failed += 1
+                raise
+            self.timeouts += 1
+            raise AICallTimeout(f"AI call exceeded {timeout or self.call_timeout}s deadline")
+        except Exception:
+            self.failed += 1
+            raise
+
+    async def _acquire(self):
+        """Wait (up to queue_timeout) for a model call slot"""
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise AICallTimeout(f"No AI slot available within {self.queue_timeout}s")
+        finally:
+            self.queued -= 1
+
+    async def stream(self, func: Callable[..., Any], *args, timeout: float = None, **kwargs) -> AsyncIterator[Any]:
+        """
+        Iterate a blocking streaming call (``func`` returns an iterator) off the event loop
+
+        The iterator is drained on one executor thread and each item is handed
+        to the event loop as soon as it arrives. ``timeout`` bounds the wait for
+        the first item and every gap between items. Closing the async iterator
+        (e.g. on client disconnect) stops the thread after its current item.
+
+        Raises:
+            AICallTimeout: if no slot frees up in time or the stream stalls
+        """
+        await self._acquire()
+
+        self.in_flight += 1
+        start_time = time.time()
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+
+        def hand_off(item, error=None):
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, (item, error))
+            except RuntimeError:
+                stop.set()  # Event loop is gone
+
+        def drain():
+            try:
+                for item in func(*args, **kwargs):
+                    if stop.is_set():
+                        return
+                    hand_off(item)
+            except Exception as e:
+                hand_off(_STREAM_END, e)
+            else:
+                hand_off(_STREAM_END)
+
+        def finished(_):
+            # Hold the slot until the thread is really done with the SDK call
+            self.total_call_time += time.time() - start_time
+            self.in_flight -= 1
+            self._semaphore.release()
+
+        future = loop.run_in_executor(self._executor, drain)
+        future.add_done_callback(finished)
+        try:
+            while True:
+                try:
+                    item, error = await asyncio.wait_for(queue.get(), timeout=timeout or self.call_timeout)
+                except asyncio.TimeoutError:
+                    self.timeouts += 1
+                    raise AICallTimeout(f"AI stream stalled for {timeout or self.call_timeout}s")
+                if item is _STREAM_END:
+                    if error is not None:
+                        self.failed += 1
+                        raise error
+                    self.completed += 1
+                    return
+                yield item
+        finally:
+            stop.set()
+
+    def get_stats(self) -> Dict:
+        """Queue depth and call counters for monitoring"""
+        finished = self.completed + self.failed + self.timeouts
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "max_queued": self.max_queued,
+            "completed": self.completed,
+            "failed": self.failed,
+            "timeouts": self.timeouts,
+            "rejected": self.rejected,
+            "avg_call_time": round(self.total_call_time / finished, 4) if finished else 0.0,
+        }
+
+
+class ChatStreamStats:
+    """Time-to-first-token and total time of streamed chat answers"""
+
+    def __init__(self):
+        self.streams = 0
+        self.total_ttft = 0.0
+        self.max_ttft = 0.0
+        self.total_time = 0.0
+
+    def record(self, ttft: float, total: float):
+        self.streams += 1
+        self.total_ttft += ttft
+        self.max_ttft = max(self.max_ttft, ttft)
+        self.total_time += total
+
+    def get_stats(self) -> Dict:
+        return {
+            "streams": self.streams,
+            "avg_ttft": round(self.total_ttft / self.streams, 4) if self.streams else 0.0,
+            "max_ttft": round(self.max_ttft, 4),
+            "avg_total_time": round(self.total_time / self.streams, 4) if self.streams else 0.0,
+        }
+
+
+def coach_prompt(message: str) -> str:
+    """Prompt for the AI Nutrition Coach"""
+    return f"""
+            You are an expert AI Nutrition Coach named "CalorAI Coach". 
+            Your goal is to help users eat healthy, lose weight, and build muscle.
+            Keep your answers short, encouraging, and emoji-friendly.
+            
+            User: {message}
+            
+            Coach:
+            """
+
+
 class MockAIService:
     """Fallback Mock Service when Gemini is not available"""
     def __init__(self):
         print("[AI] Initializing Mock AI Service (Fallback)")
+        self.gate = None
+        self.model_input_size = None
+        self.chat_stream_stats = ChatStreamStats()
     
-    async def analyze_image(self, image_bytes: bytes) -> Tuple[List[Dict], float]:
+    async def analyze_image(self, image: Union[bytes, ProcessedImage]) -> Tuple[List[Dict], float]:
         print("[AI] Mock Analysis Triggered")
         # Return a generic result so app works
         return [{
@@ -48,11 +260,23 @@ class MockAIService:
             "weight_grams": 100
         }], 0.99
 
+    OFFLINE_MESSAGE = "I am currently in Offline Mode because my brain (Google AI) could not be loaded. Please check backend logs."
+
     async def get_chat_response(self, message: str) -> str:
-        return "I am currently in Offline Mode because my brain (Google AI) could not be loaded. Please check backend logs."
+        return self.OFFLINE_MESSAGE
+
+    async def stream_chat_response(self, message: str) -> AsyncIterator[str]:
+        """Word-by-word offline answer, paced like a model stream for local testing"""
+        words = self.OFFLINE_MESSAGE.split(" ")
+        for i, word in enumerate(words):
+            await asyncio.sleep(0.02)
+            yield word if i == len(words) - 1 else word + " "
 
     def get_food_info(self, food_name: str) -> Dict:
-        return None
+        return food_index.lookup(food_name)
+
+    def get_stats(self) -> Dict:
+        return {"backend": "mock", "chat_stream": self.chat_stream_stats.get_stats()}
 
 class AIFoodRecognitionService:
     """
@@ -61,14 +285,23 @@ class AIFoodRecognitionService:
     
     def __init__(self):
         """Initialize the AI service with Google API Key"""
+        self.model = None
+        self.chat_model = None
+        # Gemini takes the stored JPEG as-is; no local model input needed
+        self.model_input_size = None
+        self.gate = ModelCallGate(
+            max_concurrency=settings.AI_MAX_CONCURRENCY,
+            call_timeout=settings.AI_CALL_TIMEOUT,
+            queue_timeout=settings.AI_QUEUE_TIMEOUT
+        )
+        self.chat_stream_stats = ChatStreamStats()
+
         if not HAS_GEMINI:
-            self.model = None
             return
 
         api_key = os.getenv("GOOGLE_API_KEY")
         if not api_key:
             print("[AI] WARNING: GOOGLE_API_KEY not found. AI features will fail.")
-            self.model = None
             return
 
         try:
@@ -89,29 +322,64 @@ class AIFoodRecognitionService:
         """
         if not self.chat_model:
             return "I'm having trouble connecting to my brain right now. Please check the API key."
+        
+        cache_key = chat_cache.make_key(message)
+        cached = await chat_cache.get(cache_key)
+        if cached is not None:
+            return cached
             
         try:
-            prompt = f"""
-            You are an expert AI Nutrition Coach named "CalorAI Coach". 
-            Your goal is to help users eat healthy, lose weight, and build muscle.
-            Keep your answers short, encouraging, and emoji-friendly.
-            
-            User: {message}
-            
-            Coach:
-            """
-            response = self.chat_model.generate_content(prompt)
+            prompt = coach_prompt(message)
+            response = await self.gate.run(self.chat_model.generate_content, prompt)
+            await chat_cache.set(cache_key, response.text)
             return response.text
+        except AICallTimeout as e:
+            print(f"[AI] Chat Timeout: {e}")
+            return "I'm getting a lot of questions right now. Ask me again in a moment!"
         except Exception as e:
             print(f"[AI] Chat Error: {e}")
             return "I'm having a bit of trouble thinking right now. Ask me again in a moment!"
     
-    async def analyze_image(self, image_bytes: bytes) -> Tuple[List[Dict], float]:
+    async def stream_chat_response(self, message: str) -> AsyncIterator[str]:
+        """
+        Stream the AI Coach answer as text chunks arrive from Gemini
+        
+        Raises:
+            AICallTimeout: if no slot frees up in time or the stream stalls
+        """
+        if not self.chat_model:
+            yield "I'm having trouble connecting to my brain right now. Please check the API key."
+            return
+        
+        cache_key = chat_cache.make_key(message)
+        cached = await chat_cache.get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+        
+        parts = []
+        chunks = self.gate.stream(self.chat_model.generate_content, coach_prompt(message), stream=True)
+        try:
+            async for chunk in chunks:
+                # Safety-filtered or empty chunks carry no text
+                try:
+                    text = chunk.text
+                except ValueError:
+                    continue
+                if text:
+                    parts.append(text)
+                    yield text
+        finally:
+            await chunks.aclose()
+        # Only complete answers are cached
+        await chat_cache.set(cache_key, "".join(parts))
+    
+    async def analyze_image(self, image: Union[bytes, ProcessedImage]) -> Tuple[List[Dict], float]:
         """
         Analyze food image using Gemini Vision
         
         Args:
-            image_bytes: Image file bytes
+            image: Processed upload (its JPEG is sent without re-decoding) or raw image bytes
             
         Returns:
             Tuple of (detected_foods, confidence_score)
@@ -128,8 +396,11 @@ class AIFoodRecognitionService:
         start_time = time.time()
         
         try:
-            # Load image for Gemini
-            image = Image.open(io.BytesIO(image_bytes))
+            # Processed uploads already hold a JPEG; only raw bytes need decoding
+            if isinstance(image, ProcessedImage):
+                image_payload = image.gemini_payload
+            else:
+                image_payload = Image.open(io.BytesIO(image))
             
             # Prompt for Gemini
             prompt = """
@@ -152,7 +423,7 @@ class AIFoodRecognitionService:
             """
             
             # Generate response
-            response = self.model.generate_content([prompt, image])
+            response = await self.gate.run(self.model.generate_content, [prompt, image_payload])
             response_text = response.text
             
             # Clean response (remove markdown if present)
@@ -170,6 +441,9 @@ class AIFoodRecognitionService:
                 
             return detected_foods, round(overall_confidence, 2)
 
+        except AICallTimeout:
+            # Let the caller answer with a retryable error instead of "no food"
+            raise
         except Exception as e:
             print(f"[AI] Error analyzing image: {e}")
             # Identify if it's a safety block or other error
@@ -177,11 +451,16 @@ class AIFoodRecognitionService:
     
     def get_food_info(self, food_name: str) -> Dict:
         """
-        Get nutrition info for a specific food (Text-only Gemini)
+        Get nutrition info (per 100g) for a specific food from the food_items index
+        
+        Resolves exact, normalized and misspelled names without a model call.
+        Returns None if no food_items row is close enough.
         """
-        # For now, we rely on the visual analysis. 
-        # In a full upgrade, we would add a text-only Gemini fallback here.
-        return None
+        return food_index.lookup(food_name)
+
+    def get_stats(self) -> Dict:
+        """Model call concurrency and queue metrics"""
+        return {"backend": "gemini", **self.gate.get_stats(), "chat_stream": self.chat_stream_stats.get_stats()}
 
             
 # Global AI service instance
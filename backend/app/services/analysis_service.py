@@ -0,0 +1,206 @@
+"""
+Food analysis pipeline shared by the HTTP endpoint and the job workers
+
+Processed upload -> cached / near-duplicate / AI detection -> nutrition ->
+FoodScan row plus daily rollup. Callers own the transaction: nothing here
+commits, so a worker can finish its job in the same commit as the scan.
+"""
+import asyncio
+import time
+from contextlib import nullcontext
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.models import FoodScan, User
+from app.schemas.food import DetectedFood, FoodAnalysisResponse
+from app.services.ai_service import ai_service
+from app.services.cache_service import analysis_cache
+from app.services.image_service import ProcessedImage, image_service
+from app.services.memory_profiler import memory_profiler
+from app.services.metrics import analysis_stage
+from app.services.nutrition_service import nutrition_service
+from app.services.phash_index import phash_index, to_signed64
+from app.services.rollup_service import rollup_service
+
+
+class LowConfidenceError(ValueError):
+    """No food detected with sufficient confidence"""
+
+    def __init__(self, confidence: float):
+        super().__init__("Unable to detect food with sufficient confidence. Please try another image.")
+        self.confidence = confidence
+
+    def to_detail(self) -> Dict:
+        return {
+            "error": "food_not_detected",
+            "message": str(self),
+            "confidence": self.confidence
+        }
+
+
+async def find_near_duplicate(db: AsyncSession, phash: Optional[int], user_id: int) -> Optional[Tuple[List[Dict], float]]:
+    """Reuse the result of a recent, visually near-identical scan by the same user"""
+    if phash is None or not settings.PHASH_DEDUP_ENABLED:
+        return None
+
+    match = phash_index.find_nearest(phash, user_id=user_id)
+    if not match:
+        return None
+
+    scan_id, _ = match
+    result = await db.execute(
+        select(FoodScan.detected_foods, FoodScan.confidence_score)
+        .where(FoodScan.id == scan_id)
+    )
+    row = result.first()
+    if not row or not row.detected_foods:
+        return None
+    return row.detected_foods, row.confidence_score
+
+
+class AnalysisService:
+    """Runs one processed upload through detection and nutrition scoring"""
+
+    async def get_user(self, db: AsyncSession) -> User:
+        """Current user (mock - use first user, creating a demo user if none exists)"""
+        user = await db.scalar(select(User).limit(1))
+        if not user:
+            user = User(
+                email="demo@calorai.com",
+                google_id="demo_123",
+                name="Demo User",
+                region="india"
+            )
+            db.add(user)
+            await db.commit()
+            await db.refresh(user)
+        return user
+
+    async def detect(self, db: AsyncSession, processed: ProcessedImage, user_id: int,
+                     db_lock: Optional[asyncio.Lock] = None) -> Tuple[List[Dict], float]:
+        """
+        Detected foods and confidence for an upload
+
+        Identical uploads are served from cache, near-identical shots reuse
+        a recent scan's result; everything else goes to the AI service.
+        Concurrent callers sharing one session pass a `db_lock`.
+        """
+        cache_key = analysis_cache.make_key(processed.compressed_bytes)
+        cached = await analysis_cache.get(cache_key)
+        if not cached:
+            async with db_lock or nullcontext():
+                cached = await find_near_duplicate(db, processed.phash, user_id)
+        if cached:
+            return cached
+
+        with analysis_stage("ai_call"), memory_profiler.stage("analyze_image", unit=True):
+            detected_foods, confidence_score = await ai_service.analyze_image(processed)
+        await analysis_cache.set(cache_key, detected_foods, confidence_score)
+        return detected_foods, confidence_score
+
+    def build_scan(self, processed: ProcessedImage, user_id: int, image_url: str,
+                   detected_foods: List[Dict], confidence_score: float, start_time: float) -> FoodScan:
+        """
+        Score detected foods into a (not yet added) FoodScan
+
+        Raises:
+            LowConfidenceError: if no food was detected confidently enough
+        """
+        # Check confidence threshold
+        if confidence_score < settings.CONFIDENCE_THRESHOLD:
+            raise LowConfidenceError(confidence_score)
+
+        with analysis_stage("nutrition"):
+            total_nutrition = nutrition_service.calculate_total_nutrition(detected_foods)
+            health_score = nutrition_service.calculate_health_score(total_nutrition)
+            dietary_tags = nutrition_service.determine_dietary_tags(detected_foods, total_nutrition)
+            ai_insights = nutrition_service.generate_ai_insights(total_nutrition, health_score)
+
+        return FoodScan(
+            user_id=user_id,
+            image_url=image_url,
+            image_phash=to_signed64(processed.phash) if processed.phash is not None else None,
+            image_derivatives=sorted(processed.derivative_paths) or None,
+            detected_foods=detected_foods,
+            detected_foods_count=len(detected_foods),
+            confidence_score=confidence_score,
+            total_calories=total_nutrition["total_calories"],
+            total_protein=total_nutrition["total_protein"],
+            total_carbs=total_nutrition["total_carbs"],
+            total_fats=total_nutrition["total_fats"],
+            total_fiber=total_nutrition["total_fiber"],
+            total_sugar=total_nutrition["total_sugar"],
+            total_sodium=total_nutrition["total_sodium"],
+            health_score=health_score,
+            dietary_tags=dietary_tags,
+            ai_insights=ai_insights,
+            analysis_time=time.time() - start_time
+        )
+
+    async def save_scans(self, db: AsyncSession, food_scans: List[FoodScan]):
+        """Stage scans and their daily rollup updates in the caller's transaction"""
+        with analysis_stage("db_write"):
+            db.add_all(food_scans)
+            await db.flush()
+            await rollup_service.apply_scans(db, food_scans)
+
+    async def create_scan(self, db: AsyncSession, processed: ProcessedImage, user_id: int,
+                          image_url: str, start_time: float) -> FoodScan:
+        """
+        Analyze an upload and stage its FoodScan and rollup update (not committed)
+
+        Raises:
+            LowConfidenceError: if no food was detected confidently enough
+        """
+        detected_foods, confidence_score = await self.detect(db, processed, user_id)
+        food_scan = self.build_scan(
+            processed, user_id, image_url, detected_foods, confidence_score, start_time
+        )
+        await self.save_scans(db, [food_scan])
+        return food_scan
+
+    async def write_scan_derivatives(self, scan_id: int, file_path: str):
+        """Write a scan's resized copies after its response and record them on the row"""
+        try:
+            paths = await image_service.write_derivatives(file_path)
+            if not paths:
+                return
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(FoodScan).where(FoodScan.id == scan_id).values(image_derivatives=sorted(paths))
+                )
+                await db.commit()
+        except Exception as e:
+            print(f"[WARN] Writing derivatives for scan {scan_id} failed: {e}")
+
+    def index_scan(self, food_scan: FoodScan, phash: Optional[int]):
+        """Make a committed scan visible to near-duplicate lookups"""
+        if phash is not None:
+            phash_index.add(food_scan.id, phash, food_scan.user_id)
+
+    def to_response(self, food_scan: FoodScan) -> FoodAnalysisResponse:
+        return FoodAnalysisResponse(
+            id=food_scan.id,
+            image_url=food_scan.image_url,
+            image_urls=image_service.get_image_urls(food_scan.image_url, food_scan.image_derivatives),
+            detected_foods=[DetectedFood(**f) for f in food_scan.detected_foods],
+            total_calories=food_scan.total_calories,
+            total_protein=food_scan.total_protein,
+            total_carbs=food_scan.total_carbs,
+            total_fats=food_scan.total_fats,
+            total_fiber=food_scan.total_fiber,
+            total_sugar=food_scan.total_sugar,
+            total_sodium=food_scan.total_sodium,
+            confidence_score=food_scan.confidence_score,
+            health_score=food_scan.health_score,
+            dietary_tags=food_scan.dietary_tags,
+            ai_insights=food_scan.ai_insights,
+            analysis_time=food_scan.analysis_time,
+            created_at=food_scan.created_at
+        )
+
+
+# Global analysis service instance
+analysis_service = AnalysisService()
@@ -0,0 +1,303 @@
+"""
+Caching service for AI results (in-process LRU with optional Redis tier)
+"""
+import hashlib
+import json
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from app.config import settings
+
+# Redis is optional - the in-process tier works without it
+try:
+    import redis.asyncio as aioredis
+    HAS_REDIS = True
+except ImportError:
+    HAS_REDIS = False
+
+
+class LRUCache:
+    """
+    In-process LRU cache with per-entry TTL and a total size budget
+
+    Entries are evicted least-recently-used first when either ``max_entries``
+    or ``max_bytes`` (sum of the sizes given to ``set``) is exceeded.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._data: "OrderedDict[str, Tuple[float, int, Any]]" = OrderedDict()
+        self.size_bytes = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+
+        expires_at, size, value = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            return None
+
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, size: int = 1, ttl: float = None):
+        if size > self.max_bytes:
+            return
+        if key in self._data:
+            self._remove(key)
+
+        expires_at = time.monotonic() + (ttl or self.ttl)
+        self._data[key] = (expires_at, size, value)
+        self.size_bytes += size
+
+        while len(self._data) > self.max_entries or self.size_bytes > self.max_bytes:
+            oldest_key = next(iter(self._data))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def _remove(self, key: str):
+        _, size, _ = self._data.pop(key)
+        self.size_bytes -= size
+
+    def clear(self):
+        self._data.clear()
+        self.size_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class RedisTier:
+    """Shared cache tier backed by Redis (JSON values)"""
+
+    def __init__(self, url: str, prefix: str, ttl: int):
+        self.prefix = prefix
+        self.ttl = ttl
+        self.client = aioredis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self.errors = 0
+
+    async def get(self, key: str) -> Optional[Any]:
+        try:
+            raw = await self.client.get(self.prefix + key)
+        except Exception as e:
+            # A broken shared tier must never fail the request
+            self.errors += 1
+            print(f"[CACHE] Redis get failed: {e}")
+            return None
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, key: str, value: Any):
+        try:
+            await self.client.set(self.prefix + key, json.dumps(value), ex=self.ttl)
+        except Exception as e:
+            self.errors += 1
+            print(f"[CACHE] Redis set failed: {e}")
+
+
+def create_redis_tier(prefix: str, ttl: int) -> Optional[RedisTier]:
+    """Build the shared Redis tier if enabled and available"""
+    if not settings.CACHE_REDIS_ENABLED:
+        return None
+    if not HAS_REDIS:
+        print("[CACHE] WARNING: redis package not installed. Using in-process cache only.")
+        return None
+    return RedisTier(settings.REDIS_URL, prefix, ttl)
+
+
+class AnalysisCache:
+    """
+    Content-addressed cache of image analysis results
+
+    Keyed by the SHA-256 of the compressed image bytes, so a retried or
+    double-submitted photo is answered without calling the model.
+    """
+
+    def __init__(self):
+        self.enabled = settings.ANALYSIS_CACHE_ENABLED
+        self.local = LRUCache(
+            max_entries=settings.ANALYSIS_CACHE_MAX_ENTRIES,
+            max_bytes=settings.ANALYSIS_CACHE_MAX_BYTES,
+            ttl=settings.ANALYSIS_CACHE_TTL
+        )
+        self.redis = create_redis_tier("fyf:analysis:", settings.ANALYSIS_CACHE_TTL)
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(image_bytes: bytes) -> str:
+        return hashlib.sha256(image_bytes).hexdigest()
+
+    async def get(self, key: str) -> Optional[Tuple[List[Dict], float]]:
+        """Look up a cached (detected_foods, confidence_score) result"""
+        if not self.enabled:
+            return None
+
+        value = self.local.get(key)
+        if value is None and self.redis is not None:
+            value = await self.redis.get(key)
+            if value is not None:
+                self.redis_hits += 1
+                self.local.set(key, value, size=len(json.dumps(value)))
+
+        if value is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        detected_foods, confidence_score = value
+        return detected_foods, confidence_score
+
+    async def set(self, key: str, detected_foods: List[Dict], confidence_score: float):
+        """Store a successful analysis result"""
+        # Empty results usually mean a model error - let the next try call the model
+        if not self.enabled or not detected_foods:
+            return
+
+        value = [detected_foods, confidence_score]
+        self.local.set(key, value, size=len(json.dumps(value)))
+        if self.redis is not None:
+            await self.redis.set(key, value)
+
+    def get_stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": len(self.local),
+            "size_bytes": self.local.size_bytes,
+            "evictions": self.local.evictions,
+            "redis_enabled": self.redis is not None,
+            "redis_errors": self.redis.errors if self.redis else 0,
+        }
+
+
+# Global analysis cache instance
+analysis_cache = AnalysisCache()
+
+
+# Words that don't change what a coach question asks
+CHAT_STOP_WORDS = frozenset("""
+a an the is are was were be been am do does did doing to of in on for at by with about
+i me you your we us it its this that these those what which how please can could would should
+tell explain hey hi hello coach calorai so just really very much also any some m ve ll re d
+""".split())
+
+# Messages revealing the user's own profile/health data are answered fresh and never stored
+PERSONAL_DATA_PATTERNS = [
+    re.compile(p, re.IGNORECASE) for p in [
+        r"[\w.+-]+@[\w-]+\.[\w.]+",  # email
+        r"(?:\+?\d[\s-]?){7,}",  # phone-like number runs
+        r"\b\d+(?:\.\d+)?\s*(?:kg|kgs|kilos?|lbs?|pounds?|cm|centimet(?:er|re)s?|ft|feet|foot|inch(?:es)?|in\b|years?|yrs?|y/?o)\b",
+        r"\d\s*'\s*\d",  # height like 5'10
+        r"\bmy\s+(?:name|age|weight|height|bmi|body|goal|target|diet plan|doctor|blood|sugar levels?|cholesterol|"
+        r"condition|diagnosis|medication|meds|pregnancy|allerg(?:y|ies))\b",
+        r"\bi(?:\s+am|'m|\s+was)\s+(?:\d|diabetic|pre-?diabetic|pregnant|allergic|lactose|overweight|obese|"
+        r"underweight|on\s+\w+)",
+        r"\bi\s+(?:weigh|have|suffer|take|was diagnosed|got diagnosed)\b",
+        r"\bmy\s+(?:son|daughter|wife|husband|child|kid|mother|father|mom|dad)\b",
+    ]
+]
+
+
+def normalize_chat_message(message: str) -> str:
+    """Fold case, accents, punctuation, whitespace and stop words: 'How much PROTEIN do I need?!' -> 'protein need'"""
+    text = unicodedata.normalize("NFKD", message)
+    text = "".join(ch for ch in text if not unicodedata.combining(ch)).lower()
+    words = re.findall(r"[a-z0-9]+", text)
+    # Word order is kept: "is fish better than chicken" must not answer the reverse question
+    return " ".join(word for word in words if word not in CHAT_STOP_WORDS)
+
+
+def contains_personal_data(message: str) -> bool:
+    return any(pattern.search(message) for pattern in PERSONAL_DATA_PATTERNS)
+
+
+class ChatResponseCache:
+    """
+    Cache of AI Coach answers to frequently asked, generic questions
+
+    Keyed on the normalized message text. Messages that contain personal
+    profile data (measurements, conditions, contact details) bypass the
+    cache in both directions.
+    """
+
+    def __init__(self):
+        self.enabled = settings.CHAT_CACHE_ENABLED
+        self.local = LRUCache(
+            max_entries=settings.CHAT_CACHE_MAX_ENTRIES,
+            max_bytes=settings.CHAT_CACHE_MAX_BYTES,
+            ttl=settings.CHAT_CACHE_TTL
+        )
+        self.redis = create_redis_tier("fyf:chat:", settings.CHAT_CACHE_TTL)
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+    def make_key(self, message: str) -> Optional[str]:
+        """Cache key for a message, or None if it must not be cached"""
+        if not self.enabled:
+            return None
+        if contains_personal_data(message):
+            self.bypassed += 1
+            return None
+        normalized = normalize_chat_message(message)
+        if not normalized:
+            return None
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+    async def get(self, key: Optional[str]) -> Optional[str]:
+        if key is None:
+            return None
+
+        value = self.local.get(key)
+        if value is None and self.redis is not None:
+            value = await self.redis.get(key)
+            if value is not None:
+                self.redis_hits += 1
+                self.local.set(key, value, size=len(value.encode("utf-8")))
+
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    async def set(self, key: Optional[str], response: str):
+        """Store a successful answer (callers must not pass fallback/error texts)"""
+        if key is None or not response:
+            return
+        self.local.set(key, response, size=len(response.encode("utf-8")))
+        if self.redis is not None:
+            await self.redis.set(key, response)
+
+    def get_stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "bypassed_personal": self.bypassed,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": len(self.local),
+            "size_bytes": self.local.size_bytes,
+            "evictions": self.local.evictions,
+            "redis_enabled": self.redis is not None,
+            "redis_errors": self.redis.errors if self.redis else 0,
+        }
+
+
+# Global chat response cache instance
+chat_cache = ChatResponseCache()
@@ -0,0 +1,369 @@
+"""
+In-memory food name index over the food_items nutrition table
+
+Lookups try, in order:
+  1. exact name match
+  2. normalized match (case, accents, punctuation and spacing folded)
+  3. fuzzy match: candidates sharing the most character trigrams with the
+     query (counted over the rarest trigrams first, up to a fixed number of
+     postings) are re-ranked by bounded edit distance
+
+The index is an immutable snapshot rebuilt from the database at startup,
+every FOOD_INDEX_REFRESH_SECONDS, and shortly after any committed change to
+food_items (tracked through SQLAlchemy session events). Rows are streamed
+in partitions and the snapshot is built on a worker thread, so a reload of a
+large catalogue doesn't stall requests. Readers never lock: a rebuild swaps
+in a new snapshot in one assignment.
+"""
+import asyncio
+import bisect
+import heapq
+import math
+import re
+import time
+import unicodedata
+from collections import OrderedDict, defaultdict
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.models import FoodItem
+
+
+NON_ALNUM = re.compile(r"[^a-z0-9]+")
+
+
+def normalize_name(name: str) -> str:
+    """Fold case, accents, punctuation and whitespace: 'Pâni-Puri ' -> 'pani puri'"""
+    if not name.isascii():
+        name = unicodedata.normalize("NFKD", name)
+        name = "".join(ch for ch in name if not unicodedata.combining(ch))
+    return NON_ALNUM.sub(" ", name.lower()).strip()
+
+
+def trigrams(normalized: str) -> set:
+    """Character trigrams of a normalized name, padded so short words still match"""
+    padded = f"  {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def bounded_edit_distance(a: str, b: str, limit: int) -> int:
+    """Levenshtein distance, giving up (returning limit + 1) once it exceeds limit"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    if len(a) < len(b):
+        a, b = b, a
+
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        row_min = i
+        for j, cb in enumerate(b, 1):
+            cost = previous[j - 1] + (ca != cb)
+            # Inlined min(): this loop is the hot path of fuzzy lookups
+            if previous[j] < cost:
+                cost = previous[j] + 1
+            if current[j - 1] < cost:
+                cost = current[j - 1] + 1
+            current.append(cost)
+            if cost < row_min:
+                row_min = cost
+        if row_min > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+# Columns the snapshot keeps (full rows would also load descriptions and JSON blobs)
+INFO_COLUMNS = [
+    FoodItem.id, FoodItem.name, FoodItem.category, FoodItem.calories_per_100g,
+    FoodItem.protein, FoodItem.carbs, FoodItem.fats, FoodItem.fiber, FoodItem.sugar,
+    FoodItem.sodium, FoodItem.region, FoodItem.dietary_tags, FoodItem.common_serving_size,
+]
+
+
+def food_item_info(item) -> Dict:
+    """Serializable nutrition info for a FoodItem row (or a row of INFO_COLUMNS)"""
+    return {
+        "id": item.id,
+        "name": item.name,
+        "category": item.category,
+        "calories_per_100g": item.calories_per_100g,
+        "protein": item.protein,
+        "carbs": item.carbs,
+        "fats": item.fats,
+        "fiber": item.fiber,
+        "sugar": item.sugar,
+        "sodium": item.sodium,
+        "region": item.region,
+        # A tuple keeps the dict atomic, so the garbage collector doesn't track
+        # (and rescan on every full collection) each of the catalogue's entries
+        "dietary_tags": tuple(item.dietary_tags or ()),
+        "common_serving_size": item.common_serving_size,
+    }
+
+
+class FoodIndexSnapshot:
+    """
+    Read-only lookup structures built from one load of food_items
+
+    Items are ordered by normalized key length (stable, so row order still
+    decides between duplicates). Every posting list is therefore sorted by
+    length too, and fuzzy lookups bisect it down to the lengths that could
+    still be within the edit-distance limit.
+    """
+
+    def __init__(self, items: List[Dict]):
+        keyed = sorted(((normalize_name(item["name"]), item) for item in items), key=lambda pair: len(pair[0]))
+        self.items = [item for _, item in keyed]
+        self.keys: List[str] = [key for key, _ in keyed]  # normalized key per item
+        self.exact: Dict[str, int] = {}
+        self.normalized: Dict[str, int] = {}
+        # length_starts[n]: first position whose key is at least n characters long
+        self.length_starts: List[int] = []
+        postings = defaultdict(list)
+
+        for position, (key, item) in enumerate(keyed):
+            while len(self.length_starts) <= len(key):
+                self.length_starts.append(position)
+            # First row wins for duplicate names
+            self.exact.setdefault(item["name"], position)
+            self.normalized.setdefault(key, position)
+            for gram in trigrams(key):
+                postings[gram].append(position)
+        self.length_starts.append(len(keyed))
+        self.postings: Dict[str, List[int]] = dict(postings)
+
+    def length_start(self, length: int) -> int:
+        """First position whose key has at least `length` characters"""
+        if length >= len(self.length_starts):
+            return len(self.items)
+        return self.length_starts[max(length, 0)]
+
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+
+class FoodNameIndex:
+    """Startup-loaded, read-optimized name -> nutrition info index"""
+
+    # Fuzzy candidates re-ranked by edit distance per lookup
+    MAX_CANDIDATES = 16
+    # Posting-list entries counted per fuzzy lookup (rarest trigrams first)
+    MAX_POSTINGS_SCANNED = 5000
+    # Rows fetched per partition while reloading
+    LOAD_PARTITION_SIZE = 1000
+    # Memoized fuzzy results (query -> position), reset with each snapshot
+    FUZZY_CACHE_SIZE = 4096
+
+    def __init__(self, min_similarity: float, refresh_seconds: float):
+        self.min_similarity = min_similarity
+        self.refresh_seconds = refresh_seconds
+        self._snapshot = FoodIndexSnapshot([])
+        self._fuzzy_cache: "OrderedDict[str, Optional[Tuple[int, float]]]" = OrderedDict()
+        self._stale = False
+        self._refresh_task: Optional[asyncio.Task] = None
+
+        self.loaded_at: Optional[float] = None
+        self.build_ms = 0.0
+        self.lookups = {"exact": 0, "normalized": 0, "fuzzy": 0, "miss": 0}
+
+    # ---- loading -------------------------------------------------------
+
+    async def refresh(self, db: AsyncSession) -> int:
+        """Reload food_items and swap in a new snapshot (built off the event loop)"""
+        self._stale = False
+        items = []
+        result = await db.stream(select(*INFO_COLUMNS).order_by(FoodItem.id))
+        async for partition in result.partitions(self.LOAD_PARTITION_SIZE):
+            items.extend(food_item_info(row) for row in partition)
+
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        snapshot = await loop.run_in_executor(None, FoodIndexSnapshot, items)
+        self.build_ms = (time.perf_counter() - start) * 1000
+
+        self._snapshot = snapshot
+        self._fuzzy_cache = OrderedDict()
+        self.loaded_at = time.time()
+        return len(snapshot)
+
+    def invalidate(self):
+        """Mark the snapshot stale; the refresher reloads it within a second or so"""
+        self._stale = True
+
+    async def _refresh_loop(self, session_factory):
+        last_refresh = time.monotonic()
+        while True:
+            await asyncio.sleep(1.0)
+            due = time.monotonic() - last_refresh >= self.refresh_seconds
+            if not (self._stale or due):
+                continue
+            try:
+                async with session_factory() as db:
+                    await self.refresh(db)
+            except Exception as e:
+                print(f"[WARN] Food index refresh failed: {e}")
+            last_refresh = time.monotonic()
+
+    def start_refresher(self, session_factory):
+        """Start periodic / on-invalidation reloads on the running event loop"""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh_loop(session_factory))
+
+    async def stop_refresher(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+
+    # ---- lookups -------------------------------------------------------
+
+    def _fuzzy(self, snapshot: FoodIndexSnapshot, key: str) -> Optional[Tuple[int, float]]:
+        # Only keys of these lengths can be within the edit-distance limit
+        first = snapshot.length_start(len(key) - int(len(key) * (1 - self.min_similarity)))
+        end = snapshot.length_start(int(len(key) / max(self.min_similarity, 0.01)) + 1)
+        spans = []
+        for gram in trigrams(key):
+            positions = snapshot.postings.get(gram)
+            if positions:
+                start = bisect.bisect_left(positions, first)
+                stop = bisect.bisect_left(positions, end, start)
+                if stop > start:
+                    spans.append((stop - start, positions, start, stop))
+        # Rarest trigrams first: they are the most selective, and the common
+        # ones ("  c", "ice") would otherwise make one lookup scan the catalogue
+        spans.sort(key=lambda span: span[0])
+        shared: Dict[int, int] = {}
+        scanned = 0
+        for count, positions, start, stop in spans:
+            if scanned and scanned + count > self.MAX_POSTINGS_SCANNED:
+                break
+            scanned += count
+            for position in positions[start:stop]:
+                shared[position] = shared.get(position, 0) + 1
+        if not shared:
+            return None
+
+        candidates = heapq.nlargest(self.MAX_CANDIDATES, shared, key=shared.__getitem__)
+
+        best = None
+        for position in candidates:
+            other = snapshot.keys[position]
+            longest = max(len(key), len(other))
+            # Largest distance that still meets min_similarity (and beats the best so far)
+            limit = int(longest * (1 - self.min_similarity))
+            if best is not None:
+                limit = min(limit, math.ceil(longest * (1 - best[1])) - 1)
+            distance = bounded_edit_distance(key, other, limit)
+            if distance > limit:
+                continue
+            similarity = 1 - distance / longest
+            if best is None or similarity > best[1]:
+                best = (position, similarity)
+        return best
+
+    @staticmethod
+    def _result(snapshot: FoodIndexSnapshot, position: int, match: str, similarity: float) -> Dict:
+        item = snapshot.items[position]
+        return {**item, "dietary_tags": list(item["dietary_tags"]), "match": match, "similarity": similarity}
+
+    def lookup(self, name: str) -> Optional[Dict]:
+        """
+        Resolve a food name to its nutrition info
+
+        Returns:
+            Copy of the food's info plus "match" (exact/normalized/fuzzy) and
+            "similarity", or None if nothing is close enough
+        """
+        if not name:
+            return None
+        snapshot = self._snapshot
+
+        position = snapshot.exact.get(name)
+        if position is not None:
+            self.lookups["exact"] += 1
+            return self._result(snapshot, position, "exact", 1.0)
+
+        key = normalize_name(name)
+        position = snapshot.normalized.get(key)
+        if position is not None:
+            self.lookups["normalized"] += 1
+            return self._result(snapshot, position, "normalized", 1.0)
+
+        cache = self._fuzzy_cache
+        if key in cache:
+            cache.move_to_end(key)
+            result = cache[key]
+        else:
+            result = self._fuzzy(snapshot, key) if key else None
+            if snapshot is self._snapshot:
+                cache[key] = result
+                if len(cache) > self.FUZZY_CACHE_SIZE:
+                    cache.popitem(last=False)
+
+        if result is None:
+            self.lookups["miss"] += 1
+            return None
+        self.lookups["fuzzy"] += 1
+        position, similarity = result
+        return self._result(snapshot, position, "fuzzy", round(similarity, 3))
+
+    def __len__(self) -> int:
+        return len(self._snapshot)
+
+    def get_stats(self) -> Dict:
+        return {
+            "entries": len(self._snapshot),
+            "loaded_at": self.loaded_at,
+            "build_ms": round(self.build_ms, 2),
+            "stale": self._stale,
+            "lookups": dict(self.lookups),
+        }
+
+
+# Global food name index instance
+food_index = FoodNameIndex(
+    min_similarity=settings.FOOD_INDEX_MIN_SIMILARITY,
+    refresh_seconds=settings.FOOD_INDEX_REFRESH_SECONDS
+)
+
+
+# ---- invalidation ------------------------------------------------------
+
+def _touches_food_items(session: Session) -> bool:
+    return any(
+        isinstance(obj, FoodItem)
+        for obj in (*session.new, *session.dirty, *session.deleted)
+    )
+
+
+@event.listens_for(Session, "before_flush")
+def _track_food_item_changes(session, flush_context, instances):
+    if _touches_food_items(session):
+        session.info["food_items_changed"] = True
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_food_item_statements(orm_execute_state):
+    # Bulk insert/update/delete statements bypass the unit of work
+    if orm_execute_state.is_select:
+        return
+    if any(mapper.class_ is FoodItem for mapper in orm_execute_state.all_mappers):
+        orm_execute_state.session.info["food_items_changed"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_food_index(session):
+    if session.info.pop("food_items_changed", False):
+        food_index.invalidate()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_food_item_changes(session):
+    session.info.pop("food_items_changed", None)
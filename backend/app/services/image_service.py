@@ -3,7 +3,12 @@ Image processing service for handling uploads and storage
 """
 import os
 import uuid
+import time
 import shutil
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 from pathlib import Path
 try:
     from PIL import Image
@@ -11,8 +16,235 @@ try:
 except ImportError:
     HAS_PIL = False
 from io import BytesIO
-from typing import Tuple
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple, Union
 from app.config import settings
+from app.services.memory_profiler import memory_profiler
+from app.services.metrics import image_stage_seconds
+
+
+# Longest side of stored images
+MAX_DIMENSION = 1920
+
+# Classifier preprocessing: resize shorter side, then center crop
+MODEL_RESIZE = 256
+
+# Grey levels (0-255) a dHash thumbnail must span to carry any structure
+DHASH_MIN_CONTRAST = 12
+
+
+class UploadTooLargeError(ValueError):
+    """Upload exceeds MAX_UPLOAD_SIZE"""
+
+
+class UnsupportedImageTypeError(ValueError):
+    """Upload is not an allowed image format (checked by content, not name)"""
+
+
+# Magic byte signatures -> canonical extension
+def sniff_image_type(head: bytes) -> Optional[str]:
+    """Identify the image format from the first bytes of a file"""
+    if head.startswith(b"\xff\xd8\xff"):
+        return ".jpg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return ".png"
+    if head[4:8] == b"ftyp" and head[8:12] in (b"heic", b"heix", b"hevc", b"hevx", b"mif1", b"msf1"):
+        return ".heic"
+    return None
+
+
+@dataclass
+class ProcessedImage:
+    """
+    Result of the upload processing pipeline
+    
+    Everything downstream consumers need comes from a single decode: the
+    stored JPEG (also the Gemini payload) and, if requested, the
+    model-sized RGB crop for a local classifier.
+    """
+    file_path: str
+    compressed_bytes: bytes
+    phash: Optional[int] = None
+    size: Optional[Tuple[int, int]] = None  # (width, height) of the stored image
+    model_input: Optional[Any] = None  # RGB PIL image of model_input_size x model_input_size
+    derivative_paths: Dict[str, str] = field(default_factory=dict)  # derivative name -> file path
+    timings: Dict[str, float] = field(default_factory=dict)  # stage -> seconds
+    
+    @property
+    def gemini_payload(self) -> Dict:
+        """Inline JPEG blob for Gemini (no decode/re-encode in the SDK)"""
+        return {"mime_type": "image/jpeg", "data": self.compressed_bytes}
+
+
+def compute_dhash(image) -> Optional[int]:
+    """
+    Compute a 64-bit difference hash (dHash) of an image
+    
+    Near-identical photos of the same plate differ in only a few bits.
+    Flat images (solid colours, very dark or blown-out shots) have no
+    gradients to hash; they get None so they never match each other.
+    """
+    small = image.convert("L").resize((9, 8), Image.Resampling.BILINEAR)
+    pixels = list(small.getdata())
+    if max(pixels) - min(pixels) < DHASH_MIN_CONTRAST:
+        return None
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return value
+
+
+def make_model_input(image, crop_size: int):
+    """Resize shorter side to MODEL_RESIZE and center crop (classifier preprocessing)"""
+    width, height = image.size
+    scale = MODEL_RESIZE / min(width, height)
+    resized = image.resize(
+        (max(crop_size, round(width * scale)), max(crop_size, round(height * scale))),
+        Image.Resampling.BILINEAR,
+        reducing_gap=2.0
+    )
+    left = (resized.width - crop_size) // 2
+    top = (resized.height - crop_size) // 2
+    return resized.crop((left, top, left + crop_size, top + crop_size))
+
+
+def derivative_path(file_path: str, name: str, image_format: str) -> str:
+    """File path of a resized derivative, e.g. <stem>_thumb.webp"""
+    path = Path(file_path)
+    ext = ".webp" if image_format == "webp" else ".jpg"
+    return str(path.with_name(f"{path.stem}_{name}{ext}"))
+
+
+def write_derivatives(image, file_path: str, sizes: Dict[str, int], image_format: str) -> Dict[str, str]:
+    """Write downscaled copies of the stored image for list/detail views"""
+    paths = {}
+    for name, max_side in sorted(sizes.items(), key=lambda item: -item[1]):
+        if max(image.size) > max_side:
+            # Chain from the previous (larger) derivative to keep resizes cheap
+            image = image.copy()
+            image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS, reducing_gap=2.0)
+        path = derivative_path(file_path, name, image_format)
+        if image_format == "webp":
+            image.save(path, format="WEBP", quality=80, method=4)
+        else:
+            image.save(path, format="JPEG", quality=80, optimize=True)
+        paths[name] = path
+    return paths
+
+
+@contextmanager
+def image_stage(timings: Dict[str, float], stage: str):
+    """Time one processing stage (memory is tracked too when the memory profiler is on)"""
+    start = time.perf_counter()
+    with memory_profiler.stage(f"save_image.{stage}"):
+        yield
+    timings[stage] = time.perf_counter() - start
+
+
+def process_image(file_data: Union[bytes, BinaryIO], file_path: str,
+                  model_input_size: Optional[int] = None) -> ProcessedImage:
+    """
+    Decode, downscale and JPEG-encode an upload, then write it to disk
+    
+    The upload is decoded exactly once. Large JPEGs are decoded at reduced
+    scale (DCT draft mode) when the stored size allows it.
+    
+    CPU-bound; runs on the ImageService worker pool. Kept at module level so
+    it can be shipped to a process pool.
+    """
+    timings = {}
+    if isinstance(file_data, (bytes, bytearray)):
+        file_data = BytesIO(file_data)
+    file_data.seek(0)
+    
+    if not HAS_PIL:
+        # Fallback: Save raw bytes if PIL is missing
+        with image_stage(timings, "write"):
+            with open(file_path, "wb") as f:
+                shutil.copyfileobj(file_data, f)
+        file_data.seek(0)
+        return ProcessedImage(file_path, file_data.read(), timings=timings)
+    
+    with image_stage(timings, "decode"):
+        image = Image.open(file_data)
+        if image.format == "JPEG" and max(image.size) > MAX_DIMENSION:
+            # Let libjpeg scale by 1/2, 1/4 or 1/8 while decoding, never below the stored size
+            ratio = MAX_DIMENSION / max(image.size)
+            image.draft("RGB", (round(image.width * ratio), round(image.height * ratio)))
+        image.load()
+    
+    # Resize if too large (max 1920px on longest side)
+    with image_stage(timings, "resize"):
+        if max(image.size) > MAX_DIMENSION:
+            image.thumbnail((MAX_DIMENSION, MAX_DIMENSION), Image.Resampling.LANCZOS)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+    
+    with image_stage(timings, "phash"):
+        phash = compute_dhash(image)
+    
+    model_input = None
+    if model_input_size:
+        with image_stage(timings, "model_input"):
+            model_input = make_model_input(image, model_input_size)
+    
+    # Encode once, then write the same buffer to disk
+    with image_stage(timings, "encode"):
+        output = BytesIO()
+        image.save(output, format="JPEG", quality=85, optimize=True)
+        compressed_bytes = output.getvalue()
+    
+    with image_stage(timings, "write"):
+        with open(file_path, "wb") as f:
+            f.write(compressed_bytes)
+    
+    return ProcessedImage(
+        file_path=file_path,
+        compressed_bytes=compressed_bytes,
+        phash=phash,
+        size=image.size,
+        model_input=model_input,
+        timings=timings
+    )
+
+
+def write_stored_derivatives(file_path: str, sizes: Dict[str, int], image_format: str) -> Dict[str, str]:
+    """
+    Write the derivatives of a JPEG already written by process_image
+    
+    Runs after the analysis response (or in a job worker), so the request
+    path only pays for the stored JPEG. The stored image is decoded at
+    reduced scale when the largest derivative allows it.
+    """
+    if not HAS_PIL or not sizes:
+        return {}
+    with Image.open(file_path) as stored:
+        ratio = max(sizes.values()) / max(stored.size)
+        if ratio < 1:
+            stored.draft("RGB", (round(stored.width * ratio), round(stored.height * ratio)))
+        image = stored.convert("RGB")
+    return write_derivatives(image, file_path, sizes, image_format)
+
+
+def load_stored_image(file_path: str, model_input_size: Optional[int] = None) -> ProcessedImage:
+    """
+    Rebuild a ProcessedImage from a JPEG already written by process_image
+
+    Used by queued analysis jobs, whose upload was processed by the HTTP tier.
+    """
+    with open(file_path, "rb") as f:
+        compressed_bytes = f.read()
+    if not HAS_PIL:
+        return ProcessedImage(file_path, compressed_bytes)
+    
+    image = Image.open(BytesIO(compressed_bytes))
+    model_input = None
+    if model_input_size:
+        image = image.convert("RGB")
+        model_input = make_model_input(image, model_input_size)
+    return ProcessedImage(file_path, compressed_bytes, size=image.size, model_input=model_input)
 
 
 class ImageService:
@@ -21,60 +253,148 @@ class ImageService:
     def __init__(self):
         self.upload_dir = Path(settings.UPLOAD_DIR)
         self.upload_dir.mkdir(parents=True, exist_ok=True)
+        self._executor: Optional[Executor] = None
+        
+        # Per-stage timing totals (seconds) for monitoring
+        self.processed = 0
+        self.stage_totals: Dict[str, float] = {}
+    
+    @property
+    def executor(self) -> Executor:
+        """Worker pool for image processing, sized to the available cores"""
+        if self._executor is None:
+            workers = settings.IMAGE_WORKERS or os.cpu_count() or 1
+            if settings.IMAGE_EXECUTOR == "process":
+                self._executor = ProcessPoolExecutor(max_workers=workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image")
+        return self._executor
+    
+    def _check_type(self, head: bytes, filename: str) -> str:
+        """Validate the real file format from its magic bytes"""
+        file_ext = sniff_image_type(head)
+        if file_ext is None:
+            raise UnsupportedImageTypeError(f"{filename or 'Upload'} is not a recognized image file")
+        if file_ext not in settings.ALLOWED_EXTENSIONS:
+            raise UnsupportedImageTypeError(f"File type {file_ext} not allowed. Allowed: {settings.ALLOWED_EXTENSIONS}")
+        return file_ext
+    
+    def validate_upload(self, upload) -> BinaryIO:
+        """
+        Check the size and real format of a received upload, in place
+        
+        Starlette has already received and spooled the multipart body by the
+        time a handler runs (in memory, or a temp file for larger parts), so
+        the spooled file is validated and used directly instead of being
+        copied. Body size is capped while it streams in by the
+        LimitUploadSize middleware. Starlette closes the file after the request.
+        """
+        file = upload.file
+        size = upload.size
+        if size is None:
+            size = file.seek(0, os.SEEK_END)
+        if size > settings.MAX_UPLOAD_SIZE:
+            raise UploadTooLargeError(
+                f"File size exceeds maximum allowed size of {settings.MAX_UPLOAD_SIZE} bytes"
+            )
+        file.seek(0)
+        self._check_type(file.read(16), upload.filename)
+        file.seek(0)
+        return file
     
-    async def save_image(self, file_bytes: bytes, filename: str) -> Tuple[str, bytes]:
+    async def save_image(self, file: Union[bytes, BinaryIO], filename: str = None,
+                         model_input_size: Optional[int] = None) -> ProcessedImage:
         """
         Save uploaded image with compression
         
+        Decoding, resizing and encoding run on a worker pool so they don't
+        block the event loop.
+        
+        Args:
+            file: Image bytes, or an upload's file from validate_upload (already validated)
+            model_input_size: Also produce a center-cropped model input of this size
+        
         Returns:
-            Tuple of (file_path, compressed_bytes)
+            ProcessedImage with file path, compressed bytes, perceptual hash
+            (None without PIL), model input and per-stage timings
         """
-        # Validate file size
-        if len(file_bytes) > settings.MAX_UPLOAD_SIZE:
-            raise ValueError(f"File size exceeds maximum allowed size of {settings.MAX_UPLOAD_SIZE} bytes")
+        with memory_profiler.stage("save_image", unit=True):
+            if isinstance(file, (bytes, bytearray)):
+                # Validate file size and real format
+                if len(file) > settings.MAX_UPLOAD_SIZE:
+                    raise UploadTooLargeError(
+                        f"File size exceeds maximum allowed size of {settings.MAX_UPLOAD_SIZE} bytes"
+                    )
+                file_ext = self._check_type(file[:16], filename)
+            else:
+                file_ext = sniff_image_type(file.read(16)) or ".jpg"
+                file.seek(0)
+                if settings.IMAGE_EXECUTOR == "process":
+                    # Buffers can't cross process boundaries
+                    file = file.read()
         
-        # Generate unique filename
-        file_ext = Path(filename).suffix.lower()
-        if file_ext not in settings.ALLOWED_EXTENSIONS:
-            raise ValueError(f"File type {file_ext} not allowed. Allowed: {settings.ALLOWED_EXTENSIONS}")
+            # Everything is stored as JPEG
+            stored_ext = ".jpg" if HAS_PIL else file_ext
+            file_path = self.upload_dir / f"{uuid.uuid4().hex}{stored_ext}"
         
-        unique_filename = f"{uuid.uuid4().hex}{file_ext}"
-        file_path = self.upload_dir / unique_filename
+            # Compress and save image
+            try:
+                loop = asyncio.get_running_loop()
+                queued_at = time.perf_counter()
+                result = await loop.run_in_executor(
+                    self.executor,
+                    process_image,
+                    file,
+                    str(file_path),
+                    model_input_size
+                )
+            except Exception as e:
+                raise ValueError(f"Error processing image: {str(e)}")
         
-        # Compress and save image
-        try:
-            if not HAS_PIL:
-                # Fallback: Save raw bytes if PIL is missing
-                with open(file_path, "wb") as f:
-                    f.write(file_bytes)
-                return str(file_path), file_bytes
-
-            image = Image.open(BytesIO(file_bytes))
-            
-            # Convert HEIC or other formats to JPEG
-            if image.format not in ["JPEG", "PNG"]:
-                image = image.convert("RGB")
-                unique_filename = f"{uuid.uuid4().hex}.jpg"
-                file_path = self.upload_dir / unique_filename
-            
-            # Resize if too large (max 1920px on longest side)
-            max_dimension = 1920
-            if max(image.size) > max_dimension:
-                image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
-            
-            # Save with compression
-            output = BytesIO()
-            if image.mode in ("RGBA", "LA", "P"):
-                image = image.convert("RGB")
-            
-            image.save(file_path, format="JPEG", quality=85, optimize=True)
-            image.save(output, format="JPEG", quality=85, optimize=True)
-            compressed_bytes = output.getvalue()
-            
-            return str(file_path), compressed_bytes
-            
-        except Exception as e:
-            raise ValueError(f"Error processing image: {str(e)}")
+            # Time spent waiting for a free worker
+            result.timings["queue"] = max(
+                0.0, time.perf_counter() - queued_at - sum(result.timings.values())
+            )
+            self._record_timings(result.timings)
+            return result
+    
+    async def write_derivatives(self, file_path: str) -> Dict[str, str]:
+        """Write the list/detail-size copies of a stored upload (derivative name -> path)"""
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        paths = await loop.run_in_executor(
+            self.executor,
+            write_stored_derivatives,
+            file_path,
+            settings.IMAGE_DERIVATIVE_SIZES,
+            settings.IMAGE_DERIVATIVE_FORMAT
+        )
+        image_stage_seconds.observe(time.perf_counter() - start, "derivatives")
+        return paths
+    
+    async def load_image(self, file_path: str, phash: Optional[int] = None,
+                         model_input_size: Optional[int] = None) -> ProcessedImage:
+        """Load a stored upload back for analysis (decode runs on the worker pool)"""
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(self.executor, load_stored_image, file_path, model_input_size)
+        result.phash = phash
+        return result
+    
+    def _record_timings(self, timings: Dict[str, float]):
+        self.processed += 1
+        for stage, seconds in timings.items():
+            self.stage_totals[stage] = self.stage_totals.get(stage, 0.0) + seconds
+            image_stage_seconds.observe(seconds, stage)
+    
+    def get_stats(self) -> Dict:
+        """Average per-stage upload processing time in milliseconds"""
+        return {
+            "processed": self.processed,
+            "avg_stage_ms": {
+                stage: round(1000 * total / self.processed, 2)
+                for stage, total in self.stage_totals.items()
+            } if self.processed else {},
+        }
     
     def get_image_url(self, file_path: str) -> str:
         """
@@ -85,10 +405,28 @@ class ImageService:
         # In production: upload to S3 and return public URL
         return f"/uploads/{Path(file_path).name}"
     
+    def get_image_urls(self, image_url: str, derivatives: Optional[List[str]] = None) -> Dict[str, str]:
+        """
+        URLs of the original image and each derivative written for it
+        
+        `derivatives` is the scan's image_derivatives (names recorded once
+        the files exist), so no filesystem checks are needed. Scans without
+        derivatives (older ones, or ones still being processed) only get
+        "original".
+        """
+        urls = {"original": image_url}
+        if not image_url.startswith("/uploads/"):
+            return urls
+        for name in derivatives or ():
+            urls[name] = self.get_image_url(derivative_path(image_url, name, settings.IMAGE_DERIVATIVE_FORMAT))
+        return urls
+    
     def delete_image(self, file_path: str):
-        """Delete image from storage"""
+        """Delete image and its derivatives from storage"""
         try:
             Path(file_path).unlink(missing_ok=True)
+            for name in settings.IMAGE_DERIVATIVE_SIZES:
+                Path(derivative_path(file_path, name, settings.IMAGE_DERIVATIVE_FORMAT)).unlink(missing_ok=True)
         except Exception as e:
             print(f"Error deleting image: {e}")
 
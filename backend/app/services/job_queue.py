@@ -0,0 +1,135 @@
+"""
+Durable analysis job queue backed by the analysis_jobs table
+
+The HTTP tier enqueues jobs; workers (in-process or separate processes
+sharing the database) claim them with a lease. A claim is a conditional
+UPDATE, so two workers can never both win the same job, on SQLite or
+Postgres. A worker that dies mid-job simply stops renewing its lease and
+the job is picked up again once the lease expires, so queued and running
+jobs survive restarts.
+"""
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+from sqlalchemy import and_, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models import AnalysisJob
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+FINISHED_STATES = (SUCCEEDED, FAILED)
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class AnalysisJobQueue:
+    """Enqueue, claim, renew and finish analysis jobs"""
+
+    def _runnable(self, now: datetime):
+        # Queued and due, or running under a lease nobody renewed
+        return or_(
+            and_(AnalysisJob.status == QUEUED, AnalysisJob.available_at <= now),
+            and_(AnalysisJob.status == RUNNING, AnalysisJob.lease_expires_at < now)
+        )
+
+    async def enqueue(self, db: AsyncSession, user_id: int, image_path: str, image_url: str,
+                      image_phash: Optional[int] = None) -> AnalysisJob:
+        """Add a job for a stored upload (committed before returning)"""
+        job = AnalysisJob(
+            id=uuid.uuid4().hex,
+            user_id=user_id,
+            image_path=image_path,
+            image_url=image_url,
+            image_phash=image_phash,
+            status=QUEUED,
+            available_at=utcnow()
+        )
+        db.add(job)
+        await db.commit()
+        return job
+
+    async def get(self, db: AsyncSession, job_id: str) -> Optional[AnalysisJob]:
+        result = await db.execute(
+            select(AnalysisJob)
+            .where(AnalysisJob.id == job_id)
+            .execution_options(populate_existing=True)
+        )
+        return result.scalar_one_or_none()
+
+    async def claim(self, db: AsyncSession, worker_id: str, limit: int, lease_seconds: float) -> List[AnalysisJob]:
+        """Lease up to `limit` runnable jobs, oldest first"""
+        now = utcnow()
+        result = await db.execute(
+            select(AnalysisJob.id)
+            .where(self._runnable(now))
+            .order_by(AnalysisJob.available_at)
+            .limit(limit * 2)  # Some candidates may be taken by other workers
+        )
+        claimed = []
+        for job_id in result.scalars().all():
+            won = await db.execute(
+                update(AnalysisJob)
+                .where(AnalysisJob.id == job_id, self._runnable(now))
+                .values(
+                    status=RUNNING,
+                    worker_id=worker_id,
+                    lease_expires_at=now + timedelta(seconds=lease_seconds),
+                    attempts=AnalysisJob.attempts + 1,
+                    started_at=now
+                )
+            )
+            if won.rowcount == 1:
+                claimed.append(job_id)
+                if len(claimed) == limit:
+                    break
+        await db.commit()
+        if not claimed:
+            return []
+
+        result = await db.execute(
+            select(AnalysisJob)
+            .where(AnalysisJob.id.in_(claimed))
+            .execution_options(populate_existing=True)
+        )
+        return list(result.scalars().all())
+
+    async def renew(self, db: AsyncSession, job_id: str, worker_id: str, lease_seconds: float) -> bool:
+        """Extend a held lease; False if the job was reclaimed by someone else"""
+        result = await db.execute(
+            update(AnalysisJob)
+            .where(AnalysisJob.id == job_id, AnalysisJob.worker_id == worker_id, AnalysisJob.status == RUNNING)
+            .values(lease_expires_at=utcnow() + timedelta(seconds=lease_seconds))
+        )
+        await db.commit()
+        return result.rowcount == 1
+
+    async def finish(self, db: AsyncSession, job_id: str, worker_id: str, status: str,
+                     scan_id: Optional[int] = None, error: Optional[Dict] = None,
+                     retry_in: Optional[float] = None) -> bool:
+        """
+        Record a job's outcome if this worker still holds it (not committed)
+
+        With `retry_in` the job goes back to the queue, due after that many
+        seconds. Returns False if the lease was lost, in which case the
+        caller must roll back its work.
+        """
+        values = {"worker_id": None, "lease_expires_at": None, "error": error}
+        if retry_in is not None:
+            values.update(status=QUEUED, available_at=utcnow() + timedelta(seconds=retry_in))
+        else:
+            values.update(status=status, scan_id=scan_id, finished_at=utcnow())
+        result = await db.execute(
+            update(AnalysisJob)
+            .where(AnalysisJob.id == job_id, AnalysisJob.worker_id == worker_id, AnalysisJob.status == RUNNING)
+            .values(**values)
+        )
+        return result.rowcount == 1
+
+
+# Global job queue instance
+analysis_jobs = AnalysisJobQueue()
@@ -0,0 +1,332 @@
+"""
+Memory instrumentation for the image path
+
+When MEMORY_PROFILER_ENABLED is set, tracemalloc traces Python allocations
+and every request records its RSS delta and how far it pushed the process's
+peak RSS. While tracing, each request and each image stage (save_image and
+its decode/resize/encode/... steps, analyze_image) also records its traced
+peak: the most Python memory held at once above what was allocated when it
+started. Every MEMORY_PROFILER_SNAPSHOT_EVERY-th run of a
+route or stage takes tracemalloc snapshots at its start and end; their
+difference gives its top allocation sites.
+
+tracemalloc only sees allocations made through Python's allocators. Pillow
+keeps decoded pixels in its own C buffers, which only show up in the RSS
+figures.
+
+Peaks are process-wide: a sample is "clean" only if no other request or
+job, and no profiler snapshot, overlapped it. Averages and maxima use clean
+samples when there are any. For exact per-stage numbers, run the pipeline
+serially with python -m app.cli.memprofile.
+"""
+import os
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Set
+try:
+    import resource
+    HAS_RESOURCE = True
+except ImportError:
+    HAS_RESOURCE = False
+from app.config import settings
+
+# Set while a request is tracked, so stages inside it don't count as separate work
+_in_request: ContextVar[bool] = ContextVar("memory_profiler_in_request", default=False)
+
+try:
+    PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    PAGE_SIZE = 4096
+
+
+def current_rss() -> Optional[int]:
+    """Resident set size of this process in bytes (Linux /proc; None elsewhere)"""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_rss() -> Optional[int]:
+    """Highest RSS this process has reached, in bytes"""
+    if not HAS_RESOURCE:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return maxrss if os.uname().sysname == "Darwin" else maxrss * 1024
+
+
+def take_snapshot() -> tracemalloc.Snapshot:
+    """tracemalloc snapshot without the profiler's own allocations"""
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ))
+
+
+class _Scope:
+    """One tracked run of a request or stage"""
+    __slots__ = ("name", "unit", "base", "peak", "rss", "peak_rss", "clean", "snapshot")
+
+    def __init__(self, name: str, unit: bool):
+        self.name = name
+        self.unit = unit
+        self.base: Optional[int] = None  # Traced bytes at start (None: not tracing)
+        self.peak = 0
+        self.rss = current_rss()
+        self.peak_rss = peak_rss()
+        self.clean = True
+        self.snapshot: Optional[tracemalloc.Snapshot] = None
+
+
+def accumulate(pair: List[int], value: int):
+    """Add a sample to a [total, max] pair"""
+    pair[0] += value
+    pair[1] = max(pair[1], value)
+
+
+class ScopeStats:
+    """Aggregated samples of one route or stage"""
+
+    def __init__(self):
+        self.samples = 0
+        self.clean_samples = 0
+        self.traced = 0
+        self.traced_peak_all = [0, 0]  # [total, max] over traced samples
+        self.traced_peak_clean = [0, 0]
+        self.rss_delta = [0, 0]
+        self.rss_peak_growth = [0, 0]
+        self.snapshots = 0
+        self.sites: Counter = Counter()  # "file:line" -> bytes allocated and kept
+        self.site_counts: Counter = Counter()  # "file:line" -> blocks
+
+    def summary(self, top: int) -> Dict:
+        use_clean = self.clean_samples > 0
+        peak = self.traced_peak_clean if use_clean else self.traced_peak_all
+        peak_samples = self.clean_samples if use_clean else self.traced
+        return {
+            "samples": self.samples,
+            "clean_samples": self.clean_samples,
+            "traced_peak_bytes": {
+                "avg": peak[0] // peak_samples if peak_samples else 0,
+                "max": peak[1],
+                "from": "clean" if use_clean else "all",
+            },
+            "rss_delta_bytes": {
+                "avg": self.rss_delta[0] // self.samples if self.samples else 0,
+                "max": self.rss_delta[1],
+            },
+            "peak_rss_growth_bytes": {"total": self.rss_peak_growth[0], "max": self.rss_peak_growth[1]},
+            "snapshots": self.snapshots,
+            "top_sites": [
+                {
+                    "site": site,
+                    "avg_bytes": size // self.snapshots,
+                    "avg_blocks": round(self.site_counts[site] / self.snapshots, 1),
+                }
+                for site, size in self.sites.most_common(top)
+            ] if self.snapshots else [],
+        }
+
+
+class MemoryProfiler:
+    """Traced peaks, RSS deltas and allocation sites per route and per stage"""
+
+    def __init__(self):
+        self.enabled = settings.MEMORY_PROFILER_ENABLED
+        self.frames = settings.MEMORY_PROFILER_FRAMES
+        self.snapshot_every = settings.MEMORY_PROFILER_SNAPSHOT_EVERY
+        self._lock = threading.Lock()
+        self._active: Set[_Scope] = set()
+        self._units = 0  # Requests and jobs in flight
+        self._snapshotting = False
+        self._runs: Dict[str, int] = {}  # Runs since the last snapshot pair, per name
+        self.routes: Dict[str, ScopeStats] = {}
+        self.stages: Dict[str, ScopeStats] = {}
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self, frames: Optional[int] = None):
+        if frames:
+            self.frames = frames
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            print(f"[MEMORY] tracemalloc started ({self.frames} frames per trace)")
+
+    def stop(self):
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+            print("[MEMORY] tracemalloc stopped")
+
+    def reset(self):
+        with self._lock:
+            self.routes.clear()
+            self.stages.clear()
+            self._runs.clear()
+
+    def _fold(self):
+        """Credit the traced peak since the last boundary to every active scope (lock held)"""
+        _, peak = tracemalloc.get_traced_memory()
+        overlapping = self._units > 1
+        for scope in self._active:
+            if peak > scope.peak:
+                scope.peak = peak
+            if overlapping:
+                scope.clean = False
+        tracemalloc.reset_peak()
+
+    def _take_snapshot(self, scope: _Scope) -> tracemalloc.Snapshot:
+        # Snapshots are Python objects too: they inflate whatever else is running
+        with self._lock:
+            for other in self._active:
+                if other is not scope:
+                    other.clean = False
+        return take_snapshot()
+
+    def begin(self, name: str, unit: bool = False) -> _Scope:
+        scope = _Scope(name, unit)
+        if not tracemalloc.is_tracing():
+            return scope
+
+        sample = False
+        with self._lock:
+            # First run of each name, then every snapshot_every-th; one snapshot
+            # pair at a time, so a run that is due but blocked waits for the next
+            runs = self._runs.get(name)
+            if self.snapshot_every and not self._snapshotting \
+                    and (runs is None or runs >= self.snapshot_every):
+                self._snapshotting = sample = True
+                self._runs[name] = 0
+            else:
+                self._runs[name] = (runs or 0) + 1
+        if sample:
+            scope.snapshot = self._take_snapshot(scope)
+
+        with self._lock:
+            if unit:
+                self._units += 1
+            self._fold()
+            scope.base, _ = tracemalloc.get_traced_memory()
+            scope.peak = scope.base
+            self._active.add(scope)
+        return scope
+
+    def end(self, scope: _Scope, name: Optional[str] = None, route: bool = False):
+        """Record a finished scope (requests only learn their route name here)"""
+        name = name or scope.name
+        rss = current_rss()
+        rss_peak = peak_rss()
+        tracing = scope.base is not None and tracemalloc.is_tracing()
+
+        sites = None
+        with self._lock:
+            if scope in self._active:
+                if tracing:
+                    self._fold()
+                self._active.discard(scope)
+                if scope.unit:
+                    self._units -= 1
+        if scope.snapshot is not None:
+            if tracing:
+                after = self._take_snapshot(scope)
+                sites = after.compare_to(scope.snapshot, "lineno")
+            scope.snapshot = None
+            with self._lock:
+                self._snapshotting = False
+
+        with self._lock:
+            table = self.routes if route else self.stages
+            stats = table.get(name)
+            if stats is None:
+                stats = table[name] = ScopeStats()
+            stats.samples += 1
+            if scope.rss is not None and rss is not None:
+                accumulate(stats.rss_delta, rss - scope.rss)
+            if scope.peak_rss is not None and rss_peak is not None:
+                accumulate(stats.rss_peak_growth, rss_peak - scope.peak_rss)
+            if tracing:
+                peak = scope.peak - scope.base
+                stats.traced += 1
+                accumulate(stats.traced_peak_all, peak)
+                if scope.clean:
+                    stats.clean_samples += 1
+                    accumulate(stats.traced_peak_clean, peak)
+            if sites is not None:
+                stats.snapshots += 1
+                for diff in sites:
+                    if diff.size_diff > 0:
+                        frame = diff.traceback[0]
+                        site = f"{frame.filename}:{frame.lineno}"
+                        stats.sites[site] += diff.size_diff
+                        stats.site_counts[site] += diff.count_diff
+
+    def stage(self, name: str, unit: bool = False):
+        """
+        Track one stage of the image path (no-op unless enabled and tracing)
+
+        `unit` marks work that runs on its own when not inside a tracked
+        request (e.g. analyze_image for a queued job), so overlapping units
+        mark each other's samples as not clean.
+        """
+        if not self.enabled or not tracemalloc.is_tracing():
+            return nullcontext()
+        return self._stage(name, unit and not _in_request.get())
+
+    @contextmanager
+    def _stage(self, name: str, unit: bool):
+        scope = self.begin(name, unit=unit)
+        try:
+            yield
+        finally:
+            self.end(scope)
+
+    def begin_request(self, method: str, path: str):
+        """Start tracking a request; returns (scope, context token)"""
+        return self.begin(f"{method} {path}", unit=True), _in_request.set(True)
+
+    def end_request(self, scope: _Scope, token, route: str):
+        _in_request.reset(token)
+        self.end(scope, route, route=True)
+
+    def top_sites(self, limit: int = 20, group_by: str = "lineno") -> List[Dict]:
+        """Largest live allocation sites of the whole process right now"""
+        snapshot = take_snapshot()
+        return [
+            {
+                "site": "\n".join(stat.traceback.format()) if group_by == "traceback"
+                else f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}" if group_by == "lineno"
+                else stat.traceback[0].filename,
+                "bytes": stat.size,
+                "blocks": stat.count,
+            }
+            for stat in snapshot.statistics(group_by)[:limit]
+        ]
+
+    def get_report(self, top: int = 10) -> Dict:
+        with self._lock:
+            routes = {name: stats.summary(top) for name, stats in self.routes.items()}
+            stages = {name: stats.summary(top) for name, stats in sorted(self.stages.items())}
+        return {**self.get_stats(), "routes": routes, "stages": stages}
+
+    def get_stats(self) -> Dict:
+        traced, _ = tracemalloc.get_traced_memory()
+        return {
+            "enabled": self.enabled,
+            "tracing": self.tracing,
+            "frames": self.frames,
+            "snapshot_every": self.snapshot_every,
+            "rss_bytes": current_rss() or 0,
+            "peak_rss_bytes": peak_rss() or 0,
+            "traced_bytes": traced,
+            "tracemalloc_overhead_bytes": tracemalloc.get_tracemalloc_memory() if self.tracing else 0,
+        }
+
+
+# Global memory profiler
+memory_profiler = MemoryProfiler()
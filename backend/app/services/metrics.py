@@ -0,0 +1,216 @@
+"""
+In-process metrics registry with Prometheus text exposition
+
+Histograms, counters and gauges are plain Python objects updated on the
+event loop (one bisect and a few additions per observation), so they stay
+on in production. Component stats that already exist (caches, admission,
+workers, DB pool) are read only when /metrics is scraped.
+
+Each worker process keeps its own registry; scrape every worker (or run a
+single worker per container) to see them all.
+
+Usage:
+    with analysis_stage("ai_call"):
+        result = await ai_service.analyze_image(processed)
+"""
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Latency buckets (seconds): 5ms .. 60s
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Labels = Tuple[str, ...]
+
+
+def escape_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    parts = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        """(name suffix, label string, value) triples"""
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{labels} {format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def samples(self):
+        for labels, value in self._values.items():
+            yield "_total", format_labels(self.labelnames, labels), value
+
+
+class Gauge(Metric):
+    """Set directly, or computed at scrape time by `collect` ({labels: value})"""
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = (),
+                 collect: Optional[Callable[[], Dict[Labels, float]]] = None):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Labels, float] = {}
+        self.collect = collect
+
+    def set(self, value: float, *labels: str):
+        self._values[labels] = value
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dec(self, *labels: str, amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) - amount
+
+    def samples(self):
+        values = self._values
+        if self.collect is not None:
+            try:
+                values = self.collect()
+            except Exception as e:
+                print(f"[METRICS] Collecting {self.name} failed: {e}")
+                values = {}
+        for labels, value in values.items():
+            yield "", format_labels(self.labelnames, labels), value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (+Inf last), sum, count]
+        self._series: Dict[Labels, list] = {}
+
+    def observe(self, value: float, *labels: str):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    @contextmanager
+    def time(self, *labels: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def samples(self):
+        for labels, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{format_value(bound)}"'
+                yield "_bucket", format_labels(self.labelnames, labels, le), cumulative
+            yield "_sum", format_labels(self.labelnames, labels), total
+            yield "_count", format_labels(self.labelnames, labels), count
+
+
+class MetricsRegistry:
+    """Named metrics rendered together in Prometheus text format"""
+
+    def __init__(self, prefix: str = ""):
+        self.prefix = prefix
+        self._metrics: Dict[str, Metric] = {}
+
+    def _register(self, metric: Metric) -> Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(self.prefix + name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames: Iterable[str] = (),
+              collect: Optional[Callable[[], Dict[Labels, float]]] = None) -> Gauge:
+        return self._register(Gauge(self.prefix + name, help_text, labelnames, collect))
+
+    def histogram(self, name: str, help_text: str, labelnames: Iterable[str] = (),
+                  buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(self.prefix + name, help_text, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def flatten_stats(stats: Dict, prefix: str = "") -> Dict[str, float]:
+    """Numeric leaves of a get_stats() dict: {"lookups": {"exact": 3}} -> {"lookups_exact": 3}"""
+    flat = {}
+    for key, value in stats.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten_stats(value, f"{name}_"))
+        elif isinstance(value, bool):
+            flat[name] = int(value)
+        elif isinstance(value, (int, float)):
+            flat[name] = value
+    return flat
+
+
+# Global registry and the metrics shared across modules
+metrics = MetricsRegistry(prefix="fyf_")
+
+http_request_seconds = metrics.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template",
+    ("method", "route", "status")
+)
+http_requests_in_flight = metrics.gauge(
+    "http_requests_in_flight", "HTTP requests currently being handled"
+)
+analysis_stage_seconds = metrics.histogram(
+    "analysis_stage_duration_seconds",
+    "Food analysis time per stage (save_image, ai_call, nutrition, db_write, db_commit)",
+    ("stage",)
+)
+image_stage_seconds = metrics.histogram(
+    "image_stage_duration_seconds",
+    "Upload processing time per stage (decode, resize, encode, ...)",
+    ("stage",)
+)
+
+
+def analysis_stage(stage: str):
+    """Time one stage of a food analysis"""
+    return analysis_stage_seconds.time(stage)
@@ -1,9 +1,131 @@
 """
 Nutrition service for calculating health metrics and insights
 """
-from typing import List, Dict, Tuple
+from dataclasses import dataclass
+from typing import Any, List, Dict, Optional, Tuple
 import random
 
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+
+# Detected-food nutrient key -> scan total field (order is the summation order)
+NUTRIENT_TOTALS = [
+    ("calories", "total_calories"),
+    ("protein", "total_protein"),
+    ("carbs", "total_carbs"),
+    ("fats", "total_fats"),
+    ("fiber", "total_fiber"),
+    ("sugar", "total_sugar"),
+    ("sodium", "total_sodium"),
+]
+
+# Health grades, indexed by score code
+HEALTH_GRADES = ["A+", "A", "B", "C", "D"]
+
+# Dietary tag bits (tag lists are always emitted in this order)
+DIETARY_TAG_BITS = [
+    ("non_veg", 1 << 0),
+    ("vegetarian", 1 << 1),
+    ("vegan", 1 << 2),
+    ("low_sugar", 1 << 3),
+    ("high_protein", 1 << 4),
+    ("keto_friendly", 1 << 5),
+]
+TAG_BITS = dict(DIETARY_TAG_BITS)
+
+# Per-food classification bits
+FOOD_MEAT = 1 << 0
+FOOD_VEG = 1 << 1
+FOOD_VEGAN = 1 << 2
+FOOD_ALL = FOOD_MEAT | FOOD_VEG | FOOD_VEGAN
+
+# Insight bits (insights are always emitted in this order)
+INSIGHT_HIGH_CALORIES = 1 << 0
+INSIGHT_HIGH_SUGAR = 1 << 1
+INSIGHT_LOW_PROTEIN = 1 << 2
+INSIGHT_HIGH_PROTEIN = 1 << 3
+INSIGHT_HIGH_SODIUM = 1 << 4
+INSIGHT_LOW_FIBER = 1 << 5
+
+
+@dataclass
+class NutritionBatch:
+    """
+    Columnar scoring results for a batch of scans
+
+    totals maps each total_* field to a float64 array (one entry per scan);
+    score_codes index HEALTH_GRADES; tag_masks/insight_masks hold the
+    DIETARY_TAG_BITS / INSIGHT_* bits.
+    """
+    totals: Dict[str, Any]
+    score_codes: Any
+    tag_masks: Any
+    insight_masks: Any
+
+    def __len__(self) -> int:
+        return len(self.score_codes)
+
+    def nutrition(self, i: int) -> Dict:
+        return {field: float(values[i]) for field, values in self.totals.items()}
+
+    def health_score(self, i: int) -> str:
+        return HEALTH_GRADES[self.score_codes[i]]
+
+    def dietary_tags(self, i: int) -> List[str]:
+        return tags_from_mask(int(self.tag_masks[i]))
+
+    def ai_insights(self, i: int) -> str:
+        return render_insights(self.nutrition(i), self.health_score(i), int(self.insight_masks[i]))
+
+
+def tags_from_mask(mask: int) -> List[str]:
+    """Dietary tag bitmask -> tag list in canonical order"""
+    return [tag for tag, bit in DIETARY_TAG_BITS if mask & bit]
+
+
+def render_insights(nutrition: Dict, health_score: str, mask: int) -> str:
+    """Insight bitmask -> the user-facing insights text"""
+    insights = []
+    
+    # Calorie insight
+    cal_percentage = (nutrition["total_calories"] / NutritionService.DAILY_RECOMMENDATIONS["calories"]) * 100
+    if mask & INSIGHT_HIGH_CALORIES:
+        insights.append(f"⚠️ This meal contains {int(cal_percentage)}% of your daily calorie needs.")
+    else:
+        insights.append(f"✅ This meal is {int(cal_percentage)}% of your daily calories - well balanced!")
+    
+    # Sugar insight
+    if mask & INSIGHT_HIGH_SUGAR:
+        insights.append(f"🍬 High sugar content detected ({nutrition['total_sugar']:.1f}g). Consider reducing sugar intake.")
+    
+    # Protein insight
+    if mask & INSIGHT_LOW_PROTEIN:
+        insights.append("💪 Low protein content. Add nuts, eggs, or lean meat for better satiety.")
+    elif mask & INSIGHT_HIGH_PROTEIN:
+        insights.append(f"💪 Excellent protein content ({nutrition['total_protein']:.1f}g)!")
+    
+    # Sodium insight
+    if mask & INSIGHT_HIGH_SODIUM:
+        insights.append(f"🧂 High sodium ({nutrition['total_sodium']:.0f}mg). Drink plenty of water.")
+    
+    # Fiber insight
+    if mask & INSIGHT_LOW_FIBER:
+        insights.append("🌾 Low fiber. Add vegetables or whole grains for better digestion.")
+    
+    # Health score feedback
+    if health_score in ["A+", "A"]:
+        insights.append("🌟 Great choice! This meal has excellent nutritional balance.")
+    elif health_score == "B":
+        insights.append("👍 Good meal choice. Could be improved with more vegetables.")
+    else:
+        insights.append("⚡ Consider adding more whole foods and vegetables for better nutrition.")
+    
+    return " ".join(insights)
+
 
 class NutritionService:
     """Service for nutrition calculations and health insights"""
@@ -19,9 +141,29 @@ class NutritionService:
         "sodium": 2300
     }
     
+    # Food classification
+    MEAT_FOODS = ["burger", "chicken curry"]
+    VEG_FOODS = ["dosa", "idli", "dal", "chapati", "rice", "salad", "samosa"]
+    VEGAN_FOODS = ["dosa", "idli", "dal", "rice", "salad", "apple", "banana"]
+    
+    # Score points -> grade cut-offs (descending, aligned with HEALTH_GRADES)
+    GRADE_THRESHOLDS = [85, 70, 55, 40]
+    
     def __init__(self):
         pass
     
+    def classify_food(self, name: str) -> int:
+        """FOOD_* bits for one detected food name"""
+        name = name.lower()
+        bits = 0
+        if name in self.MEAT_FOODS:
+            bits |= FOOD_MEAT
+        if name in self.VEG_FOODS:
+            bits |= FOOD_VEG
+        if name in self.VEGAN_FOODS:
+            bits |= FOOD_VEGAN
+        return bits
+    
     def calculate_health_score(self, nutrition: Dict) -> str:
         """
         Calculate health score based on nutrition balance
@@ -61,116 +203,188 @@ class NutritionService:
             score_points += 5
         
         # Convert to letter grade
-        if score_points >= 85:
-            return "A+"
-        elif score_points >= 70:
-            return "A"
-        elif score_points >= 55:
-            return "B"
-        elif score_points >= 40:
-            return "C"
-        else:
-            return "D"
-    
-    def determine_dietary_tags(self, detected_foods: List[Dict]) -> List[str]:
+        for grade, threshold in zip(HEALTH_GRADES, self.GRADE_THRESHOLDS):
+            if score_points >= threshold:
+                return grade
+        return HEALTH_GRADES[-1]
+    
+    def determine_dietary_tags(self, detected_foods: List[Dict], nutrition: Optional[Dict] = None) -> List[str]:
         """
         Determine dietary tags based on detected foods
-        """
-        tags = set()
         
-        # Food classification
-        meat_foods = ["burger", "chicken curry"]
-        veg_foods = ["dosa", "idli", "dal", "chapati", "rice", "salad", "samosa"]
-        vegan_foods = ["dosa", "idli", "dal", "rice", "salad", "apple", "banana"]
-        
-        food_names = [f["name"].lower() for f in detected_foods]
+        Pass the scan's totals as `nutrition` to avoid summing them again.
+        """
+        if nutrition is None:
+            nutrition = self.calculate_total_nutrition(detected_foods)
         
         # Check if veg/non-veg
-        has_meat = any(food in food_names for food in meat_foods)
-        has_only_veg = all(food in veg_foods for food in food_names)
-        has_only_vegan = all(food in vegan_foods for food in food_names)
+        any_bits = 0
+        all_bits = FOOD_ALL
+        for food in detected_foods:
+            bits = self.classify_food(food["name"])
+            any_bits |= bits
+            all_bits &= bits
         
-        if has_meat:
-            tags.add("non_veg")
-        elif has_only_veg:
-            tags.add("vegetarian")
+        mask = 0
+        if any_bits & FOOD_MEAT:
+            mask |= TAG_BITS["non_veg"]
+        elif all_bits & FOOD_VEG:
+            mask |= TAG_BITS["vegetarian"]
         
-        if has_only_vegan:
-            tags.add("vegan")
+        if all_bits & FOOD_VEGAN:
+            mask |= TAG_BITS["vegan"]
         
         # Check if low sugar
-        total_sugar = sum(f.get("sugar", 0) for f in detected_foods)
-        if total_sugar < 10:
-            tags.add("low_sugar")
+        if nutrition["total_sugar"] < 10:
+            mask |= TAG_BITS["low_sugar"]
         
         # Check if high protein
-        total_protein = sum(f.get("protein", 0) for f in detected_foods)
-        if total_protein >= 25:
-            tags.add("high_protein")
+        if nutrition["total_protein"] >= 25:
+            mask |= TAG_BITS["high_protein"]
         
         # Check if low carb (keto-friendly)
-        total_carbs = sum(f.get("carbs", 0) for f in detected_foods)
-        if total_carbs < 30:
-            tags.add("keto_friendly")
+        if nutrition["total_carbs"] < 30:
+            mask |= TAG_BITS["keto_friendly"]
         
-        return list(tags)
+        return tags_from_mask(mask)
     
     def generate_ai_insights(self, nutrition: Dict, health_score: str, user_profile: Dict = None) -> str:
         """
         Generate AI-powered insights and recommendations
         """
-        insights = []
+        mask = 0
         
-        # Calorie insight
         daily_calories = self.DAILY_RECOMMENDATIONS["calories"]
-        cal_percentage = (nutrition["total_calories"] / daily_calories) * 100
-        
-        if cal_percentage > 40:
-            insights.append(f"⚠️ This meal contains {int(cal_percentage)}% of your daily calorie needs.")
-        else:
-            insights.append(f"✅ This meal is {int(cal_percentage)}% of your daily calories - well balanced!")
-        
-        # Sugar insight
+        if (nutrition["total_calories"] / daily_calories) * 100 > 40:
+            mask |= INSIGHT_HIGH_CALORIES
         if nutrition["total_sugar"] > 20:
-            insights.append(f"🍬 High sugar content detected ({nutrition['total_sugar']:.1f}g). Consider reducing sugar intake.")
-        
-        # Protein insight
+            mask |= INSIGHT_HIGH_SUGAR
         if nutrition["total_protein"] < 10:
-            insights.append("💪 Low protein content. Add nuts, eggs, or lean meat for better satiety.")
+            mask |= INSIGHT_LOW_PROTEIN
         elif nutrition["total_protein"] >= 25:
-            insights.append(f"💪 Excellent protein content ({nutrition['total_protein']:.1f}g)!")
-        
-        # Sodium insight
+            mask |= INSIGHT_HIGH_PROTEIN
         if nutrition["total_sodium"] > 1000:
-            insights.append(f"🧂 High sodium ({nutrition['total_sodium']:.0f}mg). Drink plenty of water.")
-        
-        # Fiber insight
+            mask |= INSIGHT_HIGH_SODIUM
         if nutrition["total_fiber"] < 3:
-            insights.append("🌾 Low fiber. Add vegetables or whole grains for better digestion.")
-        
-        # Health score feedback
-        if health_score in ["A+", "A"]:
-            insights.append("🌟 Great choice! This meal has excellent nutritional balance.")
-        elif health_score == "B":
-            insights.append("👍 Good meal choice. Could be improved with more vegetables.")
-        else:
-            insights.append("⚡ Consider adding more whole foods and vegetables for better nutrition.")
+            mask |= INSIGHT_LOW_FIBER
         
-        return " ".join(insights)
+        return render_insights(nutrition, health_score, mask)
     
     def calculate_total_nutrition(self, detected_foods: List[Dict]) -> Dict:
         """
         Calculate total nutrition from detected foods
+        
+        Single pass, accumulating float64 in food order (the same order
+        score_batch uses, so both paths produce identical totals).
+        """
+        totals = {field: 0.0 for _, field in NUTRIENT_TOTALS}
+        for food in detected_foods:
+            for nutrient, field in NUTRIENT_TOTALS:
+                totals[field] += food.get(nutrient, 0) or 0
+        return totals
+    
+    def build_batch_columns(self, scans: List[List[Dict]]) -> Tuple[Dict[str, Any], Any, Any]:
+        """
+        Flatten per-scan detected_foods into columnar arrays for score_batch
+        
+        Returns:
+            Tuple of (nutrient columns keyed by nutrient name, scan_index, food_bits)
         """
-        return {
-            "total_calories": sum(f.get("calories", 0) for f in detected_foods),
-            "total_protein": sum(f.get("protein", 0) for f in detected_foods),
-            "total_carbs": sum(f.get("carbs", 0) for f in detected_foods),
-            "total_fats": sum(f.get("fats", 0) for f in detected_foods),
-            "total_fiber": sum(f.get("fiber", 0) for f in detected_foods),
-            "total_sugar": sum(f.get("sugar", 0) for f in detected_foods),
-            "total_sodium": sum(f.get("sodium", 0) for f in detected_foods),
-        }
+        self._require_numpy()
+        scan_index = []
+        food_bits = []
+        columns = {nutrient: [] for nutrient, _ in NUTRIENT_TOTALS}
+        for i, detected_foods in enumerate(scans):
+            for food in detected_foods or []:
+                scan_index.append(i)
+                food_bits.append(self.classify_food(food["name"]))
+                for nutrient, _ in NUTRIENT_TOTALS:
+                    columns[nutrient].append(food.get(nutrient, 0) or 0)
+        
+        return (
+            {nutrient: np.asarray(values, dtype=np.float64) for nutrient, values in columns.items()},
+            np.asarray(scan_index, dtype=np.intp),
+            np.asarray(food_bits, dtype=np.uint8),
+        )
+    
+    def score_batch(self, columns: Dict[str, Any], scan_index: Any, food_bits: Any, num_scans: int) -> NutritionBatch:
+        """
+        Score a whole batch of scans with array operations
+        
+        Args:
+            columns: Per-food nutrient arrays keyed by nutrient name ("calories", ...)
+            scan_index: Scan position (0..num_scans-1) of each food, in food order
+            food_bits: FOOD_* classification bits of each food
+            num_scans: Number of scans (scans without foods still get a row)
+        
+        Returns:
+            NutritionBatch; row i matches the scalar methods for scan i exactly
+        """
+        self._require_numpy()
+        
+        # Totals: np.add.at accumulates unbuffered in index order, like the scalar loop
+        totals = {}
+        for nutrient, field in NUTRIENT_TOTALS:
+            total = np.zeros(num_scans, dtype=np.float64)
+            np.add.at(total, scan_index, columns[nutrient])
+            totals[field] = total
+        
+        calories = totals["total_calories"]
+        protein = totals["total_protein"]
+        carbs = totals["total_carbs"]
+        fiber = totals["total_fiber"]
+        sugar = totals["total_sugar"]
+        sodium = totals["total_sodium"]
+        
+        # Health score (same ladder as calculate_health_score)
+        points = (
+            np.select([(calories >= 300) & (calories <= 700), calories > 700], [30, 15], 0)
+            + np.select([protein >= 20, protein >= 10], [25, 15], 0)
+            + np.select([fiber >= 5, fiber >= 2], [20, 10], 0)
+            + np.select([sugar <= 10, sugar <= 20], [15, 8], 0)
+            + np.select([sodium <= 500, sodium <= 1000], [10, 5], 0)
+        )
+        score_codes = np.select(
+            [points >= threshold for threshold in self.GRADE_THRESHOLDS],
+            list(range(len(self.GRADE_THRESHOLDS))),
+            len(HEALTH_GRADES) - 1
+        ).astype(np.int8)
+        
+        # Dietary tags (same rules as determine_dietary_tags)
+        any_bits = np.zeros(num_scans, dtype=np.uint8)
+        all_bits = np.full(num_scans, FOOD_ALL, dtype=np.uint8)
+        np.bitwise_or.at(any_bits, scan_index, food_bits)
+        np.bitwise_and.at(all_bits, scan_index, food_bits)
+        
+        has_meat = (any_bits & FOOD_MEAT) != 0
+        tag_masks = np.zeros(num_scans, dtype=np.uint8)
+        tag_masks |= np.where(has_meat, TAG_BITS["non_veg"], 0).astype(np.uint8)
+        tag_masks |= np.where(~has_meat & ((all_bits & FOOD_VEG) != 0), TAG_BITS["vegetarian"], 0).astype(np.uint8)
+        tag_masks |= np.where((all_bits & FOOD_VEGAN) != 0, TAG_BITS["vegan"], 0).astype(np.uint8)
+        tag_masks |= np.where(sugar < 10, TAG_BITS["low_sugar"], 0).astype(np.uint8)
+        tag_masks |= np.where(protein >= 25, TAG_BITS["high_protein"], 0).astype(np.uint8)
+        tag_masks |= np.where(carbs < 30, TAG_BITS["keto_friendly"], 0).astype(np.uint8)
+        
+        # Insights (same rules as generate_ai_insights)
+        cal_percentage = (calories / self.DAILY_RECOMMENDATIONS["calories"]) * 100
+        insight_masks = np.zeros(num_scans, dtype=np.uint8)
+        insight_masks |= np.where(cal_percentage > 40, INSIGHT_HIGH_CALORIES, 0).astype(np.uint8)
+        insight_masks |= np.where(sugar > 20, INSIGHT_HIGH_SUGAR, 0).astype(np.uint8)
+        insight_masks |= np.where(protein < 10, INSIGHT_LOW_PROTEIN, 0).astype(np.uint8)
+        insight_masks |= np.where(protein >= 25, INSIGHT_HIGH_PROTEIN, 0).astype(np.uint8)
+        insight_masks |= np.where(sodium > 1000, INSIGHT_HIGH_SODIUM, 0).astype(np.uint8)
+        insight_masks |= np.where(fiber < 3, INSIGHT_LOW_FIBER, 0).astype(np.uint8)
+        
+        return NutritionBatch(
+            totals=totals,
+            score_codes=score_codes,
+            tag_masks=tag_masks,
+            insight_masks=insight_masks
+        )
+    
+    def _require_numpy(self):
+        if not HAS_NUMPY:
+            raise RuntimeError("Batch scoring requires numpy (pip install numpy)")
 
 
 # Global nutrition service instance
@@ -0,0 +1,193 @@
+"""
+Near-duplicate image lookup using perceptual hashes
+
+64-bit dHashes are indexed with multi-index hashing: each hash is split into
+``chunks`` substrings, each stored in its own hash table. By the pigeonhole
+principle two hashes within hamming distance ``d`` agree to within
+``d // chunks`` bits on at least one substring, so a lookup only probes a
+handful of buckets instead of scanning every stored hash.
+"""
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from itertools import combinations
+from typing import Deque, Dict, List, Optional, Tuple
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import settings
+from app.models import FoodScan
+
+
+def to_signed64(value: int) -> int:
+    """Map an unsigned 64-bit hash onto a signed BIGINT column value"""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def from_signed64(value: int) -> int:
+    """Inverse of to_signed64"""
+    return value + (1 << 64) if value < 0 else value
+
+
+class PerceptualHashIndex:
+    """Time-windowed multi-index hamming index over 64-bit perceptual hashes"""
+
+    HASH_BITS = 64
+    # Hashes with almost no (or almost all) bits set come from low-texture
+    # images; they sit a few bits apart regardless of content
+    MIN_SET_BITS = 8
+
+    def __init__(self, max_distance: int, window_seconds: float, chunks: int = 4):
+        self.max_distance = max_distance
+        self.window_seconds = window_seconds
+        self.chunks = chunks
+        self.probe_radius = max_distance // chunks
+
+        # Split the 64 bits into `chunks` contiguous substrings
+        base, extra = divmod(self.HASH_BITS, chunks)
+        self._layout: List[Tuple[int, int]] = []  # (shift, mask)
+        shift = 0
+        for i in range(chunks):
+            width = base + (1 if i < extra else 0)
+            self._layout.append((shift, (1 << width) - 1))
+            shift += width
+
+        # Bit-flip masks within the probe radius, per substring width
+        self._flips: Dict[int, List[int]] = {}
+        for _, mask in self._layout:
+            width = mask.bit_length()
+            if width in self._flips:
+                continue
+            flips = [0]
+            for r in range(1, self.probe_radius + 1):
+                for bits in combinations(range(width), r):
+                    flip = 0
+                    for b in bits:
+                        flip |= 1 << b
+                    flips.append(flip)
+            self._flips[width] = flips
+
+        # Buckets map scan_id -> full hash so candidates are verified without a second lookup
+        self._tables: List[Dict[int, Dict[int, int]]] = [{} for _ in range(chunks)]
+        self._entries: Dict[int, Tuple[int, Optional[int], float]] = {}  # scan_id -> (hash, user_id, ts)
+        self._expiry: Deque[Tuple[float, int]] = deque()
+
+        self.lookups = 0
+        self.matches = 0
+        self.degenerate = 0
+
+    def is_degenerate(self, phash: int) -> bool:
+        """True for hashes too uniform to tell images apart"""
+        set_bits = phash.bit_count()
+        return set_bits < self.MIN_SET_BITS or set_bits > self.HASH_BITS - self.MIN_SET_BITS
+
+    def _substrings(self, phash: int) -> List[int]:
+        return [(phash >> shift) & mask for shift, mask in self._layout]
+
+    def add(self, scan_id: int, phash: int, user_id: Optional[int] = None, timestamp: float = None):
+        """Index a scan's perceptual hash"""
+        if self.is_degenerate(phash):
+            return
+        timestamp = timestamp or time.time()
+        if scan_id in self._entries:
+            self.remove(scan_id)
+
+        for table, sub in zip(self._tables, self._substrings(phash)):
+            table.setdefault(sub, {})[scan_id] = phash
+        self._entries[scan_id] = (phash, user_id, timestamp)
+        self._expiry.append((timestamp, scan_id))
+
+    def remove(self, scan_id: int):
+        entry = self._entries.pop(scan_id, None)
+        if entry is None:
+            return
+        for table, sub in zip(self._tables, self._substrings(entry[0])):
+            bucket = table.get(sub)
+            if bucket is not None:
+                bucket.pop(scan_id, None)
+                if not bucket:
+                    del table[sub]
+
+    def _evict_expired(self, now: float):
+        cutoff = now - self.window_seconds
+        while self._expiry and self._expiry[0][0] < cutoff:
+            timestamp, scan_id = self._expiry.popleft()
+            entry = self._entries.get(scan_id)
+            # Skip stale expiry records for scans that were re-added later
+            if entry is not None and entry[2] == timestamp:
+                self.remove(scan_id)
+
+    def find_nearest(self, phash: int, user_id: Optional[int] = None) -> Optional[Tuple[int, int]]:
+        """
+        Find the closest indexed scan within max_distance
+
+        Returns:
+            Tuple of (scan_id, distance), or None if nothing is close enough
+        """
+        self.lookups += 1
+        if self.is_degenerate(phash):
+            self.degenerate += 1
+            return None
+        now = time.time()
+        self._evict_expired(now)
+
+        max_distance = self.max_distance
+        best = None
+        for (shift, mask), table in zip(self._layout, self._tables):
+            sub = (phash >> shift) & mask
+            for flip in self._flips[mask.bit_length()]:
+                bucket = table.get(sub ^ flip)
+                if not bucket:
+                    continue
+                for scan_id, other in bucket.items():
+                    distance = (phash ^ other).bit_count()
+                    if distance > max_distance:
+                        continue
+                    _, owner, timestamp = self._entries[scan_id]
+                    if user_id is not None and owner != user_id:
+                        continue
+                    # Prefer the closest match, then the most recent one
+                    rank = (distance, -timestamp)
+                    if best is None or rank < best[0]:
+                        best = (rank, scan_id, distance)
+
+        if best is None:
+            return None
+        self.matches += 1
+        return best[1], best[2]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_stats(self) -> Dict:
+        return {
+            "entries": len(self._entries),
+            "lookups": self.lookups,
+            "matches": self.matches,
+            "degenerate": self.degenerate,
+            "max_distance": self.max_distance,
+            "window_seconds": self.window_seconds,
+        }
+
+
+async def warm_phash_index(index: PerceptualHashIndex, db: AsyncSession) -> int:
+    """Load scans from the current time window into the index (e.g. after restart)"""
+    since = datetime.now(timezone.utc) - timedelta(seconds=index.window_seconds)
+    result = await db.execute(
+        select(FoodScan.id, FoodScan.image_phash, FoodScan.user_id, FoodScan.created_at)
+        .where(FoodScan.image_phash.isnot(None), FoodScan.created_at >= since)
+    )
+    rows = result.all()
+    for scan_id, phash, user_id, created_at in rows:
+        if created_at.tzinfo is None:
+            # SQLite returns naive datetimes; they are stored in UTC
+            created_at = created_at.replace(tzinfo=timezone.utc)
+        index.add(scan_id, from_signed64(phash), user_id, timestamp=created_at.timestamp())
+    return len(rows)
+
+
+# Global near-duplicate index instance
+phash_index = PerceptualHashIndex(
+    max_distance=settings.PHASH_MAX_DISTANCE,
+    window_seconds=settings.PHASH_WINDOW_MINUTES * 60,
+    chunks=settings.PHASH_INDEX_CHUNKS
+)
@@ -0,0 +1,256 @@
+"""
+On-demand sampling profiler for live workers
+
+A background thread snapshots the Python stack of every thread
+(sys._current_frames) every PROFILER_INTERVAL_MS and counts identical
+stacks. Nothing runs while no profile is active. Output is collapsed stacks
+(flamegraph.pl, speedscope, inferno) or speedscope JSON.
+
+Profiles are either timed ("everything this worker does for N seconds") or
+request-driven ("while the next N requests to a path are in flight", or one
+request carrying an X-Profile header with the admin token).
+"""
+import asyncio
+import hmac
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+from app.config import settings
+
+# (name, file, first line of the function)
+Frame = Tuple[str, str, int]
+Stack = Tuple[Frame, ...]  # root first, thread name as the root frame
+
+
+def frame_key(frame) -> Frame:
+    code = frame.f_code
+    return (getattr(code, "co_qualname", code.co_name), code.co_filename, code.co_firstlineno)
+
+
+class SamplingProfiler:
+    """Samples the stacks of all threads from a daemon thread"""
+
+    def __init__(self, interval: float, max_depth: int = 128):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.counts: Counter = Counter()
+        self.samples = 0
+        self.started_at = 0.0
+        self.stopped_at = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.stopped_at = time.time()
+        return self.counts
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    stack.append(frame_key(frame))
+                    frame = frame.f_back
+                stack.append((names.get(thread_id, f"thread-{thread_id}"), "", 0))
+                stack.reverse()
+                self.counts[tuple(stack)] += 1
+            self.samples += 1
+
+
+def frame_label(frame: Frame) -> str:
+    name, filename, line = frame
+    if not filename:
+        return name
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+def to_collapsed(counts: Counter) -> str:
+    """Brendan Gregg's collapsed format: 'root;child;leaf count' per line"""
+    lines = [
+        ";".join(frame_label(frame).replace(";", ":") for frame in stack) + f" {count}"
+        for stack, count in counts.most_common()
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def to_speedscope(counts: Counter, interval: float, name: str) -> Dict:
+    """speedscope 'sampled' profile JSON, one profile per thread"""
+    frames: List[Dict] = []
+    frame_index: Dict[Frame, int] = {}
+    profiles: Dict[str, Dict] = {}
+    weight = interval * 1000  # milliseconds per sample
+
+    for stack, count in counts.items():
+        thread_name = stack[0][0]
+        profile = profiles.setdefault(thread_name, {
+            "type": "sampled",
+            "name": thread_name,
+            "unit": "milliseconds",
+            "startValue": 0,
+            "endValue": 0,
+            "samples": [],
+            "weights": [],
+        })
+        indexes = []
+        for frame in stack[1:]:
+            index = frame_index.get(frame)
+            if index is None:
+                index = frame_index[frame] = len(frames)
+                frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+            indexes.append(index)
+        profile["samples"].append(indexes)
+        profile["weights"].append(count * weight)
+        profile["endValue"] += count * weight
+
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "shared": {"frames": frames},
+        "profiles": list(profiles.values()),
+        "name": name,
+        "exporter": settings.APP_NAME,
+    }
+
+
+@dataclass
+class ProfileSession:
+    """One profile: timed, or tied to a number of requests"""
+    id: str
+    interval: float
+    path: Optional[str] = None  # Request path being profiled (request mode)
+    requests_left: int = 0
+    active_requests: int = 0
+    profiled_requests: int = 0
+    status: str = "armed"  # armed, running, done
+    profiler: Optional[SamplingProfiler] = None
+    counts: Counter = field(default_factory=Counter)
+    samples: int = 0
+    duration: float = 0.0
+
+    def summary(self) -> Dict:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "path": self.path,
+            "interval_ms": round(self.interval * 1000, 3),
+            "requests_left": self.requests_left,
+            "profiled_requests": self.profiled_requests,
+            "samples": self.samples,
+            "unique_stacks": len(self.counts),
+            "duration": round(self.duration, 3),
+        }
+
+
+class ProfileManager:
+    """Runs at most one profile at a time per worker process and keeps recent results"""
+
+    KEEP_SESSIONS = 10
+
+    def __init__(self):
+        self.enabled = settings.PROFILER_ENABLED
+        self.current: Optional[ProfileSession] = None
+        self.armed: Optional[ProfileSession] = None  # Waiting for requests to `path`
+        self.sessions: "OrderedDict[str, ProfileSession]" = OrderedDict()
+
+    @property
+    def busy(self) -> bool:
+        return self.current is not None or self.armed is not None
+
+    def _new_session(self, interval_ms: Optional[float]) -> ProfileSession:
+        interval = (interval_ms or settings.PROFILER_INTERVAL_MS) / 1000
+        session = ProfileSession(id=uuid.uuid4().hex[:12], interval=max(0.001, interval))
+        self.sessions[session.id] = session
+        while len(self.sessions) > self.KEEP_SESSIONS:
+            self.sessions.popitem(last=False)
+        return session
+
+    def _start(self, session: ProfileSession):
+        session.status = "running"
+        session.profiler = SamplingProfiler(session.interval)
+        session.profiler.start()
+        self.current = session
+
+    def _finish(self, session: ProfileSession):
+        profiler = session.profiler
+        session.counts = profiler.stop()
+        session.samples = profiler.samples
+        session.duration = profiler.stopped_at - profiler.started_at
+        session.profiler = None
+        session.status = "done"
+        self.current = None
+
+    async def profile_for(self, seconds: float, interval_ms: Optional[float] = None) -> ProfileSession:
+        """Sample everything this worker does for `seconds`"""
+        session = self._new_session(interval_ms)
+        self._start(session)
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            self._finish(session)
+        return session
+
+    def arm(self, path: str, count: int, interval_ms: Optional[float] = None) -> ProfileSession:
+        """Sample while the next `count` requests to `path` are in flight"""
+        session = self._new_session(interval_ms)
+        session.path = path
+        session.requests_left = count
+        self.armed = session
+        return session
+
+    def claim_request(self, path: str, profile_header: Optional[str]) -> Optional[ProfileSession]:
+        """Session to profile this request under, if any (called for every request)"""
+        session = self.armed
+        if session is not None and path == session.path and session.requests_left > 0:
+            session.requests_left -= 1
+            if session.requests_left == 0:
+                self.armed = None
+        elif profile_header is not None and self.current is None and self.armed is None \
+                and settings.ADMIN_TOKEN and hmac.compare_digest(profile_header, settings.ADMIN_TOKEN):
+            session = self._new_session(None)
+            session.path = path
+        else:
+            return None
+
+        if self.current is None:
+            self._start(session)
+        elif self.current is not session:
+            return None
+        session.active_requests += 1
+        session.profiled_requests += 1
+        return session
+
+    def release_request(self, session: ProfileSession):
+        session.active_requests -= 1
+        if session.active_requests == 0 and session.requests_left == 0 and self.current is session:
+            self._finish(session)
+
+    def get(self, session_id: str) -> Optional[ProfileSession]:
+        return self.sessions.get(session_id)
+
+    def get_stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "current": self.current.id if self.current else None,
+            "armed": self.armed.summary() if self.armed else None,
+            "sessions": [session.summary() for session in self.sessions.values()],
+        }
+
+
+# Global profile manager
+profile_manager = ProfileManager()
@@ -0,0 +1,325 @@
+"""
+Token-bucket rate limiting for expensive endpoints (model calls)
+
+Every protected request takes one token from each of its buckets, all or
+nothing:
+  - per user (RATE_LIMIT_PER_MINUTE burst, plus a RATE_LIMIT_PER_DAY budget)
+  - per client IP
+  - global, shared by everyone (protects the upstream model quota)
+
+Buckets live in-process by default. With RATE_LIMIT_REDIS_ENABLED they live
+in Redis, and a Lua script checks and debits them atomically, so the limits
+hold across workers. If Redis is unreachable the in-process store takes over.
+"""
+import math
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from fastapi import HTTPException, Request, Response, status
+from jose import JWTError, jwt
+from app.config import settings
+
+try:
+    import redis.asyncio as aioredis
+    HAS_REDIS = True
+except ImportError:
+    HAS_REDIS = False
+
+
+@dataclass(frozen=True)
+class BucketRule:
+    """Bucket shape: up to `capacity` tokens, refilled at `refill_per_second`"""
+    name: str
+    capacity: float
+    refill_per_second: float
+
+    @classmethod
+    def per_minute(cls, name: str, limit: int) -> "BucketRule":
+        return cls(name, float(limit), limit / 60.0)
+
+    @classmethod
+    def per_day(cls, name: str, limit: int) -> "BucketRule":
+        return cls(name, float(limit), limit / 86400.0)
+
+
+@dataclass
+class RateLimitResult:
+    allowed: bool
+    retry_after: float = 0.0  # seconds until the request would be allowed
+    limited_by: Optional[str] = None  # rule name that rejected the request
+    remaining: float = 0.0  # tokens left in the tightest bucket
+
+
+class LocalBucketStore:
+    """In-process buckets: key -> [tokens, last_refill]"""
+
+    # Drop idle (refilled-to-full) buckets every this many checks
+    SWEEP_EVERY = 10000
+
+    def __init__(self):
+        self._buckets: Dict[str, List[float]] = {}
+        self._checks = 0
+
+    def take(self, buckets: List[Tuple[str, BucketRule]], now: float, cost: float = 1.0) -> RateLimitResult:
+        # No awaits in here, so the check-and-debit is atomic on the event loop
+        states = []
+        retry_after = 0.0
+        limited_by = None
+        remaining = math.inf
+        for key, rule in buckets:
+            state = self._buckets.get(key)
+            if state is None:
+                tokens = rule.capacity
+            else:
+                tokens = min(rule.capacity, state[0] + (now - state[1]) * rule.refill_per_second)
+            states.append((key, tokens))
+            if tokens < cost:
+                wait = (cost - tokens) / rule.refill_per_second
+                if wait > retry_after:
+                    retry_after = wait
+                    limited_by = rule.name
+            remaining = min(remaining, tokens - cost)
+
+        self._checks += 1
+        if self._checks % self.SWEEP_EVERY == 0:
+            self._sweep(now)
+
+        if limited_by is not None:
+            return RateLimitResult(False, retry_after, limited_by, 0.0)
+
+        for key, tokens in states:
+            self._buckets[key] = [tokens - cost, now]
+        return RateLimitResult(True, remaining=max(0.0, remaining))
+
+    def _sweep(self, now: float):
+        # A bucket untouched for a full day has refilled under any rule we use
+        stale = [key for key, (_, updated) in self._buckets.items() if now - updated > 86400]
+        for key in stale:
+            del self._buckets[key]
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+# KEYS: bucket keys; ARGV: now, cost, then capacity/refill pairs per key
+# Returns {allowed (0/1), retry_after or remaining (string), index of limiting key}
+TOKEN_BUCKET_LUA = """
+local now = tonumber(ARGV[1])
+local cost = tonumber(ARGV[2])
+local tokens = {}
+local wait = 0
+local limiting = 0
+local remaining = math.huge
+for i = 1, #KEYS do
+    local capacity = tonumber(ARGV[1 + 2 * i])
+    local rate = tonumber(ARGV[2 + 2 * i])
+    local state = redis.call('HMGET', KEYS[i], 't', 'ts')
+    local t = tonumber(state[1])
+    if t == nil then
+        t = capacity
+    else
+        t = math.min(capacity, t + math.max(0, now - tonumber(state[2])) * rate)
+    end
+    tokens[i] = t
+    if t < cost and (cost - t) / rate > wait then
+        wait = (cost - t) / rate
+        limiting = i
+    end
+    remaining = math.min(remaining, t - cost)
+end
+if limiting > 0 then
+    return {0, tostring(wait), limiting}
+end
+for i = 1, #KEYS do
+    local capacity = tonumber(ARGV[1 + 2 * i])
+    local rate = tonumber(ARGV[2 + 2 * i])
+    redis.call('HSET', KEYS[i], 't', tostring(tokens[i] - cost), 'ts', tostring(now))
+    redis.call('PEXPIRE', KEYS[i], math.ceil(capacity / rate * 1000))
+end
+return {1, tostring(math.max(0, remaining)), 0}
+"""
+
+
+class RedisBucketStore:
+    """Buckets shared across workers, debited atomically by a Lua script"""
+
+    def __init__(self, url: str, prefix: str = "fyf:ratelimit:"):
+        self.prefix = prefix
+        self.client = aioredis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self.script = self.client.register_script(TOKEN_BUCKET_LUA)
+        self.errors = 0
+
+    async def take(self, buckets: List[Tuple[str, BucketRule]], now: float, cost: float = 1.0) -> RateLimitResult:
+        keys = [self.prefix + key for key, _ in buckets]
+        args = [now, cost]
+        for _, rule in buckets:
+            args.extend([rule.capacity, rule.refill_per_second])
+        allowed, value, limiting = await self.script(keys=keys, args=args)
+        value = float(value)
+        if int(allowed):
+            return RateLimitResult(True, remaining=value)
+        return RateLimitResult(False, value, buckets[int(limiting) - 1][1].name, 0.0)
+
+
+class RateLimiter:
+    """Per-user / per-IP / global token buckets with a local or Redis store"""
+
+    def __init__(self):
+        self.enabled = settings.RATE_LIMIT_ENABLED
+        self.local = LocalBucketStore()
+        self.redis: Optional[RedisBucketStore] = None
+        if settings.RATE_LIMIT_REDIS_ENABLED:
+            if HAS_REDIS:
+                self.redis = RedisBucketStore(settings.REDIS_URL)
+            else:
+                print("[RATE] WARNING: redis package not installed. Using in-process buckets.")
+
+        # Decoded bearer tokens (token -> (user_id, expires_at)); decoding is the slow part
+        self._token_cache: Dict[str, Tuple[Optional[str], float]] = {}
+
+        self.allowed = 0
+        self.throttled: Dict[str, int] = {}
+
+    async def take(self, buckets: List[Tuple[str, BucketRule]], cost: float = 1.0) -> RateLimitResult:
+        now = time.time()
+        if self.redis is not None:
+            try:
+                return await self.redis.take(buckets, now, cost)
+            except Exception as e:
+                # Fail over to per-process limits rather than failing requests
+                self.redis.errors += 1
+                print(f"[RATE] Redis check failed, using local buckets: {e}")
+        return self.local.take(buckets, now, cost)
+
+    def user_id(self, request: Request) -> Optional[str]:
+        """User id from a valid bearer token ("sub" claim), if any"""
+        authorization = request.headers.get("authorization")
+        if not authorization or not authorization.lower().startswith("bearer "):
+            return None
+        token = authorization[7:].strip()
+
+        cached = self._token_cache.get(token)
+        if cached is not None and cached[1] > time.time():
+            return cached[0]
+        try:
+            claims = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+        except JWTError:
+            return None
+        subject = claims.get("sub") or claims.get("user_id")
+        subject = str(subject) if subject is not None else None
+
+        if len(self._token_cache) >= 10000:
+            self._token_cache.clear()
+        self._token_cache[token] = (subject, float(claims.get("exp", time.time() + 60)))
+        return subject
+
+    @staticmethod
+    def client_ip(request: Request) -> str:
+        if settings.RATE_LIMIT_TRUST_FORWARDED:
+            forwarded = request.headers.get("x-forwarded-for")
+            if forwarded:
+                return forwarded.split(",")[0].strip()
+        return request.client.host if request.client else "unknown"
+
+    def record(self, result: RateLimitResult):
+        if result.allowed:
+            self.allowed += 1
+        else:
+            self.throttled[result.limited_by] = self.throttled.get(result.limited_by, 0) + 1
+
+    def get_stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "store": "redis" if self.redis is not None else "local",
+            "local_buckets": len(self.local),
+            "allowed": self.allowed,
+            "throttled": dict(self.throttled),
+            "redis_errors": self.redis.errors if self.redis else 0,
+        }
+
+
+# Global rate limiter instance
+rate_limiter = RateLimiter()
+
+
+def rate_limit(name: str, per_minute: int, per_day: int = 0, ip_per_minute: int = 0, global_per_minute: int = 0,
+               cost_field: Optional[str] = None):
+    """
+    Build a FastAPI dependency enforcing token buckets for one endpoint group
+
+    A limit of 0 disables that bucket. Throttled requests get 429 with
+    Retry-After; allowed ones get X-RateLimit-Remaining. With `cost_field`
+    a request costs one token per value of that form field (e.g. per image).
+
+    Usage: @router.post("/analyze", dependencies=[Depends(rate_limit("analyze", ...))])
+    """
+    user_minute = BucketRule.per_minute(f"{name}:user_minute", per_minute) if per_minute else None
+    user_day = BucketRule.per_day(f"{name}:user_day", per_day) if per_day else None
+    ip_minute = BucketRule.per_minute(f"{name}:ip_minute", ip_per_minute) if ip_per_minute else None
+    global_minute = BucketRule.per_minute(f"{name}:global_minute", global_per_minute) if global_per_minute else None
+
+    async def dependency(request: Request, response: Response):
+        if not rate_limiter.enabled:
+            return
+
+        ip = rate_limiter.client_ip(request)
+        # Anonymous callers get their "user" buckets keyed by IP
+        user = rate_limiter.user_id(request) or f"ip:{ip}"
+        buckets = []
+        if user_minute:
+            buckets.append((f"{user_minute.name}:{user}", user_minute))
+        if user_day:
+            buckets.append((f"{user_day.name}:{user}", user_day))
+        if ip_minute:
+            buckets.append((f"{ip_minute.name}:{ip}", ip_minute))
+        if global_minute:
+            buckets.append((global_minute.name, global_minute))
+        if not buckets:
+            return
+
+        cost = 1
+        if cost_field:
+            # FastAPI has already parsed (and cached) the form for the endpoint
+            form = await request.form()
+            cost = max(1, len(form.getlist(cost_field)))
+
+        result = await rate_limiter.take(buckets, cost)
+        rate_limiter.record(result)
+        if not result.allowed:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail={
+                    "error": "rate_limited",
+                    "message": "Too many requests. Please slow down.",
+                    "limit": result.limited_by,
+                    "retry_after": round(result.retry_after, 1),
+                },
+                headers={"Retry-After": str(max(1, math.ceil(result.retry_after)))}
+            )
+        response.headers["X-RateLimit-Remaining"] = str(int(result.remaining))
+
+    return dependency
+
+
+# Endpoint group limits
+analyze_rate_limit = rate_limit(
+    "analyze",
+    per_minute=settings.RATE_LIMIT_PER_MINUTE,
+    per_day=settings.RATE_LIMIT_PER_DAY,
+    ip_per_minute=settings.RATE_LIMIT_IP_PER_MINUTE,
+    global_per_minute=settings.RATE_LIMIT_GLOBAL_PER_MINUTE
+)
+analyze_batch_rate_limit = rate_limit(
+    "analyze",
+    per_minute=settings.RATE_LIMIT_PER_MINUTE,
+    per_day=settings.RATE_LIMIT_PER_DAY,
+    ip_per_minute=settings.RATE_LIMIT_IP_PER_MINUTE,
+    global_per_minute=settings.RATE_LIMIT_GLOBAL_PER_MINUTE,
+    cost_field="images"
+)
+chat_rate_limit = rate_limit(
+    "chat",
+    per_minute=settings.RATE_LIMIT_CHAT_PER_MINUTE,
+    ip_per_minute=settings.RATE_LIMIT_IP_PER_MINUTE,
+    global_per_minute=settings.RATE_LIMIT_GLOBAL_PER_MINUTE
+)
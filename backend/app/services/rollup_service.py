@@ -0,0 +1,153 @@
+"""
+Rollup service maintaining per-user daily nutrition totals
+"""
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import delete, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models import DailyNutrition, FoodScan
+
+
+# FoodScan total columns mirrored by DailyNutrition
+NUTRIENT_FIELDS = [
+    "total_calories",
+    "total_protein",
+    "total_carbs",
+    "total_fats",
+    "total_fiber",
+    "total_sugar",
+    "total_sodium",
+]
+
+# Days covered by each summary range (ending on the requested day)
+RANGE_DAYS = {"day": 1, "week": 7, "month": 30}
+
+
+def scan_day(created_at: Optional[datetime]) -> date:
+    """UTC calendar day a scan belongs to"""
+    if created_at is None:
+        return datetime.now(timezone.utc).date()
+    if created_at.tzinfo is not None:
+        created_at = created_at.astimezone(timezone.utc)
+    return created_at.date()
+
+
+class RollupService:
+    """Incrementally maintained daily nutrition rollups"""
+
+    def _upsert_statement(self, db: AsyncSession, rows: List[Dict]):
+        """INSERT ... ON CONFLICT (user_id, day) DO UPDATE adding to the running totals"""
+        dialect = db.get_bind().dialect.name
+        insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        statement = insert(DailyNutrition).values(rows)
+        table = DailyNutrition.__table__
+        increments = {
+            field: table.c[field] + statement.excluded[field]
+            for field in ["scan_count"] + NUTRIENT_FIELDS
+        }
+        return statement.on_conflict_do_update(
+            index_elements=["user_id", "day"],
+            set_=increments
+        )
+
+    async def apply_scan(self, db: AsyncSession, scan: FoodScan, sign: int = 1):
+        """
+        Add (sign=1) or remove (sign=-1) one scan from its day's rollup
+
+        Runs in the caller's transaction so the rollup commits atomically
+        with the scan insert/delete.
+        """
+        await self.apply_scans(db, [scan], sign)
+
+    async def apply_scans(self, db: AsyncSession, scans: List[FoodScan], sign: int = 1):
+        """Apply several scans in one upsert (one row per user and day)"""
+        rows: Dict[Tuple[int, date], Dict] = {}
+        for scan in scans:
+            key = (scan.user_id, scan_day(scan.created_at))
+            row = rows.get(key)
+            if row is None:
+                row = rows[key] = {"user_id": key[0], "day": key[1], "scan_count": 0}
+                row.update({field: 0.0 for field in NUTRIENT_FIELDS})
+            row["scan_count"] += sign
+            for field in NUTRIENT_FIELDS:
+                row[field] += sign * (getattr(scan, field) or 0)
+        if rows:
+            await db.execute(self._upsert_statement(db, list(rows.values())))
+
+    async def get_summary(self, db: AsyncSession, user_id: int, range_name: str,
+                          end_day: Optional[date] = None) -> Dict:
+        """Totals over a day/week/month range plus the per-day breakdown"""
+        end_day = end_day or datetime.now(timezone.utc).date()
+        start_day = end_day - timedelta(days=RANGE_DAYS[range_name] - 1)
+
+        result = await db.execute(
+            select(DailyNutrition)
+            .where(
+                DailyNutrition.user_id == user_id,
+                DailyNutrition.day >= start_day,
+                DailyNutrition.day <= end_day
+            )
+            .order_by(DailyNutrition.day)
+        )
+        days = [row for row in result.scalars().all() if row.scan_count > 0]
+
+        totals = {field: sum(getattr(row, field) for row in days) for field in NUTRIENT_FIELDS}
+        return {
+            "range": range_name,
+            "start_date": start_day,
+            "end_date": end_day,
+            "scan_count": sum(row.scan_count for row in days),
+            **totals,
+            "days": days,
+        }
+
+    async def rebuild(self, db: AsyncSession, chunk_size: int = 1000) -> Tuple[int, int]:
+        """
+        Recompute all rollups from food_scans (backfill / repair)
+
+        Streams scans in id order and aggregates in memory, then replaces
+        the rollup table in one transaction.
+
+        Returns:
+            Tuple of (scans_read, rollup_rows_written)
+        """
+        aggregates: Dict[Tuple[int, date], Dict] = {}
+        scans_read = 0
+        last_id = 0
+        columns = [getattr(FoodScan, field) for field in NUTRIENT_FIELDS]
+
+        while True:
+            result = await db.execute(
+                select(FoodScan.id, FoodScan.user_id, FoodScan.created_at, *columns)
+                .where(FoodScan.id > last_id)
+                .order_by(FoodScan.id)
+                .limit(chunk_size)
+            )
+            rows = result.all()
+            if not rows:
+                break
+            for row in rows:
+                key = (row.user_id, scan_day(row.created_at))
+                aggregate = aggregates.setdefault(
+                    key, {"scan_count": 0, **{field: 0.0 for field in NUTRIENT_FIELDS}}
+                )
+                aggregate["scan_count"] += 1
+                for field in NUTRIENT_FIELDS:
+                    aggregate[field] += getattr(row, field) or 0
+            scans_read += len(rows)
+            last_id = rows[-1].id
+
+        await db.execute(delete(DailyNutrition))
+        new_rows = [
+            {"user_id": user_id, "day": day, **aggregate}
+            for (user_id, day), aggregate in aggregates.items()
+        ]
+        for i in range(0, len(new_rows), chunk_size):
+            await db.execute(self._upsert_statement(db, new_rows[i:i + chunk_size]))
+        await db.commit()
+        return scans_read, len(new_rows)
+
+
+# Global rollup service instance
+rollup_service = RollupService()
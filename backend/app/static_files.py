@@ -0,0 +1,117 @@
+"""
+Static file serving for uploaded images with long-lived caching
+"""
+import os
+import re
+from typing import Optional, Tuple
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Receive, Scope, Send
+from app.config import settings
+
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class FileRangeResponse(Response):
+    """206 Partial Content response for a single byte range of a file"""
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, path: str, start: int, end: int, file_size: int, headers: dict):
+        super().__init__(status_code=206, headers=headers, media_type=headers.get("content-type"))
+        self.path = path
+        self.start = start
+        self.end = end
+        self.headers["content-range"] = f"bytes {start}-{end}/{file_size}"
+        self.headers["content-length"] = str(end - start + 1)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"].upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        remaining = self.end - self.start + 1
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.start)
+            while remaining > 0:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining > 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def parse_range(range_header: str, file_size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single-range `Range` header into inclusive (start, end)
+
+    Returns None for headers we don't handle (multiple ranges, other units),
+    in which case the full file is served. Raises ValueError if unsatisfiable.
+    """
+    match = RANGE_PATTERN.match(range_header.strip())
+    if not match:
+        return None
+
+    first, last = match.groups()
+    if first == "" and last == "":
+        return None
+    if first == "":
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError("Empty suffix range")
+        return max(0, file_size - length), file_size - 1
+
+    start = int(first)
+    end = int(last) if last else file_size - 1
+    if start >= file_size or end < start:
+        raise ValueError("Range not satisfiable")
+    return start, min(end, file_size - 1)
+
+
+class ImmutableStaticFiles(StaticFiles):
+    """
+    StaticFiles for content that never changes once written
+
+    Uploaded images get unique names and are never overwritten, so they are
+    served with `Cache-Control: immutable`, a strong ETag derived from the
+    file name and size, conditional 304s and single byte-range (206) support.
+    """
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+        name = os.path.basename(full_path)
+
+        response = FileResponse(full_path, status_code=status_code, stat_result=stat_result)
+        response.headers["etag"] = f'"{name}-{stat_result.st_size}"'
+        response.headers["cache-control"] = f"public, max-age={settings.IMAGE_CACHE_MAX_AGE}, immutable"
+        response.headers["accept-ranges"] = "bytes"
+
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+
+        range_header = request_headers.get("range")
+        if range_header and status_code == 200:
+            if_range = request_headers.get("if-range")
+            if if_range is None or if_range == response.headers["etag"]:
+                try:
+                    byte_range = parse_range(range_header, stat_result.st_size)
+                except ValueError:
+                    return Response(
+                        status_code=416,
+                        headers={"content-range": f"bytes */{stat_result.st_size}"}
+                    )
+                if byte_range is not None:
+                    headers = {
+                        key: value for key, value in response.headers.items()
+                        if key != "content-length"
+                    }
+                    return FileRangeResponse(str(full_path), *byte_range, stat_result.st_size, headers)
+
+        return response
@@ -0,0 +1,250 @@
+"""
+Background worker pool for queued food analysis jobs
+
+Workers claim jobs from the analysis_jobs table under a lease, run the
+shared analysis pipeline and record the outcome in the same transaction as
+the new FoodScan. The pool runs inside the API process (ANALYSIS_WORKERS > 0)
+or as separate processes that share the database and UPLOAD_DIR, so it can
+be scaled independently of the HTTP tier.
+
+Usage:
+    python -m app.workers.analysis_worker
+    python -m app.workers.analysis_worker --concurrency 8
+"""
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import time
+import uuid
+from typing import Dict, Optional, Set
+from app.config import settings
+from app.database import AsyncSessionLocal, async_engine
+from app.models import AnalysisJob
+from app.services.ai_service import ai_service
+from app.services.analysis_service import analysis_service, LowConfidenceError
+from app.services.food_index import food_index
+from app.services.image_service import image_service
+from app.services.metrics import analysis_stage
+from app.services.job_queue import analysis_jobs, FAILED, SUCCEEDED
+from app.services.phash_index import from_signed64, phash_index, warm_phash_index
+
+
+class AnalysisWorkerPool:
+    """Claims and runs up to `concurrency` analysis jobs at a time"""
+
+    def __init__(self, session_factory, concurrency: int, poll_interval: float,
+                 lease_seconds: float, max_attempts: int, retry_seconds: float,
+                 worker_id: Optional[str] = None):
+        self.session_factory = session_factory
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_seconds = retry_seconds
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+        self._runner: Optional[asyncio.Task] = None
+        self._jobs: Set[asyncio.Task] = set()
+        self._wakeup = asyncio.Event()
+
+        self.stats: Dict[str, int] = {
+            "claimed": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "retried": 0,
+            "lost_leases": 0,
+            "claim_errors": 0,
+        }
+
+    @property
+    def running(self) -> bool:
+        return self._runner is not None and not self._runner.done()
+
+    def start(self):
+        if self.concurrency <= 0 or self.running:
+            return
+        self._runner = asyncio.create_task(self._run())
+        print(f"[JOBS] Analysis worker {self.worker_id} started ({self.concurrency} slots)")
+
+    async def stop(self, timeout: float = 10.0):
+        """Stop claiming, give in-flight jobs `timeout` seconds, then abandon them to their leases"""
+        if self._runner is not None:
+            self._runner.cancel()
+            try:
+                await self._runner
+            except asyncio.CancelledError:
+                pass
+            self._runner = None
+        if self._jobs:
+            _, pending = await asyncio.wait(self._jobs, timeout=timeout)
+            for task in pending:
+                task.cancel()
+
+    def notify(self):
+        """A job was just enqueued in this process: claim now instead of at the next poll"""
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            free = self.concurrency - len(self._jobs)
+            jobs = []
+            if free > 0:
+                try:
+                    async with self.session_factory() as db:
+                        jobs = await analysis_jobs.claim(db, self.worker_id, free, self.lease_seconds)
+                except Exception as e:
+                    self.stats["claim_errors"] += 1
+                    print(f"[JOBS] Claim failed: {e}")
+
+            for job in jobs:
+                self.stats["claimed"] += 1
+                task = asyncio.create_task(self._process(job))
+                self._jobs.add(task)
+                task.add_done_callback(self._job_done)
+
+            if len(self._jobs) >= self.concurrency:
+                # All slots busy; claim again as soon as one frees up
+                await self._wakeup.wait()
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def _job_done(self, task: asyncio.Task):
+        self._jobs.discard(task)
+        self._wakeup.set()
+
+    async def _keep_lease(self, job_id: str):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                async with self.session_factory() as db:
+                    if not await analysis_jobs.renew(db, job_id, self.worker_id, self.lease_seconds):
+                        return
+            except Exception as e:
+                print(f"[JOBS] Lease renewal for {job_id} failed: {e}")
+
+    async def _process(self, job: AnalysisJob):
+        start_time = time.time()
+        heartbeat = asyncio.create_task(self._keep_lease(job.id))
+        try:
+            async with self.session_factory() as db:
+                if job.attempts > self.max_attempts:
+                    await self._fail(db, job, {"error": "too_many_attempts", "message": "Analysis kept failing. Please try another image."})
+                    return
+                try:
+                    phash = from_signed64(job.image_phash) if job.image_phash is not None else None
+                    processed = await image_service.load_image(
+                        job.image_path, phash=phash, model_input_size=ai_service.model_input_size
+                    )
+                    try:
+                        processed.derivative_paths = await image_service.write_derivatives(job.image_path)
+                    except Exception as e:
+                        print(f"[WARN] Writing derivatives for job {job.id} failed: {e}")
+                    food_scan = await analysis_service.create_scan(
+                        db, processed, job.user_id, job.image_url, start_time
+                    )
+                    if not await analysis_jobs.finish(db, job.id, self.worker_id, SUCCEEDED, scan_id=food_scan.id):
+                        # Someone else reclaimed the job; their result wins
+                        await db.rollback()
+                        self.stats["lost_leases"] += 1
+                        return
+                    with analysis_stage("db_commit"):
+                        await db.commit()
+                    analysis_service.index_scan(food_scan, phash)
+                    self.stats["succeeded"] += 1
+                except LowConfidenceError as e:
+                    await db.rollback()
+                    await self._fail(db, job, e.to_detail())
+                except FileNotFoundError:
+                    await db.rollback()
+                    await self._fail(db, job, {"error": "image_missing", "message": "The uploaded image is no longer available."})
+                except Exception as e:
+                    await db.rollback()
+                    await self._retry_or_fail(db, job, e)
+        except Exception as e:
+            # Could not even record the outcome; the lease expires and the job is retried
+            print(f"[JOBS] Job {job.id} crashed: {e}")
+        finally:
+            heartbeat.cancel()
+
+    async def _fail(self, db, job: AnalysisJob, error: Dict):
+        if await analysis_jobs.finish(db, job.id, self.worker_id, FAILED, error=error):
+            await db.commit()
+            self.stats["failed"] += 1
+        else:
+            self.stats["lost_leases"] += 1
+
+    async def _retry_or_fail(self, db, job: AnalysisJob, exc: Exception):
+        error = {"error": "analysis_failed", "message": f"Analysis failed: {str(exc)}"}
+        if job.attempts >= self.max_attempts:
+            print(f"[JOBS] Job {job.id} failed after {job.attempts} attempts: {exc}")
+            await self._fail(db, job, error)
+            return
+        # Exponential backoff: retry_seconds, 2x, 4x, ...
+        retry_in = self.retry_seconds * 2 ** (job.attempts - 1)
+        if await analysis_jobs.finish(db, job.id, self.worker_id, FAILED, error=error, retry_in=retry_in):
+            await db.commit()
+            self.stats["retried"] += 1
+            print(f"[JOBS] Job {job.id} attempt {job.attempts} failed, retrying in {retry_in:.1f}s: {exc}")
+
+    def get_stats(self) -> Dict:
+        return {
+            "worker_id": self.worker_id,
+            "running": self.running,
+            "concurrency": self.concurrency,
+            "in_flight": len(self._jobs),
+            **self.stats,
+        }
+
+
+def create_worker_pool(concurrency: int) -> AnalysisWorkerPool:
+    return AnalysisWorkerPool(
+        AsyncSessionLocal,
+        concurrency=concurrency,
+        poll_interval=settings.ANALYSIS_JOB_POLL_SECONDS,
+        lease_seconds=settings.ANALYSIS_JOB_LEASE_SECONDS,
+        max_attempts=settings.ANALYSIS_JOB_MAX_ATTEMPTS,
+        retry_seconds=settings.ANALYSIS_JOB_RETRY_SECONDS
+    )
+
+
+# In-process worker pool (started with the API when ANALYSIS_WORKERS > 0)
+analysis_workers = create_worker_pool(settings.ANALYSIS_WORKERS)
+
+
+async def main(args):
+    pool = create_worker_pool(args.concurrency)
+
+    # Same lookups the API warms at startup
+    async with AsyncSessionLocal() as db:
+        await food_index.refresh(db)
+        loaded = await warm_phash_index(phash_index, db)
+    print(f"[OK] Near-duplicate index loaded ({loaded} recent scans)")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    pool.start()
+    try:
+        await stop.wait()
+    finally:
+        print("[JOBS] Shutting down, finishing in-flight jobs...")
+        await pool.stop(timeout=args.drain_seconds)
+        await async_engine.dispose()
+    print(f"[OK] Worker stopped: {pool.get_stats()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run food analysis job workers")
+    parser.add_argument("--concurrency", type=int, default=max(1, settings.ANALYSIS_WORKERS),
+                        help="Jobs processed at once by this process")
+    parser.add_argument("--drain-seconds", type=float, default=30.0,
+                        help="Grace period for in-flight jobs on shutdown")
+    asyncio.run(main(parser.parse_args()))